@@ -1,18 +1,44 @@
-from contextlib import asynccontextmanager
+try:
+    # 尽早安装 uvloop 事件循环策略（libuv 实现，对 I/O 密集负载有显著吞吐提升）
+    import uvloop
+    uvloop.install()
+except ImportError:
+    # Windows 或未安装 uvloop 时退回默认事件循环
+    uvloop = None
+
+from contextlib import asynccontextmanager, AsyncExitStack
+
+import orjson
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 
-from app.middleware.node import NodeMiddleware
-from app.middleware.process_time import ProcessTimeMiddleware
-from app.middleware.referer import RefererCheckMiddleware
+from app.middleware.cors import WildcardCORSMiddleware
+from app.middleware.probe import ProbeShortCircuitMiddleware
+from app.middleware.unified import UnifiedMiddleware
 
 from asgi_correlation_id import CorrelationIdMiddleware
 
 from app.routes import router
+from app.routes.healthz import HEALTHZ_BODY, bind_advanced_components, prime_system_sampler, system_sampler_loop
 from app.utils.config import settings
+from app.utils.concurrency_limiter import (
+    AccountTier,
+    ConcurrencyConfig,
+    get_concurrency_limiter,
+)
+from app.utils.warp_optimizer import get_warp_optimizer, WARPOptimizationConfig
+from app.utils.proxy_pool import initialize_proxy_pool, shutdown_proxy_pool
+from app.utils.background_tasks import start_background_tasks, stop_background_tasks
+from app.utils import cf_ranges
+import aiohttp
 import asyncio
+import itertools
 import logging
+import os
+import tempfile
+import time
+from typing import Final
 
 # 配置日志
 logging.basicConfig(
@@ -22,144 +48,226 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# 启动配置为常量，构造一次供每次 lifespan 复用（测试中 lifespan 会反复启停）
+_CONCURRENCY_CFG: Final = ConcurrencyConfig(
+    account_tier=AccountTier.FREE,
+    max_queue_size=50,
+    request_timeout=45.0
+)
+
+_WARP_CFG: Final = WARPOptimizationConfig(
+    target_config_count=8,
+    min_config_count=5,
+    max_config_count=8,
+    config_dir=settings.WARP_CONFIG_DIR,
+    account_tier=AccountTier.FREE
+)
+
+# 多 worker 部署时的 leader 锁文件句柄（保持打开以持有锁）
+_leader_lock_file = None
+
+
+def _acquire_warp_leader_lock() -> bool:
+    """多 worker 部署时通过文件锁选主
+
+    只有拿到锁的 worker 运行 WARP 配置生成和优化循环，避免每个
+    worker 都向 Cloudflare API 注册设备。锁随进程退出自动释放。
+    """
+    global _leader_lock_file
+    try:
+        import fcntl
+    except ImportError:
+        # 非 POSIX 平台没有 fcntl，退回单 worker 假设
+        return True
+
+    lock_path = os.path.join(tempfile.gettempdir(), "ytdlp_warp_leader.lock")
+    try:
+        _leader_lock_file = open(lock_path, "w")
+        fcntl.flock(_leader_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        if _leader_lock_file:
+            _leader_lock_file.close()
+            _leader_lock_file = None
+        return False
+
+
+async def _cancel_tracked_tasks(tasks: set):
+    """取消并等待所有登记的后台任务结束"""
+    pending = [t for t in tasks if not t.done()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    logger.info(f"✅ 已取消 {len(pending)} 个后台任务")
+
+
 # Lifespan context manager for startup and shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """应用生命周期管理器 - 处理启动和关闭事件"""
-    
-    # 存储清理任务的引用
-    cleanup_task = None
-    
-    try:
-        # === 应用启动 ===
-        logger.info("🚀 启动 YTDLP FastAPI 服务...")
-        logger.info(f"📊 直链模式: {'启用' if settings.DIRECT_LINK_MODE else '禁用'}")
-        logger.info(f"🔐 允许的域名: {settings.ALLOWED_HOSTS}")
-        logger.info(f"🔧 WARP 代理: {'启用' if settings.ENABLE_WARP_PROXY else '禁用'}")
-        
-        # 1. 初始化并发控制系统（两种模式都需要）
+    """应用生命周期管理器 - 处理启动和关闭事件
+
+    关闭逻辑通过 AsyncExitStack 在资源创建的同时注册，
+    finally 阶段按 LIFO 顺序统一回收。
+    """
+
+    async with AsyncExitStack() as stack:
+        # 启动期间多处分支用到的配置，只读一次
+        warp_enabled = bool(settings.ENABLE_WARP_PROXY)
+        direct_link_mode = bool(settings.DIRECT_LINK_MODE)
+
         try:
-            from app.utils.concurrency_limiter import get_concurrency_limiter, start_cleanup_task, ConcurrencyConfig, AccountTier
-            
-            concurrency_config = ConcurrencyConfig(
-                account_tier=AccountTier.FREE,
-                max_queue_size=50,
-                request_timeout=45.0
+            # === 应用启动 ===
+            logger.info("🚀 启动 YTDLP FastAPI 服务...")
+            logger.info(f"📊 直链模式: {'启用' if direct_link_mode else '禁用'}")
+            logger.info(f"🔐 允许的域名: {settings.ALLOWED_HOSTS}")
+            logger.info(f"🔧 WARP 代理: {'启用' if warp_enabled else '禁用'}")
+
+            # 全局共享 HTTP 会话：代理健康检查等复用同一连接池，
+            # 避免每次请求重建 TCP+TLS 连接，也防止 FD 泄漏
+            app.state.http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10),
             )
-            limiter = get_concurrency_limiter(concurrency_config)
-            
-            # 启动并发控制清理任务
-            cleanup_task = asyncio.create_task(start_cleanup_task())
-            logger.info("✅ 并发控制系统已启动")
-            
-        except Exception as e:
-            logger.error(f"❌ 并发控制系统初始化失败: {e}")
-            # 并发控制失败不阻止应用启动，但会记录错误
-            logger.warning("⚠️ 并发控制初始化失败，应用将继续运行")
-        
-        # 2. 条件性初始化 WARP 相关组件（仅代理模式）
-        if settings.ENABLE_WARP_PROXY:
-            logger.info("🌐 初始化 WARP 代理系统...")
-            
+            stack.push_async_callback(app.state.http_session.close)
+
+            # 所有在 lifespan 中直接创建的长期任务统一登记到 app.state，
+            # 关闭时批量取消并等待，避免 "Task was destroyed but it is pending"
+            app.state.background_tasks = set()
+            stack.push_async_callback(_cancel_tracked_tasks, app.state.background_tasks)
+
+            def spawn(coro) -> asyncio.Task:
+                task = asyncio.create_task(coro)
+                app.state.background_tasks.add(task)
+                task.add_done_callback(app.state.background_tasks.discard)
+                return task
+
+            # Cloudflare IP 段每日刷新（ip-check 的本地网段判定用）
+            spawn(cf_ranges.ranges_refresh_loop(app.state.http_session))
+
+            # 0. 启动系统指标采样任务（/status 读取缓存而非阻塞采样）
             try:
-                from app.utils.warp_optimizer import get_warp_optimizer, WARPOptimizationConfig
-                from app.utils.proxy_pool import initialize_proxy_pool, shutdown_proxy_pool
-                
-                # 初始化 WARP 优化器
-                warp_opt_config = WARPOptimizationConfig(
-                    target_config_count=8,
-                    min_config_count=5,
-                    max_config_count=8,
-                    config_dir=settings.WARP_CONFIG_DIR,
-                    account_tier=AccountTier.FREE
-                )
-                optimizer = get_warp_optimizer(warp_opt_config)
-                
-                # 初始化 WARP 配置
-                init_result = await optimizer.initialize()
-                logger.info(f"✅ WARP 配置初始化完成: {init_result}")
-                
-                # 启动优化循环
-                await optimizer.start_optimization_loop()
-                logger.info("✅ WARP 优化循环已启动")
-                
-                # 初始化 WARP 代理池
-                await initialize_proxy_pool(
-                    config_dir=settings.WARP_CONFIG_DIR,
-                    health_check_interval=settings.PROXY_HEALTH_CHECK_INTERVAL
-                )
-                logger.info("✅ WARP 代理池已初始化")
-                
+                prime_system_sampler()
+                spawn(system_sampler_loop())
+                logger.info("✅ 系统指标采样任务已启动")
             except Exception as e:
-                logger.error(f"❌ WARP 代理系统初始化失败: {e}")
-                # 在直链模式下，WARP 失败不应该阻止应用启动
-                if not settings.DIRECT_LINK_MODE:
-                    raise
-                else:
-                    logger.warning("⚠️ WARP 初始化失败，继续使用直链模式")
-        else:
-            logger.info("🔄 跳过 WARP 代理初始化（直链模式）")
-        
-        # 3. 启动后台任务（条件性）
-        try:
-            from app.utils.background_tasks import start_background_tasks, stop_background_tasks
-            await start_background_tasks()
-            logger.info("✅ 后台任务已启动")
+                logger.error(f"❌ 系统指标采样任务启动失败: {e}")
+
+            # 1. 初始化并发控制系统（两种模式都需要）
+            try:
+                limiter = get_concurrency_limiter(_CONCURRENCY_CFG)
+
+                # 过期请求清理并入 background_tasks 的统一清理循环
+                logger.info("✅ 并发控制系统已启动")
+
+            except Exception as e:
+                logger.error(f"❌ 并发控制系统初始化失败: {e}")
+                # 并发控制失败不阻止应用启动，但会记录错误
+                logger.warning("⚠️ 并发控制初始化失败，应用将继续运行")
+
+            # 2. 条件性初始化 WARP 相关组件（仅代理模式）
+            async def init_warp_system():
+                if not warp_enabled:
+                    logger.info("🔄 跳过 WARP 代理初始化（直链模式）")
+                    return
+
+                logger.info("🌐 初始化 WARP 代理系统...")
+
+                try:
+                    # 初始化 WARP 优化器
+                    optimizer = get_warp_optimizer(_WARP_CFG)
+
+                    # 多 worker 下只有 leader 负责配置生成和优化循环，
+                    # 其余 worker 直接从磁盘加载配置初始化代理池
+                    if _acquire_warp_leader_lock():
+                        # 初始化 WARP 配置
+                        init_result = await optimizer.initialize()
+                        logger.info(f"✅ WARP 配置初始化完成: {init_result}")
+
+                        # 启动优化循环
+                        await optimizer.start_optimization_loop()
+                        stack.push_async_callback(_stop_warp_optimizer)
+                        logger.info("✅ WARP 优化循环已启动")
+                    else:
+                        logger.info("ℹ️ 非 leader worker，跳过 WARP 配置生成与优化循环")
+
+                    # 初始化 WARP 代理池
+                    await initialize_proxy_pool(
+                        config_dir=settings.WARP_CONFIG_DIR,
+                        health_check_interval=settings.PROXY_HEALTH_CHECK_INTERVAL,
+                        http_session=app.state.http_session,
+                        max_check_concurrency=8
+                    )
+                    stack.push_async_callback(_shutdown_proxy_pool)
+                    logger.info("✅ WARP 代理池已初始化")
+
+                except Exception as e:
+                    logger.error(f"❌ WARP 代理系统初始化失败: {e}")
+                    # 在直链模式下，WARP 失败不应该阻止应用启动
+                    if not direct_link_mode:
+                        raise
+                    else:
+                        logger.warning("⚠️ WARP 初始化失败，继续使用直链模式")
+
+            # 3. 启动后台任务（条件性）
+            async def init_background_tasks():
+                try:
+                    await start_background_tasks()
+                    stack.push_async_callback(_stop_background_tasks)
+                    logger.info("✅ 后台任务已启动")
+                except Exception as e:
+                    logger.error(f"❌ 后台任务启动失败: {e}")
+                    # 后台任务失败不应该阻止应用启动
+                    logger.warning("⚠️ 后台任务启动失败，应用将继续运行")
+
+            # WARP 初始化和后台任务相互独立，并发执行以缩短冷启动时间
+            await asyncio.gather(init_warp_system(), init_background_tasks())
+
+            # 组件初始化完成后，缓存单例引用供状态端点直接读取
+            bind_advanced_components(http_session=app.state.http_session)
+
+            logger.info("🎉 YTDLP FastAPI 服务启动完成!")
+
         except Exception as e:
-            logger.error(f"❌ 后台任务启动失败: {e}")
-            # 后台任务失败不应该阻止应用启动
-            logger.warning("⚠️ 后台任务启动失败，应用将继续运行")
-        
-        logger.info("🎉 YTDLP FastAPI 服务启动完成!")
-        
+            logger.error(f"💥 应用启动失败: {e}")
+            raise
+
         # === 应用运行期间 ===
         yield
-        
-    except Exception as e:
-        logger.error(f"💥 应用启动失败: {e}")
-        raise
-    
-    finally:
+
         # === 应用关闭 ===
         logger.info("🛑 关闭 YTDLP FastAPI 服务...")
-        
-        # 1. 停止并发控制清理任务
-        if cleanup_task:
-            cleanup_task.cancel()
-            try:
-                await cleanup_task
-            except asyncio.CancelledError:
-                pass
-            logger.info("✅ 并发控制任务已停止")
-        
-        # 2. 停止后台任务
-        try:
-            from app.utils.background_tasks import stop_background_tasks
-            await stop_background_tasks()
-            logger.info("✅ 后台任务已停止")
-        except Exception as e:
-            logger.error(f"❌ 后台任务停止失败: {e}")
-        
-        # 3. 条件性关闭 WARP 相关组件
-        if settings.ENABLE_WARP_PROXY:
-            try:
-                from app.utils.warp_optimizer import get_warp_optimizer
-                from app.utils.proxy_pool import shutdown_proxy_pool
-                
-                # 停止 WARP 优化循环
-                optimizer = get_warp_optimizer()
-                if optimizer:
-                    await optimizer.stop_optimization_loop()
-                    logger.info("✅ WARP 优化循环已停止")
-                
-                # 关闭代理池
-                await shutdown_proxy_pool()
-                logger.info("✅ WARP 代理池已关闭")
-                
-            except Exception as e:
-                logger.error(f"❌ WARP 系统关闭失败: {e}")
-        
-        logger.info("👋 YTDLP FastAPI 服务已完全关闭")
+
+    logger.info("👋 YTDLP FastAPI 服务已完全关闭")
+
+
+async def _stop_background_tasks():
+    """停止后台任务（lifespan 关闭回调）"""
+    try:
+        await stop_background_tasks()
+        logger.info("✅ 后台任务已停止")
+    except Exception as e:
+        logger.error(f"❌ 后台任务停止失败: {e}")
+
+
+async def _stop_warp_optimizer():
+    """停止 WARP 优化循环（lifespan 关闭回调）"""
+    try:
+        optimizer = get_warp_optimizer()
+        if optimizer:
+            await optimizer.stop_optimization_loop()
+            logger.info("✅ WARP 优化循环已停止")
+    except Exception as e:
+        logger.error(f"❌ WARP 优化循环停止失败: {e}")
+
+
+async def _shutdown_proxy_pool():
+    """关闭 WARP 代理池（lifespan 关闭回调）"""
+    try:
+        await shutdown_proxy_pool()
+        logger.info("✅ WARP 代理池已关闭")
+    except Exception as e:
+        logger.error(f"❌ WARP 代理池关闭失败: {e}")
 
 # 解析允许的主机
 try:
@@ -177,15 +285,18 @@ except Exception as e:
     allowed_hosts = ["*"]  # 失败时的默认值
 
 # 初始化 FastAPI 应用
+_docs_disabled = bool(settings.DISABLE_DOCS)
+
 try:
     app = FastAPI(
         title="YTDLP FastAPI",
         description="高性能 YouTube 视频解析 API - 支持智能并发控制和 WARP 代理优化",
         version="2.0.0",
         lifespan=lifespan,
-        docs_url="/" if not bool(settings.DISABLE_DOCS) else None,
-        redoc_url="/redoc" if not bool(settings.DISABLE_DOCS) else None,
-        openapi_url=None if bool(settings.DISABLE_DOCS) else "/openapi.json"
+        default_response_class=ORJSONResponse,
+        docs_url="/" if not _docs_disabled else None,
+        redoc_url="/redoc" if not _docs_disabled else None,
+        openapi_url=None if _docs_disabled else "/openapi.json"
     )
     
     logger.info("✅ FastAPI 应用初始化成功")
@@ -196,28 +307,28 @@ except Exception as e:
 
 # 添加中间件（带错误处理）
 try:
-    # CORS 中间件
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # 在生产环境中应该设置具体的域名
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
+    # CORS 中间件（全通配场景，静态响应头 + 预检直接 204）
+    app.add_middleware(WildcardCORSMiddleware)
     
-    # 信任主机中间件
-    app.add_middleware(
-        TrustedHostMiddleware,
-        allowed_hosts=allowed_hosts
-    )
+    # 信任主机中间件（全通配时等于无条件放行，直接不挂载省掉每请求的 Host 匹配）
+    if allowed_hosts != ["*"]:
+        app.add_middleware(
+            TrustedHostMiddleware,
+            allowed_hosts=allowed_hosts
+        )
     
     # 请求追踪中间件
-    app.add_middleware(CorrelationIdMiddleware)
+    # 默认的 uuid4 生成器每请求要取 16 字节系统随机数；追踪 ID 只需唯一不需随机，
+    # 用 PID + 纳秒时间戳起始的计数器即可（多 worker 下也不会撞）
+    _PID = os.getpid()
+    _COUNTER = itertools.count(time.time_ns())
+    app.add_middleware(
+        CorrelationIdMiddleware,
+        generator=lambda: f"{_PID:x}{next(_COUNTER):016x}",
+    )
     
-    # 自定义中间件
-    app.add_middleware(ProcessTimeMiddleware)
-    app.add_middleware(NodeMiddleware)
-    app.add_middleware(RefererCheckMiddleware)
+    # 自定义中间件（referer 校验 + 节点标识 + 耗时统计合并为一层）
+    app.add_middleware(UnifiedMiddleware)
     
     logger.info("✅ 中间件配置完成")
     
@@ -234,14 +345,30 @@ except Exception as e:
     raise
 
 # 健康检查端点
+# 响应内容只依赖启动时的配置，预序列化一次即可
+_HEALTH_BODY = orjson.dumps({
+    "status": "healthy",
+    "service": "YTDLP FastAPI",
+    "mode": "direct" if settings.DIRECT_LINK_MODE else "proxy",
+    "warp_enabled": bool(settings.ENABLE_WARP_PROXY)
+})
+
+_HEALTH_RESPONSE = Response(
+    content=_HEALTH_BODY,
+    media_type="application/json",
+)
+
+
 @app.get("/health", include_in_schema=False)
 async def health_check():
-    """简单的健康检查端点"""
-    return {
-        "status": "healthy",
-        "service": "YTDLP FastAPI",
-        "mode": "direct" if settings.DIRECT_LINK_MODE else "proxy",
-        "warp_enabled": bool(settings.ENABLE_WARP_PROXY)
-    }
+    """简单的健康检查端点（返回预序列化的缓存响应）"""
+    return _HEALTH_RESPONSE
+
+
+# 探活短路中间件：最后注册即最外层，probe 流量不再穿过整个中间件栈
+app.add_middleware(
+    ProbeShortCircuitMiddleware,
+    responses={"/health": _HEALTH_BODY, "/healthz": HEALTHZ_BODY},
+)
 
 logger.info("🚀 YTDLP FastAPI 应用配置完成，等待启动...")
@@ -0,0 +1,47 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# The API is open to any origin and uses no cookies, so the CORS response
+# is identical for every request and can be built once at import time.
+_CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"*"),
+    (b"access-control-allow-headers", b"*"),
+    (b"access-control-max-age", b"86400"),
+]
+
+
+class WildcardCORSMiddleware:
+    """
+    Pure-ASGI replacement for CORSMiddleware for the wildcard-origin case.
+
+    Appends a static set of CORS headers to every response and answers
+    preflight OPTIONS requests directly with 204, skipping per-request
+    origin matching and header construction entirely.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Short-circuit preflight requests before they reach the router
+        if scope["method"] == "OPTIONS":
+            headers = dict(scope["headers"])
+            if b"access-control-request-method" in headers:
+                await send({
+                    "type": "http.response.start",
+                    "status": 204,
+                    "headers": _CORS_HEADERS,
+                })
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        async def send_with_cors(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + _CORS_HEADERS
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
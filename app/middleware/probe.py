@@ -0,0 +1,33 @@
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class ProbeShortCircuitMiddleware:
+    """
+    Outermost middleware answering liveness probes before the rest of the
+    middleware stack and routing run.
+
+    Railway / load-balancer probes hit /health and /healthz at a steady
+    rate; their responses are static, so serving pre-serialized bytes here
+    skips CORS, correlation-ID and referer processing for every probe.
+    """
+
+    def __init__(self, app: ASGIApp, responses: dict[str, bytes]) -> None:
+        self.app = app
+        self.responses = responses
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            body = self.responses.get(scope["path"])
+            if body is not None:
+                await send({
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode("latin-1")),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        await self.app(scope, receive, send)
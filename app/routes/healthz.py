@@ -4,16 +4,19 @@
 """
 
 import logging
+import orjson
 import psutil
 import time
 import asyncio
 import aiohttp
-import yt_dlp
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
+
+from app.utils.hc_cache import get_or_set
+from app.utils import cf_ranges, ytdlp_pool
 
 # 导入新的组件（如果启用）
 try:
@@ -34,127 +37,237 @@ except ImportError:
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 按秒缓存的 ISO 时间戳：datetime.now().isoformat() 每次调用都要
+# 取时区、构造对象再格式化；状态端点只需要秒级精度，同一秒内复用
+_TS: Tuple[int, str] = (0, "")
+
+
+def iso_now() -> str:
+    """返回当前 ISO 格式时间戳（秒级精度，同一秒内返回缓存值）"""
+    global _TS
+    now = int(time.time())
+    if now != _TS[0]:
+        _TS = (now, datetime.now().isoformat())
+    return _TS[1]
+
+# 高级组件引用缓存（启动时绑定一次，状态端点不再每次请求做单例查找）
+_limiter = None
+_optimizer = None
+# lifespan 创建的共享 HTTP 会话：连接和 DNS 解析跨请求复用
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+def bind_advanced_components(http_session: Optional[aiohttp.ClientSession] = None):
+    """在应用启动完成后绑定单例引用
+
+    必须在 lifespan 完成组件初始化之后调用，确保拿到的是
+    带有启动配置的实例而不是默认配置的新实例。
+    """
+    global _limiter, _optimizer, _http_session
+    if ADVANCED_FEATURES_AVAILABLE:
+        _limiter = get_concurrency_limiter()
+        _optimizer = get_warp_optimizer()
+    _http_session = http_session
+
+# 系统指标采样缓存
+# psutil.cpu_percent(interval=1) 会阻塞事件循环整整1秒，
+# 改为后台任务周期性采样，/status 只读取缓存值
+_SYSTEM_SAMPLE_INTERVAL = 2.0
+# 磁盘用量变化慢，且 statvfs 在 fuse/overlay 文件系统上可能卡顿，降频采样
+_DISK_SAMPLE_INTERVAL = 10.0
+_system_sample: Dict[str, Any] = {
+    "cpu_percent": 0.0,
+    "memory": None,
+    "disk": None,
+}
+
+
+def prime_system_sampler():
+    """预热 CPU 采样（首次 interval=None 调用固定返回 0.0，需要先调用一次）"""
+    psutil.cpu_percent(interval=None)
+
+
+async def system_sampler_loop():
+    """后台采样循环 - 周期性刷新 CPU/内存/磁盘指标缓存"""
+    next_disk_sample = 0.0
+    while True:
+        try:
+            _system_sample["cpu_percent"] = psutil.cpu_percent(interval=None)
+            _system_sample["memory"] = psutil.virtual_memory()
+            now = time.monotonic()
+            if now >= next_disk_sample:
+                # statvfs 放到线程池，避免慢速文件系统卡住事件循环
+                _system_sample["disk"] = await asyncio.to_thread(psutil.disk_usage, '/')
+                next_disk_sample = now + _DISK_SAMPLE_INTERVAL
+        except Exception as e:
+            logger.error(f"系统指标采样失败: {e}")
+        await asyncio.sleep(_SYSTEM_SAMPLE_INTERVAL)
+
+
+# /healthz 响应内容固定，预序列化一次，探活流量不再走每请求的 JSON 编码
+HEALTHZ_BODY = orjson.dumps({"status": "healthy", "message": "Service is running"})
+
+_HEALTHZ_RESPONSE = Response(
+    content=HEALTHZ_BODY,
+    media_type="application/json",
+    headers={"Cache-Control": "max-age=60"},
+)
+
 
 @router.get("/healthz", summary="健康检查", tags=["Health"])
 async def health_check():
-    """基本健康检查"""
-    return {"status": "healthy", "message": "Service is running"}
+    """基本健康检查（返回预序列化的常量响应）"""
+    return _HEALTHZ_RESPONSE
+
+
+# IP 检测服务列表（模块级常量，每次请求复用）
+_IP_SERVICES = (
+    "https://api.ipify.org?format=json",
+    "https://httpbin.org/ip",
+    "https://api.myip.com",
+    "https://ipapi.co/json/",
+)
+
+
+async def _probe_ip_service(session: aiohttp.ClientSession, service_url: str) -> Dict[str, Any]:
+    """探测单个 IP 检测服务，返回统一的结果结构"""
+    try:
+        async with session.get(service_url) as response:
+            if response.status == 200:
+                data = await response.json()
+
+                # 不同服务的 IP 字段名不同
+                ip = data.get('ip') or data.get('origin')
+
+                if ip:
+                    return {
+                        "service": service_url,
+                        "ip": ip,
+                        "status": "success",
+                        "data": data
+                    }
+                return {
+                    "service": service_url,
+                    "status": "error",
+                    "error": "无法解析 IP 字段"
+                }
+            return {
+                "service": service_url,
+                "status": "error",
+                "error": f"HTTP {response.status}"
+            }
+    except Exception as e:
+        return {
+            "service": service_url,
+            "status": "error",
+            "error": str(e)
+        }
+
+
+async def _probe_cloudflare_trace(session: aiohttp.ClientSession) -> Tuple[bool, str]:
+    """通过 Cloudflare trace 服务判断 WARP 是否生效"""
+    try:
+        async with session.get("https://1.1.1.1/cdn-cgi/trace",
+                               timeout=aiohttp.ClientTimeout(total=5)) as response:
+            if response.status == 200:
+                trace_data = await response.text()
+                # trace 是 k=v 行格式，单次遍历解析出 warp 字段即可，
+                # 不必对整个响应体做两次 lower() 子串扫描
+                trace = dict(
+                    line.split('=', 1) for line in trace_data.splitlines() if '=' in line
+                )
+                if trace.get('warp', '').lower() in ('on', 'plus'):
+                    return True, "WARP detected via trace"
+                return False, "No WARP detected"
+            return False, f"Trace service error: {response.status}"
+    except Exception as e:
+        return False, f"Trace check failed: {e}"
+
+
+async def _check_warp_via_ranges(session: aiohttp.ClientSession,
+                                 successful_ips: list) -> Tuple[bool, str]:
+    """先做本地 Cloudflare 网段匹配，必要时才用 trace 确认
+
+    出口 IP 不在 Cloudflare 段内时直接判定 WARP 未生效，省掉一次
+    对 1.1.1.1 的 HTTP 往返；在段内时再用 trace 确认 warp=on。
+    """
+    if successful_ips and not any(cf_ranges.is_cf(ip) for ip in successful_ips):
+        return False, "Egress IP not in Cloudflare ranges (local check)"
+    return await _probe_cloudflare_trace(session)
+
+
+async def _do_ip_check() -> Dict[str, Any]:
+    """执行一次真实的出口 IP 探测"""
+    # 四个 IP 探测相互独立，并发发出：
+    # 总耗时从各服务延迟之和降为其中最慢的一个
+    if _http_session and not _http_session.closed:
+        # 共享会话：keep-alive 复用套接字，DNS 结果命中连接器缓存
+        results = await asyncio.gather(
+            *(_probe_ip_service(_http_session, url) for url in _IP_SERVICES)
+        )
+        successful_ips = [r["ip"] for r in results if r.get("ip")]
+        is_cloudflare_ip, cloudflare_check = await _check_warp_via_ranges(
+            _http_session, successful_ips
+        )
+    else:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            results = await asyncio.gather(
+                *(_probe_ip_service(session, url) for url in _IP_SERVICES)
+            )
+            successful_ips = [r["ip"] for r in results if r.get("ip")]
+            is_cloudflare_ip, cloudflare_check = await _check_warp_via_ranges(
+                session, successful_ips
+            )
+
+    return {
+        "timestamp": iso_now(),
+        "container_ips": {
+            "results": results,
+            "successful_ips": successful_ips,
+            "unique_ips": list(set(successful_ips)),
+            "total_services": len(_IP_SERVICES),
+            "successful_services": len(successful_ips)
+        },
+        "warp_analysis": {
+            "is_cloudflare_ip": is_cloudflare_ip,
+            "check_method": cloudflare_check,
+            "warp_status": "ACTIVE" if is_cloudflare_ip else "INACTIVE"
+        },
+        "recommendation": "WARP 生效" if is_cloudflare_ip else "WARP 可能未生效，检查配置"
+    }
 
 
 @router.get("/ip-check", summary="IP 地址检测", tags=["Network"])
-async def check_ip_address():
+async def check_ip_address(refresh: int = 0):
     """
     检测容器的真实出口 IP 地址
     用于验证 WARP 是否生效（Cloudflare IP 段表示 WARP 生效）
+
+    结果缓存 60 秒，带 ?refresh=1 可强制重新探测
     """
     try:
-        # 多个 IP 检测服务
-        ip_services = [
-            "https://api.ipify.org?format=json",
-            "https://httpbin.org/ip",
-            "https://api.myip.com",
-            "https://ipapi.co/json/",
-        ]
-        
-        results = []
-        
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            for service_url in ip_services:
-                try:
-                    async with session.get(service_url) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            
-                            # 不同服务的 IP 字段名不同
-                            ip = None
-                            if 'ip' in data:
-                                ip = data['ip']
-                            elif 'origin' in data:
-                                ip = data['origin']
-                            
-                            if ip:
-                                results.append({
-                                    "service": service_url,
-                                    "ip": ip,
-                                    "status": "success",
-                                    "data": data
-                                })
-                            else:
-                                results.append({
-                                    "service": service_url,
-                                    "status": "error",
-                                    "error": "无法解析 IP 字段"
-                                })
-                        else:
-                            results.append({
-                                "service": service_url,
-                                "status": "error",
-                                "error": f"HTTP {response.status}"
-                            })
-                except Exception as e:
-                    results.append({
-                        "service": service_url,
-                        "status": "error",
-                        "error": str(e)
-                    })
-        
-        # 提取成功获取的 IP
-        successful_ips = [r["ip"] for r in results if r.get("ip")]
-        
-        # 检查是否为 Cloudflare IP 段
-        is_cloudflare_ip = False
-        cloudflare_check = "unknown"
-        
-        if successful_ips:
-            # 使用第一个成功的 IP 进行 Cloudflare 检查
-            test_ip = successful_ips[0]
-            try:
-                # Cloudflare 的 IP 段检查
-                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-                    # 使用 Cloudflare 的 trace 服务
-                    async with session.get("https://1.1.1.1/cdn-cgi/trace") as response:
-                        if response.status == 200:
-                            trace_data = await response.text()
-                            if "warp=on" in trace_data.lower() or "warp=plus" in trace_data.lower():
-                                is_cloudflare_ip = True
-                                cloudflare_check = "WARP detected via trace"
-                            else:
-                                cloudflare_check = "No WARP detected"
-                        else:
-                            cloudflare_check = f"Trace service error: {response.status}"
-            except Exception as e:
-                cloudflare_check = f"Trace check failed: {e}"
-        
-        return {
-            "timestamp": datetime.now().isoformat(),
-            "container_ips": {
-                "results": results,
-                "successful_ips": successful_ips,
-                "unique_ips": list(set(successful_ips)),
-                "total_services": len(ip_services),
-                "successful_services": len(successful_ips)
-            },
-            "warp_analysis": {
-                "is_cloudflare_ip": is_cloudflare_ip,
-                "check_method": cloudflare_check,
-                "warp_status": "ACTIVE" if is_cloudflare_ip else "INACTIVE"
-            },
-            "recommendation": "WARP 生效" if is_cloudflare_ip else "WARP 可能未生效，检查配置"
-        }
-        
+        body, hit = await get_or_set("ip-check", 60, _do_ip_check, refresh=bool(refresh))
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"Cache-Control": "max-age=60", "X-Cache": "HIT" if hit else "MISS"},
+        )
     except Exception as e:
         logger.error(f"IP 检查失败: {e}")
         raise HTTPException(status_code=500, detail=f"IP 检查失败: {str(e)}")
 
 
 @router.get("/warp-test", summary="WARP 连接测试", tags=["Network"])
-async def test_warp_connection():
+async def test_warp_connection(refresh: int = 0):
     """
     使用 yt-dlp 测试 WARP 代理连接
     模拟真实的视频解析请求来验证 WARP 是否正常工作
+
+    测试结果缓存 120 秒（每次测试都会真实解析一次 YouTube），
+    带 ?refresh=1 可强制重测
     """
     if not WARP_AVAILABLE:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=503,
             content={
                 "status": "unavailable",
@@ -162,71 +275,82 @@ async def test_warp_connection():
                 "reason": "Missing WARP dependencies"
             }
         )
-    
+
     try:
-        results = {
-            "timestamp": datetime.now().isoformat(),
-            "tests": [],
-            "summary": {}
-        }
-        
-        # 测试 1: 无代理的直接连接
-        logger.info("测试无代理连接...")
-        direct_result = await _test_ytdlp_connection(None, "direct")
-        results["tests"].append(direct_result)
-        
-        # 测试 2: 使用 WARP 代理连接
-        if WARP_AVAILABLE:
-            proxy_pool = get_proxy_pool()
-            if proxy_pool:
-                logger.info("测试 WARP 代理连接...")
-                
-                # 获取最佳代理
-                proxy_info = await proxy_pool.get_best_proxy()
-                if proxy_info:
-                    warp_result = await _test_ytdlp_connection(proxy_info.url, "warp")
-                    results["tests"].append(warp_result)
-                    
-                    # 释放代理
-                    await proxy_pool.release_proxy(proxy_info, success=warp_result["success"])
-                else:
-                    results["tests"].append({
-                        "test_type": "warp",
-                        "success": False,
-                        "error": "无可用的 WARP 代理",
-                        "proxy_used": None
-                    })
-            else:
-                results["tests"].append({
-                    "test_type": "warp",
-                    "success": False,
-                    "error": "WARP 代理池未初始化",
-                    "proxy_used": None
-                })
-        
-        # 生成摘要
-        successful_tests = [t for t in results["tests"] if t.get("success")]
-        failed_tests = [t for t in results["tests"] if not t.get("success")]
-        
-        results["summary"] = {
-            "total_tests": len(results["tests"]),
-            "successful": len(successful_tests),
-            "failed": len(failed_tests),
-            "warp_working": any(t["test_type"] == "warp" and t["success"] for t in results["tests"]),
-            "direct_working": any(t["test_type"] == "direct" and t["success"] for t in results["tests"]),
-            "recommendation": _get_warp_recommendation(results["tests"])
-        }
-        
-        return results
-        
+        body, hit = await get_or_set("warp-test", 120, _do_warp_test, refresh=bool(refresh))
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"Cache-Control": "max-age=120", "X-Cache": "HIT" if hit else "MISS"},
+        )
     except Exception as e:
         logger.error(f"WARP 连接测试失败: {e}")
         raise HTTPException(status_code=500, detail=f"WARP 测试失败: {str(e)}")
 
 
+async def _do_warp_test() -> Dict[str, Any]:
+    """执行一次真实的 WARP 连接测试（直连 + 代理各解析一次）"""
+    results = {
+        "timestamp": iso_now(),
+        "tests": [],
+        "summary": {}
+    }
+
+    # 测试 1: 无代理的直接连接
+    logger.info("测试无代理连接...")
+    direct_result = await _test_ytdlp_connection(None, "direct")
+    results["tests"].append(direct_result)
+
+    # 测试 2: 使用 WARP 代理连接
+    proxy_pool = get_proxy_pool()
+    if proxy_pool:
+        logger.info("测试 WARP 代理连接...")
+
+        # 获取最佳代理
+        proxy_info = await proxy_pool.get_best_proxy()
+        if proxy_info:
+            warp_result = await _test_ytdlp_connection(proxy_info.url, "warp")
+            results["tests"].append(warp_result)
+
+            # 释放代理
+            await proxy_pool.release_proxy(proxy_info, success=warp_result["success"])
+        else:
+            results["tests"].append({
+                "test_type": "warp",
+                "success": False,
+                "error": "无可用的 WARP 代理",
+                "proxy_used": None
+            })
+    else:
+        results["tests"].append({
+            "test_type": "warp",
+            "success": False,
+            "error": "WARP 代理池未初始化",
+            "proxy_used": None
+        })
+
+    # 生成摘要
+    successful_tests = [t for t in results["tests"] if t.get("success")]
+    failed_tests = [t for t in results["tests"] if not t.get("success")]
+
+    results["summary"] = {
+        "total_tests": len(results["tests"]),
+        "successful": len(successful_tests),
+        "failed": len(failed_tests),
+        "warp_working": any(t["test_type"] == "warp" and t["success"] for t in results["tests"]),
+        "direct_working": any(t["test_type"] == "direct" and t["success"] for t in results["tests"]),
+        "recommendation": _get_warp_recommendation(results["tests"])
+    }
+
+    return results
+
+
+# Rick Roll - 稳定的测试视频
+_TEST_VIDEO_ID = "dQw4w9WgXcQ"
+
+
 async def _test_ytdlp_connection(proxy_url: str = None, test_type: str = "unknown") -> Dict[str, Any]:
     """使用 yt-dlp 测试连接"""
-    test_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"  # Rick Roll - 稳定的测试视频
     start_time = time.time()
     
     try:
@@ -241,14 +365,12 @@ async def _test_ytdlp_connection(proxy_url: str = None, test_type: str = "unknow
         
         if proxy_url:
             ydl_opts['proxy'] = proxy_url
-        
-        # 在线程池中运行 yt-dlp
-        loop = asyncio.get_event_loop()
-        info = await loop.run_in_executor(
-            None,
-            lambda: yt_dlp.YoutubeDL(ydl_opts).extract_info(test_url, download=False)
+
+        # 连通性测试要求真实出网，跳过缓存但仍走专用线程池
+        info = await ytdlp_pool.extract(
+            _TEST_VIDEO_ID, ydl_opts, proxy=proxy_url, use_cache=False
         )
-        
+
         processing_time = time.time() - start_time
         
         if info and info.get('title'):
@@ -302,11 +424,48 @@ def _get_warp_recommendation(tests: list) -> str:
         return "❌ 所有连接都失败，检查网络和配置"
 
 
+async def _do_warp_status() -> Dict[str, Any]:
+    """收集 WARP 配置和代理池状态"""
+    status = {
+        "timestamp": iso_now(),
+        "warp_manager": {},
+        "proxy_pool": {},
+        "config_files": []
+    }
+
+    # WARP 管理器状态
+    try:
+        warp_manager = get_warp_manager()
+        manager_status = warp_manager.get_status()
+        status["warp_manager"] = manager_status
+
+        # 获取配置文件详情
+        configs = warp_manager.list_configs()
+        status["config_files"] = configs
+
+    except Exception as e:
+        status["warp_manager"] = {"error": str(e)}
+
+    # 代理池状态
+    try:
+        proxy_pool = get_proxy_pool()
+        if proxy_pool:
+            pool_status = proxy_pool.get_pool_status()
+            status["proxy_pool"] = pool_status
+        else:
+            status["proxy_pool"] = {"status": "not_initialized"}
+
+    except Exception as e:
+        status["proxy_pool"] = {"error": str(e)}
+
+    return status
+
+
 @router.get("/warp-status", summary="WARP 状态详情", tags=["Network"])
-async def get_warp_status():
-    """获取 WARP 配置和代理池状态"""
+async def get_warp_status(refresh: int = 0):
+    """获取 WARP 配置和代理池状态（缓存 30 秒，?refresh=1 强制刷新）"""
     if not WARP_AVAILABLE:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=503,
             content={
                 "status": "unavailable",
@@ -314,58 +473,43 @@ async def get_warp_status():
                 "reason": "Missing WARP dependencies"
             }
         )
-    
+
     try:
-        status = {
-            "timestamp": datetime.now().isoformat(),
-            "warp_manager": {},
-            "proxy_pool": {},
-            "config_files": []
-        }
-        
-        # WARP 管理器状态
-        try:
-            warp_manager = get_warp_manager()
-            manager_status = warp_manager.get_status()
-            status["warp_manager"] = manager_status
-            
-            # 获取配置文件详情
-            configs = warp_manager.list_configs()
-            status["config_files"] = configs
-            
-        except Exception as e:
-            status["warp_manager"] = {"error": str(e)}
-        
-        # 代理池状态
-        try:
-            proxy_pool = get_proxy_pool()
-            if proxy_pool:
-                pool_status = proxy_pool.get_pool_status()
-                status["proxy_pool"] = pool_status
-            else:
-                status["proxy_pool"] = {"status": "not_initialized"}
-                
-        except Exception as e:
-            status["proxy_pool"] = {"error": str(e)}
-        
-        return status
-        
+        body, hit = await get_or_set("warp-status", 30, _do_warp_status, refresh=bool(refresh))
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"Cache-Control": "max-age=30", "X-Cache": "HIT" if hit else "MISS"},
+        )
     except Exception as e:
         logger.error(f"获取 WARP 状态失败: {e}")
         raise HTTPException(status_code=500, detail=f"状态获取失败: {str(e)}")
 
 
+# /status 短 TTL 响应缓存：负载均衡高频轮询时，N 次请求只序列化一次
+_STATUS_CACHE_TTL = 5.0
+_status_cache: Dict[str, Any] = {"expires": 0.0, "body": b""}
+
+
 @router.get("/status", summary="系统状态", tags=["Health"])
 async def system_status():
     """系统详细状态"""
     try:
-        # 基本系统信息
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        
+        now = time.monotonic()
+        if now < _status_cache["expires"]:
+            return Response(
+                content=_status_cache["body"],
+                media_type="application/json",
+                headers={"Cache-Control": f"max-age={int(_STATUS_CACHE_TTL)}", "X-Cache": "HIT"},
+            )
+
+        # 基本系统信息（读取后台采样缓存，避免阻塞事件循环）
+        cpu_percent = _system_sample["cpu_percent"]
+        memory = _system_sample["memory"] or psutil.virtual_memory()
+        disk = _system_sample["disk"] or psutil.disk_usage('/')
+
         status = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": iso_now(),
             "system": {
                 "cpu_percent": cpu_percent,
                 "memory": {
@@ -385,9 +529,17 @@ async def system_status():
                 "warp_available": WARP_AVAILABLE
             }
         }
-        
-        return JSONResponse(content=status)
-        
+
+        body = orjson.dumps(status)
+        _status_cache["body"] = body
+        _status_cache["expires"] = now + _STATUS_CACHE_TTL
+
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"Cache-Control": f"max-age={int(_STATUS_CACHE_TTL)}", "X-Cache": "MISS"},
+        )
+
     except Exception as e:
         logger.error(f"获取系统状态失败: {e}")
         raise HTTPException(status_code=500, detail="无法获取系统状态")
@@ -397,11 +549,6 @@ async def system_status():
 async def test_video_parsing():
     """简化的视频解析测试"""
     try:
-        import yt_dlp
-        
-        # 使用 yt-dlp 测试一个简单的视频
-        test_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
-        
         ydl_opts = {
             'quiet': True,
             'no_warnings': True,
@@ -409,29 +556,29 @@ async def test_video_parsing():
             'format': 'best[height<=720]',  # 限制分辨率避免超时
             'noplaylist': True,
         }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # 只提取元数据，不下载
-            info = ydl.extract_info(test_url, download=False)
-            
-            result = {
-                "status": "success",
-                "video_info": {
-                    "title": info.get('title', 'Unknown'),
-                    "duration": info.get('duration', 0),
-                    "uploader": info.get('uploader', 'Unknown'),
-                    "view_count": info.get('view_count', 0),
-                    "format_count": len(info.get('formats', [])),
-                    "direct_link_available": bool(info.get('url'))
-                },
-                "message": "视频解析功能正常"
-            }
-            
-            return JSONResponse(content=result)
-            
+
+        # 专用线程池自带并发上限和结果缓存，探测请求不会挤占事件循环
+        info = await ytdlp_pool.extract(_TEST_VIDEO_ID, ydl_opts)
+
+        result = {
+            "status": "success",
+            "video_info": {
+                "title": info.get('title', 'Unknown'),
+                "duration": info.get('duration', 0),
+                "uploader": info.get('uploader', 'Unknown'),
+                "view_count": info.get('view_count', 0),
+                "format_count": len(info.get('formats', [])),
+                "direct_link_available": bool(info.get('url'))
+            },
+            "message": "视频解析功能正常"
+        }
+
+        return result
+
+
     except Exception as e:
         logger.error(f"视频解析测试失败: {e}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={
                 "status": "error",
@@ -448,9 +595,9 @@ if ADVANCED_FEATURES_AVAILABLE:
     async def concurrency_status():
         """获取并发控制状态"""
         try:
-            limiter = get_concurrency_limiter()
+            limiter = _limiter or get_concurrency_limiter()
             status = limiter.get_status()
-            return JSONResponse(content=status)
+            return status
         except Exception as e:
             logger.error(f"获取并发状态失败: {e}")
             raise HTTPException(status_code=500, detail="无法获取并发状态")
@@ -459,9 +606,9 @@ if ADVANCED_FEATURES_AVAILABLE:
     async def warp_optimization_status():
         """获取 WARP 优化状态"""
         try:
-            optimizer = get_warp_optimizer()
+            optimizer = _optimizer or get_warp_optimizer()
             status = optimizer.get_optimization_status()
-            return JSONResponse(content=status)
+            return status
         except Exception as e:
             logger.error(f"获取 WARP 状态失败: {e}")
             raise HTTPException(status_code=500, detail="无法获取 WARP 状态")
@@ -470,9 +617,9 @@ if ADVANCED_FEATURES_AVAILABLE:
     async def force_warp_optimization():
         """强制执行 WARP 优化"""
         try:
-            optimizer = get_warp_optimizer()
+            optimizer = _optimizer or get_warp_optimizer()
             result = await optimizer.force_optimization()
-            return JSONResponse(content={"status": "success", "result": result})
+            return {"status": "success", "result": result}
         except Exception as e:
             logger.error(f"强制 WARP 优化失败: {e}")
             raise HTTPException(status_code=500, detail="强制优化失败")
@@ -481,7 +628,7 @@ else:
     @router.get("/concurrency", summary="并发控制状态（不可用）", tags=["Advanced"])
     async def concurrency_status_unavailable():
         """并发控制功能不可用"""
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=503,
             content={
                 "status": "unavailable",
@@ -493,7 +640,7 @@ else:
     @router.get("/warp-optimization", summary="WARP 优化状态（不可用）", tags=["Advanced"]) 
     async def warp_optimization_status_unavailable():
         """WARP 优化功能不可用"""
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=503,
             content={
                 "status": "unavailable", 
@@ -4,13 +4,14 @@ Video processing routes for yt-dlp FastAPI
 
 import logging
 from typing import Optional, Annotated
+import hashlib
 import time
-import asyncio
 import uuid
-import yt_dlp
 
-from fastapi import APIRouter, Request, HTTPException, Header
-from fastapi.responses import JSONResponse
+import orjson
+
+from fastapi import APIRouter, BackgroundTasks, Request, HTTPException, Header, Path
+from fastapi.responses import Response
 
 from app.models.error import HTTPError
 from app.models.media import SimpleVideoResponse
@@ -18,12 +19,112 @@ from app.utils.proxy_pool import get_proxy_pool
 from app.utils.metrics import get_metrics
 from app.utils.crypto import encrypt_data
 from app.utils.config import settings
-from app.utils.dlp_utils import DLPUtils
+from app.utils.dlp_utils import YOUTUBE_VIDEO_ID_PATTERN
+from app.utils import ytdlp_pool
 
 router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
+# 直链不可用的流媒体协议（frozenset：哈希查找替代每次迭代新建列表做线性扫描）
+_BLOCKED_PROTOCOLS = frozenset({'m3u8', 'm3u8_native', 'http_dash_segments'})
+
+
+async def _finish_bookkeeping(proxy_info, success: bool):
+    """释放代理的收尾工作
+
+    指标记录已是同步调用（end_request 不再加锁），在调用点直接
+    完成；这里只剩代理释放，失败只记日志，不影响已经完成的解析
+    结果。
+    """
+    if not proxy_info:
+        return
+    proxy_pool = get_proxy_pool()
+    if not proxy_pool:
+        return
+    try:
+        await proxy_pool.release_proxy(proxy_info, success=success)
+    except Exception as e:
+        logger.warning(f"请求收尾记录失败: {e}")
+
+
+def _build_response_data(request: Request, video_id: str, video_info: dict,
+                         video_format: Optional[dict],
+                         audio_format: Optional[dict]) -> dict:
+    """按运行模式构建响应体：直链返回原始 URL，代理模式返回加密链接"""
+    response_data = {
+        "video_id": video_id,
+        "title": video_info.get('title', ''),
+        "duration": video_info.get('duration', 0),
+    }
+
+    if settings.DIRECT_LINK_MODE:
+        # 直链模式：返回真实 YouTube 链接
+        response_data.update({
+            "video_url": video_format.get('url') if video_format else None,
+            "audio_url": audio_format.get('url') if audio_format else None,
+        })
+        return response_data
+
+    # 代理模式：返回加密的本地代理链接
+    host = str(request.url.hostname)
+    port = request.url.port
+    scheme = request.url.scheme
+
+    base_url = f"{scheme}://{host}"
+    if port and port not in (80, 443):
+        base_url += f":{port}"
+
+    if video_format:
+        video_token = encrypt_data({"url": video_format.get('url'), "type": "video"})
+        response_data["video_url"] = f"{base_url}/v1/proxy/{video_token}"
+
+    if audio_format:
+        audio_token = encrypt_data({"url": audio_format.get('url'), "type": "audio"})
+        response_data["audio_url"] = f"{base_url}/v1/proxy/{audio_token}"
+
+    return response_data
+
+
+def _select_best_formats(formats: list) -> tuple:
+    """单次遍历选出最佳无声视频格式和纯音频格式
+
+    过滤条件与优先级和原先的"过滤 + 排序"完全一致，只是不再
+    构造中间列表：对每个候选维护当前最优的比较键。
+    """
+    best_video = best_audio = None
+    # 比较键初始化为最小元组，省去循环内的 None 判断
+    best_video_key = best_audio_key = (-1, -1, -1)
+    # 热名绑定为局部变量（LOAD_FAST 代替 LOAD_GLOBAL）
+    blocked = _BLOCKED_PROTOCOLS
+
+    for fmt in formats:
+        get = fmt.get
+        url = get('url')
+        if (not url or
+                url.endswith('.m3u8') or
+                get('protocol') in blocked):
+            continue
+
+        vcodec = get('vcodec')
+        acodec = get('acodec')
+
+        if vcodec != 'none' and acodec == 'none':
+            # 视频优先级：4K 以内分辨率 > 比特率 > 文件大小
+            height = get('height') or 0
+            key = (height if height <= 2160 else 0, get('tbr') or 0, get('filesize') or 0)
+            if key > best_video_key:
+                best_video_key, best_video = key, fmt
+        elif acodec != 'none' and vcodec == 'none':
+            # 音频优先级：m4a > mp3 > 其他，其次比特率和文件大小
+            ext = get('ext')
+            key = (1 if ext == 'm4a' else 0.5 if ext == 'mp3' else 0,
+                   get('abr') or 0, get('filesize') or 0)
+            if key > best_audio_key:
+                best_audio_key, best_audio = key, fmt
+
+    return best_video, best_audio
+
 
 @router.get(
     "/video/{video_id}",
@@ -37,7 +138,12 @@ logger = logging.getLogger(__name__)
     },
     tags=["Video"]
 )
-async def fetch_simple(request: Request, video_id: str, x_secret: Annotated[Optional[str], Header()] = None) -> JSONResponse:
+async def fetch_simple(
+    request: Request,
+    video_id: Annotated[str, Path(pattern=YOUTUBE_VIDEO_ID_PATTERN)],
+    background_tasks: BackgroundTasks,
+    x_secret: Annotated[Optional[str], Header()] = None
+) -> Response:
     """
     🚀 视频解析接口 - 支持直链和代理模式
     
@@ -48,24 +154,21 @@ async def fetch_simple(request: Request, video_id: str, x_secret: Annotated[Opti
     # 生成请求 ID 用于性能追踪
     request_id = str(uuid.uuid4())
     metrics = get_metrics()
-    await metrics.start_request(request_id)
+    metrics.start_request(request_id)
     
     start_time = time.time()
     proxy_used = None
-    
+    # 在 try 外初始化：鉴权/校验阶段抛出时异常分支也要读它
+    proxy_info = None
+
     try:
         # 🔐 API 鉴权检查
         if not settings.validate_secret_for_domain(x_secret, str(request.url.hostname)):
             raise HTTPException(status_code=401, detail="Invalid API key")
 
-        # 🎬 基础验证
-        if not DLPUtils.validate_youtube_video_id(video_id):
-            raise HTTPException(status_code=400, detail="无效的 YouTube 视频 ID")
-        
         logger.info(f"开始解析视频: {video_id}")
         
         # 🎯 获取代理（如果启用）
-        proxy_info = None
         if settings.ENABLE_WARP_PROXY:
             proxy_pool = get_proxy_pool()
             if proxy_pool:
@@ -75,8 +178,6 @@ async def fetch_simple(request: Request, video_id: str, x_secret: Annotated[Opti
                     logger.info(f"使用代理: {proxy_used}")
         
         # 🚀 核心解析逻辑
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        
         # 配置 yt-dlp 选项
         ydl_opts = {
             'quiet': True,
@@ -87,19 +188,21 @@ async def fetch_simple(request: Request, video_id: str, x_secret: Annotated[Opti
             'skip_download': True,
             # 获取所有格式，在代码中筛选最佳直链
             'format': 'all',
+            # HLS/DASH 格式随后会被过滤掉，直接跳过清单抓取和解析
+            'youtube_include_dash_manifest': False,
+            'youtube_include_hls_manifest': False,
         }
         
         # 添加代理配置
         if proxy_info:
             ydl_opts['proxy'] = proxy_info.url
         
-        # 🎯 解析视频信息
-        loop = asyncio.get_event_loop()
-        video_info = await loop.run_in_executor(
-            None, 
-            lambda: yt_dlp.YoutubeDL(ydl_opts).extract_info(url, download=False)
+        # 🎯 解析视频信息（专用线程池 + 结果缓存，相同视频的并发请求只解析一次）
+        video_info = await ytdlp_pool.extract(
+            video_id, ydl_opts,
+            proxy=proxy_info.url if proxy_info else None
         )
-        
+
         if not video_info:
             raise HTTPException(status_code=404, detail="视频不存在或无法访问")
         
@@ -108,159 +211,98 @@ async def fetch_simple(request: Request, video_id: str, x_secret: Annotated[Opti
         if not formats:
             raise HTTPException(status_code=404, detail="无法获取视频格式信息")
         
-        # 🎥 选择最佳视频格式 (优先级：可直接下载 > 4K无声 > 1080p)
-        video_format = None
-        
-        # 过滤视频格式：无声视频，非 HLS/DASH 流媒体
-        video_formats = []
-        for fmt in formats:
-            if (fmt.get('vcodec') != 'none' and 
-                fmt.get('acodec') == 'none' and
-                fmt.get('protocol') not in ['m3u8', 'm3u8_native', 'http_dash_segments'] and
-                fmt.get('url') and 
-                not fmt.get('url', '').endswith('.m3u8')):
-                video_formats.append(fmt)
-        
-        # 按优先级排序：4K > 1080p > 其他，质量越高越好
-        video_formats.sort(key=lambda x: (
-            x.get('height', 0) if x.get('height', 0) <= 2160 else 0,  # 4K 优先
-            x.get('tbr', 0),  # 比特率越高越好
-            x.get('filesize', 0) if x.get('filesize') else 0  # 文件大小
-        ), reverse=True)
-        
-        video_format = video_formats[0] if video_formats else None
-        
+        # 🎥🔊 单次遍历选出最佳视频/音频格式
+        # 原来各做一次"过滤列表 + 排序"，对热路径是两份中间列表加两次
+        # O(n log n)；改为一趟循环维护当前最优，比较键与原排序键一致
+        video_format, audio_format = _select_best_formats(formats)
+
         # 记录选择的视频格式
         if video_format:
             logger.info(f"选择视频格式: {video_format.get('format_id')} - {video_format.get('height')}p - {video_format.get('ext')} - {video_format.get('protocol')}")
         else:
             logger.warning("未找到合适的视频格式")
-        
-        # 🔊 选择最佳音频格式 (优先级：m4a > mp3 > 其他)
-        audio_format = None
-        
-        # 过滤音频格式：纯音频，非流媒体
-        audio_formats = []
-        for fmt in formats:
-            if (fmt.get('acodec') != 'none' and 
-                fmt.get('vcodec') == 'none' and
-                fmt.get('protocol') not in ['m3u8', 'm3u8_native', 'http_dash_segments'] and
-                fmt.get('url') and 
-                not fmt.get('url', '').endswith('.m3u8')):
-                audio_formats.append(fmt)
-        
-        # 按优先级排序：m4a > mp3 > webm > 其他，质量越高越好
-        audio_formats.sort(key=lambda x: (
-            1 if x.get('ext') == 'm4a' else 0.5 if x.get('ext') == 'mp3' else 0,  # 格式优先级
-            x.get('abr', 0),  # 音频比特率
-            x.get('filesize', 0) if x.get('filesize') else 0  # 文件大小
-        ), reverse=True)
-        
-        audio_format = audio_formats[0] if audio_formats else None
-        
+
         # 记录选择的音频格式
         if audio_format:
             logger.info(f"选择音频格式: {audio_format.get('format_id')} - {audio_format.get('ext')} - {audio_format.get('abr')}kbps - {audio_format.get('protocol')}")
         else:
             logger.warning("未找到合适的音频格式")
         
-        # 构建响应
-        response_data = {
-            "video_id": video_id,
-            "title": video_info.get('title', ''),
-            "duration": video_info.get('duration', 0),
-        }
-        
-        # 根据配置返回直链或代理链接
-        if settings.DIRECT_LINK_MODE:
-            # 直链模式：返回真实 YouTube 链接
-            response_data.update({
-                "video_url": video_format.get('url') if video_format else None,
-                "audio_url": audio_format.get('url') if audio_format else None,
-            })
-        else:
-            # 代理模式：返回加密的本地代理链接
-            host = str(request.url.hostname)
-            port = request.url.port
-            scheme = request.url.scheme
-            
-            base_url = f"{scheme}://{host}"
-            if port and port not in (80, 443):
-                base_url += f":{port}"
-            
-            if video_format:
-                video_data = {
-                    "url": video_format.get('url'),
-                    "type": "video"
-                }
-                video_token = encrypt_data(video_data)
-                response_data["video_url"] = f"{base_url}/v1/proxy/{video_token}"
-            
-            if audio_format:
-                audio_data = {
-                    "url": audio_format.get('url'),
-                    "type": "audio"
-                }
-                audio_token = encrypt_data(audio_data)
-                response_data["audio_url"] = f"{base_url}/v1/proxy/{audio_token}"
-        
+        # 构建响应（直链 / 加密代理链接由辅助函数按配置生成）
+        response_data = _build_response_data(request, video_id, video_info,
+                                             video_format, audio_format)
+
         processing_time = time.time() - start_time
-        
-        # 释放代理
-        if proxy_info:
-            proxy_pool = get_proxy_pool()
-            if proxy_pool:
-                await proxy_pool.release_proxy(proxy_info, success=True)
-        
-        # 记录性能指标
-        await metrics.end_request(
+
+        # 只序列化一次：指标的 response_size 取真实字节数
+        # （原来 len(str(...)) 等于为了取大小再做一遍 repr 编码）
+        body = orjson.dumps(response_data)
+
+        # ETag 取响应体摘要：同一视频在解析缓存 TTL 内链接不变，
+        # 客户端带 If-None-Match 复用时直接 304，省去重复传输
+        etag = f'"{hashlib.blake2s(body, digest_size=8).hexdigest()}"'
+        if request.headers.get('if-none-match') == etag:
+            metrics.end_request(
+                request_id=request_id,
+                video_id=video_id,
+                success=True,
+                proxy_used=proxy_used,
+                response_size=0
+            )
+            background_tasks.add_task(_finish_bookkeeping, proxy_info, True)
+            return Response(
+                status_code=304,
+                headers={"ETag": etag, "Cache-Control": "public, max-age=300"},
+                background=background_tasks
+            )
+
+        # 指标同步记录，代理释放挂到 BackgroundTasks：
+        # 响应先上线再做收尾，客户端不用等这次 await
+        metrics.end_request(
             request_id=request_id,
             video_id=video_id,
             success=True,
             proxy_used=proxy_used,
-            response_size=len(str(response_data))
+            response_size=len(body)
         )
-        
+        background_tasks.add_task(_finish_bookkeeping, proxy_info, True)
+
         logger.info(f"视频解析完成: {video_id}, 耗时: {processing_time:.2f}秒")
-        
-        return JSONResponse(
-            content=response_data,
-            headers={"X-Processing-Time": f"{processing_time:.3f}"}
+
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={
+                "ETag": etag,
+                "Cache-Control": "public, max-age=300",
+                "X-Processing-Time": f"{processing_time:.3f}",
+            },
+            background=background_tasks
         )
         
     except HTTPException:
-        # 释放代理（失败情况）
-        if proxy_info:
-            proxy_pool = get_proxy_pool()
-            if proxy_pool:
-                await proxy_pool.release_proxy(proxy_info, success=False)
-        
-        # 记录失败指标
-        await metrics.end_request(
+        # 记录失败指标 + 释放代理
+        metrics.end_request(
             request_id=request_id,
             video_id=video_id,
             success=False,
             proxy_used=proxy_used
         )
+        await _finish_bookkeeping(proxy_info, success=False)
         raise
     except Exception as e:
         processing_time = time.time() - start_time
-        
-        # 释放代理（异常情况）
-        if proxy_info:
-            proxy_pool = get_proxy_pool()
-            if proxy_pool:
-                await proxy_pool.release_proxy(proxy_info, success=False)
-        
-        # 记录异常指标
-        await metrics.end_request(
+
+        # 记录异常指标 + 释放代理
+        metrics.end_request(
             request_id=request_id,
             video_id=video_id,
             success=False,
             error_type=type(e).__name__,
             proxy_used=proxy_used
         )
-        
+        await _finish_bookkeeping(proxy_info, success=False)
+
         logger.error(f"视频解析失败: {video_id}, 错误: {e}, 耗时: {processing_time:.2f}秒")
         raise HTTPException(status_code=500, detail=f"解析失败: {str(e)}")
 
@@ -271,19 +313,17 @@ async def fetch_simple(request: Request, video_id: str, x_secret: Annotated[Opti
     description="获取 YouTube 视频的所有可用格式",
     tags=["Video"]
 )
-async def get_formats(request: Request, video_id: str, x_secret: Annotated[Optional[str], Header()] = None):
+async def get_formats(
+    request: Request,
+    video_id: Annotated[str, Path(pattern=YOUTUBE_VIDEO_ID_PATTERN)],
+    x_secret: Annotated[Optional[str], Header()] = None
+):
     """获取视频的所有可用格式信息"""
     try:
         # 🔐 API 鉴权检查
         if not settings.validate_secret_for_domain(x_secret, str(request.url.hostname)):
             raise HTTPException(status_code=401, detail="Invalid API key")
         
-        # 🎬 基础验证
-        if not DLPUtils.validate_youtube_video_id(video_id):
-            raise HTTPException(status_code=400, detail="无效的 YouTube 视频 ID")
-        
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        
         # 配置 yt-dlp 选项
         ydl_opts = {
             'quiet': True,
@@ -292,24 +332,23 @@ async def get_formats(request: Request, video_id: str, x_secret: Annotated[Optio
             'writesubtitles': False,
             'writeautomaticsub': False,
             'skip_download': True,
+            # 只要元数据，省掉 HLS/DASH 清单的抓取与解析
+            'youtube_include_dash_manifest': False,
+            'youtube_include_hls_manifest': False,
         }
-        
-        # 解析视频信息
-        loop = asyncio.get_event_loop()
-        video_info = await loop.run_in_executor(
-            None, 
-            lambda: yt_dlp.YoutubeDL(ydl_opts).extract_info(url, download=False)
-        )
-        
+
+        # 解析视频信息（专用线程池 + 结果缓存）
+        # process=False：跳过每个格式的签名解密，格式列表端点只要元数据
+        video_info = await ytdlp_pool.extract(video_id, ydl_opts, process=False)
+
         if not video_info:
             raise HTTPException(status_code=404, detail="视频不存在或无法访问")
         
         formats = video_info.get('formats', [])
-        
-        # 简化格式信息
-        simplified_formats = []
-        for fmt in formats:
-            simplified_formats.append({
+
+        # 简化格式信息（列表推导一次成型；响应经应用级 ORJSONResponse 编码）
+        simplified_formats = [
+            {
                 "format_id": fmt.get('format_id'),
                 "ext": fmt.get('ext'),
                 "resolution": f"{fmt.get('width', 0)}x{fmt.get('height', 0)}" if fmt.get('width') else None,
@@ -318,8 +357,10 @@ async def get_formats(request: Request, video_id: str, x_secret: Annotated[Optio
                 "acodec": fmt.get('acodec'),
                 "abr": fmt.get('abr'),
                 "vbr": fmt.get('vbr'),
-            })
-        
+            }
+            for fmt in formats
+        ]
+
         return {
             "video_id": video_id,
             "title": video_info.get('title', ''),
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+后台备份写入器
+备份改名属于非关键写入：排进队列由单个守护线程消费，
+清理路径不再串行等待一串 rename 系统调用
+"""
+
+import atexit
+import logging
+import queue
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBackupWriter:
+    """单线程消费的备份改名队列"""
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[Tuple[Path, Path]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="backup-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                src, dst = item
+                try:
+                    src.rename(dst)
+                    logger.info(f"配置已备份: {src.name} -> {dst.name}")
+                except OSError as e:
+                    logger.error(f"备份改名失败 {src}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, src: Path, dst: Path):
+        """排队一个备份改名，立即返回"""
+        self._ensure_thread()
+        self._queue.put((src, dst))
+
+    def flush(self):
+        """等待队列清空（进程退出前由 atexit 调用）"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+
+# 全局写入器实例
+_writer: Optional[AsyncBackupWriter] = None
+
+def get_backup_writer() -> AsyncBackupWriter:
+    """获取全局备份写入器实例"""
+    global _writer
+    if _writer is None:
+        _writer = AsyncBackupWriter()
+        atexit.register(_writer.flush)
+    return _writer
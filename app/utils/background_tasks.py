@@ -1,73 +1,128 @@
 import asyncio
 import logging
+import aiohttp
 import psutil
 import time
-from typing import Optional, List
+from typing import Optional, Tuple
+from app.utils.concurrency_limiter import get_concurrency_limiter
+from app.utils.config import settings
 from app.utils.proxy_pool import get_proxy_pool
 from app.utils.metrics import get_metrics
 
 logger = logging.getLogger(__name__)
 
+
+def _sample_system() -> Tuple[float, float]:
+    """一次性读取 CPU 和内存占用（在线程池里跑，/proc 解析不占事件循环）"""
+    return psutil.cpu_percent(interval=None), psutil.virtual_memory().percent
+
+
+async def _hydrate_cookies():
+    """从 COOKIES_URL 异步加载 cookies
+
+    原来在 Settings 的校验器里用同步 requests 拉取，导入配置时
+    就阻塞在网络上；改为启动后的一次性后台任务，URL 慢或挂掉
+    都不影响冷启动，失败重试一次。
+    """
+    for attempt in range(2):
+        try:
+            timeout = aiohttp.ClientTimeout(total=5)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(settings.COOKIES_URL) as response:
+                    response.raise_for_status()
+                    settings.COOKIES = await response.text()
+                    logger.info("✅ COOKIES 已从 COOKIES_URL 加载")
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"COOKIES 加载失败 (第{attempt + 1}次): {e}")
+            await asyncio.sleep(2 ** attempt)
+    logger.error("COOKIES 加载失败，保持为空")
+
 class BackgroundTaskManager:
-    """后台任务管理器"""
-    
+    """后台任务管理器
+
+    所有后台协程挂在一个 asyncio.TaskGroup 下，由常驻的监督任务
+    持有：gather(return_exceptions=True) 的取消语义有坑（可能吞掉
+    CancelledError 导致关停悬挂），TaskGroup 保证取消并等齐全部
+    子任务后才返回。
+    """
+
     def __init__(self):
-        self.tasks: List[asyncio.Task] = []
+        self._supervisor: Optional[asyncio.Task] = None
         self.running = False
-    
+
     async def start_all_tasks(self):
         """启动所有后台任务"""
         if self.running:
             return
-        
+
         self.running = True
         logger.info("启动后台任务...")
-        
-        # 系统监控任务
-        system_monitor_task = asyncio.create_task(self._system_monitor_loop())
-        self.tasks.append(system_monitor_task)
-        
-        # 数据清理任务
-        cleanup_task = asyncio.create_task(self._cleanup_loop())
-        self.tasks.append(cleanup_task)
-        
-        logger.info(f"已启动 {len(self.tasks)} 个后台任务")
-    
+
+        # 预热 CPU 采样：interval=None 的首次调用固定返回 0.0，
+        # 之后每次调用返回距上次调用以来的平均占用率
+        psutil.cpu_percent(interval=None)
+
+        started = asyncio.Event()
+        self._supervisor = asyncio.create_task(self._supervise(started))
+        await started.wait()
+
+    async def _supervise(self, started: asyncio.Event):
+        """常驻监督协程：TaskGroup 的生命周期即全部后台任务的生命周期"""
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._system_monitor_loop())
+                tg.create_task(self._cleanup_loop())
+                task_count = 2
+
+                # cookies 异步注水（一次性任务）
+                if settings.COOKIES_URL and not settings.COOKIES:
+                    tg.create_task(_hydrate_cookies())
+                    task_count += 1
+
+                logger.info(f"已启动 {task_count} 个后台任务")
+                started.set()
+        finally:
+            # 启动方不能卡在 wait 上，即便 TaskGroup 立即失败
+            started.set()
+
     async def stop_all_tasks(self):
         """停止所有后台任务"""
         if not self.running:
             return
-        
+
         self.running = False
         logger.info("停止后台任务...")
-        
-        # 取消所有任务
-        for task in self.tasks:
-            if not task.done():
-                task.cancel()
-        
-        # 等待任务完成
-        if self.tasks:
-            await asyncio.gather(*self.tasks, return_exceptions=True)
-        
-        self.tasks.clear()
+
+        if self._supervisor is not None:
+            # 取消监督任务即取消整个 TaskGroup；await 保证所有子任务
+            # 都已结束才继续关停流程
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+
         logger.info("所有后台任务已停止")
-    
+
     async def _system_monitor_loop(self):
-        """系统监控循环 - 每30秒记录一次系统指标"""
+        """系统监控循环 - 按 MONITOR_PERIOD_SECONDS 周期记录系统指标"""
         while self.running:
             try:
-                # 获取系统指标
-                cpu_percent = psutil.cpu_percent(interval=1)
-                memory = psutil.virtual_memory()
-                memory_percent = memory.percent
-                
-                # 记录到性能监控
+                # 获取系统指标（批量放到线程池，/proc/stat 和
+                # /proc/meminfo 的解析完全不碰事件循环）
+                cpu_percent, memory_percent = await asyncio.to_thread(_sample_system)
+
+                # 记录到性能监控：队列深度取自并发限制器的真实状态
+                limiter = get_concurrency_limiter()
                 metrics = get_metrics()
-                await metrics.record_system_metrics(
+                metrics.record_system_metrics(
                     cpu_usage=cpu_percent,
                     memory_usage=memory_percent,
-                    queue_size=0  # 暂时设为0，可以后续添加队列监控
+                    queue_size=len(limiter.active_requests) + len(limiter._entries)
                 )
                 
                 # 记录代理池状态
@@ -78,7 +133,7 @@ class BackgroundTaskManager:
                 else:
                     logger.debug(f"系统监控 - CPU: {cpu_percent}%, 内存: {memory_percent}%, 代理池未初始化")
                 
-                await asyncio.sleep(30)  # 每30秒监控一次
+                await asyncio.sleep(settings.MONITOR_PERIOD_SECONDS)
                 
             except asyncio.CancelledError:
                 break
@@ -87,23 +142,36 @@ class BackgroundTaskManager:
                 await asyncio.sleep(60)  # 出错时等待1分钟
     
     async def _cleanup_loop(self):
-        """数据清理循环 - 每小时清理一次旧数据"""
+        """统一清理循环
+
+        并发限制器的过期请求清理和性能指标的旧数据清理合在一个
+        循环里：以限制器的 cleanup_interval（30s）为基准节拍，指标
+        清理按整数倍分频保持原来的小时级频率，少一个常驻任务和
+        一半的定时唤醒。
+        """
+        limiter = get_concurrency_limiter()
+        interval = limiter.config.cleanup_interval
+        # 指标清理的分频系数（3600s / 30s = 每 120 拍一次）
+        metrics_every = max(1, int(3600 / interval))
+        tick = 0
+
         while self.running:
             try:
-                # 清理性能指标旧数据
-                metrics = get_metrics()
-                await metrics.cleanup_old_data()
-                
-                logger.info("定期数据清理完成")
-                
-                # 每小时清理一次
-                await asyncio.sleep(3600)
-                
+                await limiter.cleanup_expired_requests()
+
+                if tick % metrics_every == 0:
+                    metrics = get_metrics()
+                    metrics.cleanup_old_data()
+                    logger.info("定期数据清理完成")
+                tick += 1
+
+                await asyncio.sleep(interval)
+
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"数据清理异常: {e}")
-                await asyncio.sleep(1800)  # 出错时等待30分钟
+                await asyncio.sleep(60)  # 出错时等待1分钟
 
 
 # 全局后台任务管理器
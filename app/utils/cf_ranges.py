@@ -0,0 +1,93 @@
+"""
+Cloudflare 公布的出口 IP 段本地判定
+
+WARP 生效时容器出口 IP 落在 Cloudflare 段内。与其每次都对
+1.1.1.1/cdn-cgi/trace 发一次 HTTP 请求，不如先在本地做网段匹配：
+IP 明显不在 Cloudflare 段时直接判定未生效，trace 只用于确认
+warp=on。段列表内置（来自 cloudflare.com/ips-v4 与 ips-v6），
+并可由后台任务每日刷新。
+"""
+
+import ipaddress
+import logging
+from typing import List
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# https://www.cloudflare.com/ips-v4
+_V4_PREFIXES = [
+    "173.245.48.0/20",
+    "103.21.244.0/22",
+    "103.22.200.0/22",
+    "103.31.4.0/22",
+    "141.101.64.0/18",
+    "108.162.192.0/18",
+    "190.93.240.0/20",
+    "188.114.96.0/20",
+    "197.234.240.0/22",
+    "198.41.128.0/17",
+    "162.158.0.0/15",
+    "104.16.0.0/13",
+    "104.24.0.0/14",
+    "172.64.0.0/13",
+    "131.0.72.0/22",
+]
+
+# https://www.cloudflare.com/ips-v6
+_V6_PREFIXES = [
+    "2400:cb00::/32",
+    "2606:4700::/32",
+    "2803:f800::/32",
+    "2405:b500::/32",
+    "2405:8100::/32",
+    "2a06:98c0::/29",
+    "2c0f:f248::/32",
+]
+
+_RANGE_URLS = (
+    "https://www.cloudflare.com/ips-v4",
+    "https://www.cloudflare.com/ips-v6",
+)
+
+_nets: List[ipaddress._BaseNetwork] = [
+    ipaddress.ip_network(p) for p in _V4_PREFIXES + _V6_PREFIXES
+]
+
+
+def is_cf(ip: str) -> bool:
+    """判断 IP 是否属于 Cloudflare 公布的出口段"""
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(addr in net for net in _nets)
+
+
+async def refresh_ranges(session: aiohttp.ClientSession):
+    """从 Cloudflare 官方列表刷新网段（失败时保留内置列表）"""
+    global _nets
+    prefixes: List[str] = []
+    for url in _RANGE_URLS:
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise aiohttp.ClientError(f"HTTP {response.status} from {url}")
+            text = await response.text()
+            prefixes.extend(line.strip() for line in text.splitlines() if line.strip())
+
+    nets = [ipaddress.ip_network(p) for p in prefixes]
+    if nets:
+        _nets = nets
+        logger.info(f"Cloudflare IP 段已刷新: {len(nets)} 个网段")
+
+
+async def ranges_refresh_loop(session: aiohttp.ClientSession):
+    """每日刷新一次 Cloudflare IP 段的后台循环"""
+    import asyncio
+    while True:
+        await asyncio.sleep(86400)
+        try:
+            await refresh_ranges(session)
+        except Exception as e:
+            logger.warning(f"Cloudflare IP 段刷新失败，沿用当前列表: {e}")
@@ -6,16 +6,24 @@
 """
 
 import asyncio
+import heapq
+import itertools
 import time
 import logging
-import uuid
+import secrets
 from typing import Optional, Dict, Any, List
 from dataclasses import dataclass
-from collections import deque
+from collections import OrderedDict
 from enum import Enum
 
 logger = logging.getLogger(__name__)
 
+# 请求 ID：6 位随机进程前缀 + 递增计数。uuid4 每次要读 122 位随机数
+# 再格式化成 36 字符，而日志里只用得到短 ID；这里一次取随机前缀，
+# 之后每个 ID 只是一次计数器自增
+_ID_PREFIX = secrets.token_hex(3)
+_ID_SEQ = itertools.count()
+
 class AccountTier(Enum):
     """账户等级"""
     FREE = "free"
@@ -37,13 +45,18 @@ class CloudflareWARPLimits:
         """总最大并发数"""
         return self.warp_connectors * self.max_concurrent_per_connector
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ConcurrencyConfig:
     """并发配置"""
     account_tier: AccountTier = AccountTier.FREE
     max_queue_size: int = 50           # 队列最大长度
     request_timeout: float = 45.0      # 请求总超时
     cleanup_interval: float = 30.0     # 清理间隔
+    # 老化调度权重：排序键 = aging_alpha*等待时长 + aging_beta*优先级。
+    # beta=30 表示 1 级优先级约等于 30 秒等待——低优先级请求等足
+    # 时间后可以超过新来的高优先级，避免被持续到达的高优流量饿死
+    aging_alpha: float = 1.0
+    aging_beta: float = 30.0
     
     def get_warp_limits(self) -> CloudflareWARPLimits:
         """根据账户等级获取 WARP 限制"""
@@ -98,26 +111,40 @@ class ConcurrencyLimiter:
         self.warp_limits = self.config.get_warp_limits()
         
         # 并发控制
+        # 使用计数器而非 asyncio.Semaphore：
+        # 1. Semaphore 没有 acquire_nowait()，原实现的"直接执行"路径从未生效
+        # 2. Semaphore 无法在运行时安全调整容量，计数器配合锁可以 O(1) 调整
         self.active_requests: Dict[str, RequestInfo] = {}
-        self.request_queue: deque[RequestInfo] = deque()
-        self.semaphore = asyncio.Semaphore(self.warp_limits.total_max_concurrent)
+        # 等待队列：按 user_ip 分桶，桶间用亏空轮转（DRR）公平调度，
+        # 防止单个 IP 占满整个队列饿死其他来源；桶内仍是按老化键
+        # （等待时长 + 优先级加权）排序的堆。request_id -> RequestInfo
+        # 字典做懒删除——出队/超时只从字典移除，堆里的陈旧项在调度
+        # 弹出时跳过，不再整队重排
+        self._buckets: "OrderedDict[str, List[tuple]]" = OrderedDict()
+        self._deficit: Dict[str, float] = {}
+        self._entries: Dict[str, RequestInfo] = {}
+        self._seq = itertools.count()
+        self.max_concurrent = self.warp_limits.total_max_concurrent
+        self.active_slots = 0
         
-        # 速率限制 (令牌桶算法)
+        # 速率限制 (令牌桶算法)；时钟用 monotonic，不受系统对时跳变影响
         self.tokens = float(self.warp_limits.burst_limit)
-        self.last_refill = time.time()
+        self.last_refill = time.monotonic()
         
-        # 统计信息
-        self.stats = {
-            "total_requests": 0,
-            "successful_requests": 0,
-            "rejected_requests": 0,
-            "timeout_requests": 0,
-            "queued_requests": 0,
-            "peak_concurrent": 0,
-            "peak_queue_size": 0
-        }
+        # 统计信息：独立属性而非字典，热路径上自增是一条 STORE_ATTR；
+        # 对外的 statistics 字典只在 get_status 时按需拼装
+        self._total_requests = 0
+        self._successful_requests = 0
+        self._rejected_requests = 0
+        self._timeout_requests = 0
+        self._queued_requests = 0
+        self._peak_concurrent = 0
+        self._peak_queue_size = 0
         
         self._lock = asyncio.Lock()
+        # 条件变量与 _lock 共享底层锁：释放槽位时直接唤醒等待者，
+        # 取代 wait_for_slot 里每 0.5s 扫一遍队列的轮询
+        self._cond = asyncio.Condition(self._lock)
         logger.info(f"并发限制器初始化: 最大并发={self.warp_limits.total_max_concurrent}, "
                    f"QPS限制={self.warp_limits.rate_limit_per_second}, "
                    f"账户等级={self.config.account_tier.value}")
@@ -137,19 +164,19 @@ class ConcurrencyLimiter:
         Returns:
             Optional[str]: 请求ID，None表示被拒绝
         """
-        request_id = str(uuid.uuid4())
+        request_id = f"{_ID_PREFIX}{next(_ID_SEQ):08x}"
         current_time = time.time()
         
         async with self._lock:
             # 检查速率限制
-            if not await self._check_rate_limit():
-                self.stats["rejected_requests"] += 1
+            if not self._check_rate_limit():
+                self._rejected_requests += 1
                 logger.warning(f"请求被速率限制拒绝: video_id={video_id}, ip={user_ip}")
                 return None
             
             # 检查队列是否已满
-            if len(self.request_queue) >= self.config.max_queue_size:
-                self.stats["rejected_requests"] += 1
+            if len(self._entries) >= self.config.max_queue_size:
+                self._rejected_requests += 1
                 logger.warning(f"请求被拒绝-队列已满: video_id={video_id}, ip={user_ip}")
                 return None
             
@@ -163,32 +190,37 @@ class ConcurrencyLimiter:
             )
             
             # 尝试直接获取槽位
-            try:
-                self.semaphore.acquire_nowait()
+            if self.active_slots < self.max_concurrent:
+                self.active_slots += 1
                 # 直接执行
                 request_info.started_at = current_time
                 self.active_requests[request_id] = request_info
-                self.stats["total_requests"] += 1
-                self.stats["peak_concurrent"] = max(
-                    self.stats["peak_concurrent"], 
-                    len(self.active_requests)
-                )
-                logger.info(f"请求直接执行: {request_id[:8]}... (并发: {len(self.active_requests)})")
+                self._total_requests += 1
+                n_active = len(self.active_requests)
+                if n_active > self._peak_concurrent:
+                    self._peak_concurrent = n_active
+                logger.info(f"请求直接执行: {request_id} (并发: {len(self.active_requests)})")
                 return request_id
-                
-            except Exception:
-                # 加入队列
-                self.request_queue.append(request_info)
-                self.stats["queued_requests"] += 1
-                self.stats["peak_queue_size"] = max(
-                    self.stats["peak_queue_size"],
-                    len(self.request_queue)
-                )
-                
-                queue_position = len(self.request_queue)
+
+            else:
+                # 加入队列：O(log n) 入堆，顺序由堆不变式维护。
+                # 老化键在入队时一次算好：-alpha*t 是随时间共享的偏移，
+                # 相对顺序不变，无需周期性重算
+                key = (-self.config.aging_alpha * current_time
+                       + self.config.aging_beta * priority)
+                bucket_key = user_ip or "anon"
+                bucket = self._buckets.setdefault(bucket_key, [])
+                heapq.heappush(bucket, (-key, next(self._seq), request_id))
+                self._entries[request_id] = request_info
+                self._queued_requests += 1
+                n_queued = len(self._entries)
+                if n_queued > self._peak_queue_size:
+                    self._peak_queue_size = n_queued
+
+                queue_position = len(self._entries)
                 estimated_wait = queue_position * 5  # 估算等待时间
-                
-                logger.info(f"请求加入队列: {request_id[:8]}... "
+
+                logger.info(f"请求加入队列: {request_id} "
                            f"(位置: {queue_position}, 预计等待: {estimated_wait}s)")
                 return request_id
     
@@ -204,129 +236,200 @@ class ConcurrencyLimiter:
             bool: 是否成功获取槽位
         """
         timeout = timeout or self.config.request_timeout
-        start_time = time.time()
-        check_interval = 0.5  # 检查间隔
-        
-        while time.time() - start_time < timeout:
-            async with self._lock:
-                # 检查是否已经在执行
-                if request_id in self.active_requests:
-                    request_info = self.active_requests[request_id]
-                    if request_info.started_at is not None:
-                        return True
-                
-                # 在队列中查找请求
-                for i, item in enumerate(self.request_queue):
-                    if item.request_id == request_id:
-                        # 如果是队列首位，尝试获取槽位
-                        if i == 0:
-                            try:
-                                self.semaphore.acquire_nowait()
-                                # 从队列移除并激活
-                                request_info = self.request_queue.popleft()
-                                request_info.started_at = time.time()
-                                self.active_requests[request_id] = request_info
-                                self.stats["total_requests"] += 1
-                                self.stats["peak_concurrent"] = max(
-                                    self.stats["peak_concurrent"], 
-                                    len(self.active_requests)
-                                )
-                                
-                                logger.info(f"队列请求开始执行: {request_id[:8]}... "
-                                           f"(等待时间: {time.time() - request_info.created_at:.1f}s)")
-                                return True
-                            except Exception:
-                                pass
-                        else:
-                            # 还在队列中等待
-                            logger.debug(f"请求队列等待: {request_id[:8]}... (位置: {i+1})")
-                        break
-                else:
-                    # 请求不在队列中，可能已被清理
-                    logger.warning(f"请求未找到: {request_id[:8]}...")
-                    return False
-            
-            # 等待一段时间再检查
-            await asyncio.sleep(check_interval)
-        
-        # 超时处理
-        await self._handle_request_timeout(request_id)
-        return False
+
+        def _resolved() -> bool:
+            # 已被调度执行，或已不在队列中（被清理/超时移除）都算"有结果"
+            request_info = self.active_requests.get(request_id)
+            if request_info is not None and request_info.started_at is not None:
+                return True
+            return request_id not in self._entries
+
+        async with self._cond:
+            try:
+                # Condition.wait 在取消时也会先重新持锁再抛出，
+                # 所以超时分支下面的队列清理可以直接复用当前锁
+                await asyncio.wait_for(self._cond.wait_for(_resolved), timeout)
+            except asyncio.TimeoutError:
+                # 懒删除：只摘掉字典项，堆里的陈旧项由调度侧跳过
+                self._entries.pop(request_id, None)
+                # 超时和调度可能竞争：wait_for 的定时器触发时请求或许
+                # 刚被 _dispatch_locked 放进活跃集。此时必须归还槽位并
+                # 调度后继，否则这个槽位就永久泄漏了
+                if self.active_requests.pop(request_id, None) is not None:
+                    self._release_slot()
+                    self._dispatch_locked()
+                self._timeout_requests += 1
+                logger.warning(f"请求超时: {request_id}")
+                return False
+
+            request_info = self.active_requests.get(request_id)
+            if request_info is not None and request_info.started_at is not None:
+                logger.info(f"队列请求开始执行: {request_id} "
+                           f"(等待时间: {time.time() - request_info.created_at:.1f}s)")
+                return True
+
+            # 请求不在队列中，可能已被清理
+            logger.warning(f"请求未找到: {request_id}")
+            return False
     
     async def release_request_slot(self, request_id: str, success: bool = True):
         """释放请求槽位"""
         async with self._lock:
             if request_id in self.active_requests:
                 request_info = self.active_requests.pop(request_id)
-                self.semaphore.release()
+                self._release_slot()
                 
                 if success:
-                    self.stats["successful_requests"] += 1
+                    self._successful_requests += 1
                 
                 execution_time = time.time() - (request_info.started_at or request_info.created_at)
-                logger.info(f"请求完成: {request_id[:8]}... "
+                logger.info(f"请求完成: {request_id} "
                            f"(执行时间: {execution_time:.1f}s, 成功: {success})")
                 
                 # 处理队列中的下一个请求
-                await self._process_queue()
-    
-    async def _check_rate_limit(self) -> bool:
-        """检查速率限制 (令牌桶算法)"""
-        current_time = time.time()
-        
-        # 补充令牌
-        time_passed = current_time - self.last_refill
-        self.tokens = min(
-            self.warp_limits.burst_limit,
-            self.tokens + time_passed * self.warp_limits.rate_limit_per_second
-        )
-        self.last_refill = current_time
-        
+                self._dispatch_locked()
+
+    def _release_slot(self):
+        """释放一个并发槽位（调用方需持有 self._lock）"""
+        self.active_slots = max(0, self.active_slots - 1)
+
+    def _pop_bucket_head(self, bucket_key: str) -> Optional[RequestInfo]:
+        """弹出指定桶的队首活请求；桶空则回收（调用方需持有 self._lock）"""
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            return None
+        while bucket:
+            request_id = heapq.heappop(bucket)[-1]
+            request_info = self._entries.pop(request_id, None)
+            if request_info is not None:
+                return request_info
+            # 陈旧堆项（已超时/已清理），跳过
+        del self._buckets[bucket_key]
+        self._deficit.pop(bucket_key, None)
+        return None
+
+    def _dispatch_locked(self):
+        """把队首请求调度进活跃集并唤醒等待者（调用方需持有 self._lock）
+
+        调度在释放槽位的一侧完成，等待者只需等自己的 started_at
+        被置位，不再自旋扫描队列。桶间按亏空轮转（DRR，quantum=1）：
+        每轮给各桶记 1 个配额，配额够就放行一个请求并把桶移到队尾，
+        重 IP 的积压不影响轻 IP 的调度延迟。
+        """
+        admitted = False
+        while self._entries and self.active_slots < self.max_concurrent:
+            progressed = False
+            for bucket_key in list(self._buckets.keys()):
+                if self.active_slots >= self.max_concurrent:
+                    break
+                deficit = self._deficit.get(bucket_key, 0.0) + 1.0
+                if deficit < 1.0:
+                    self._deficit[bucket_key] = deficit
+                    continue
+                request_info = self._pop_bucket_head(bucket_key)
+                if request_info is None:
+                    continue
+                self._deficit[bucket_key] = deficit - 1.0
+                self._buckets.move_to_end(bucket_key)
+
+                self.active_slots += 1
+                request_info.started_at = time.time()
+                self.active_requests[request_info.request_id] = request_info
+                self._total_requests += 1
+                n_active = len(self.active_requests)
+                if n_active > self._peak_concurrent:
+                    self._peak_concurrent = n_active
+                admitted = True
+                progressed = True
+            if not progressed:
+                break
+        if admitted:
+            self._cond.notify_all()
+
+    async def set_max_concurrent(self, new_limit: int):
+        """运行时安全调整最大并发数
+
+        asyncio.Semaphore 无法安全 resize，计数器方案只需要更新上限；
+        缩容时已占用的槽位会随请求完成自然收敛。
+        """
+        async with self._lock:
+            old_limit = self.max_concurrent
+            self.max_concurrent = max(1, new_limit)
+            logger.info(f"最大并发数调整: {old_limit} -> {self.max_concurrent}")
+            # 扩容后立即调度队列中的请求
+            self._dispatch_locked()
+
+    def _check_rate_limit(self) -> bool:
+        """检查速率限制 (令牌桶算法)
+
+        桶已满时跳过补充：不做无谓的浮点运算，也避免长期空转
+        把舍入误差累积进 tokens。方法里没有 await，保持同步在
+        持锁代码里零开销调用。
+        """
+        was_full = self.tokens >= self.warp_limits.burst_limit
+        if not was_full:
+            current_time = time.monotonic()
+            self.tokens = min(
+                self.warp_limits.burst_limit,
+                self.tokens + (current_time - self.last_refill)
+                * self.warp_limits.rate_limit_per_second
+            )
+            self.last_refill = current_time
+
         # 检查是否有可用令牌
         if self.tokens >= 1.0:
+            if was_full:
+                # 满桶期间不积累令牌：消费时把补充基准拉到当前，
+                # 否则下次补充会把满桶闲置的时间也折算成令牌
+                self.last_refill = time.monotonic()
             self.tokens -= 1.0
             return True
-        
+
         return False
     
-    async def _process_queue(self):
-        """处理队列中的请求"""
-        if not self.request_queue:
-            return
-        
-        # 按优先级排序队列
-        sorted_queue = sorted(
-            self.request_queue, 
-            key=lambda x: (-x.priority, x.created_at)
-        )
-        self.request_queue = deque(sorted_queue)
-    
-    async def _handle_request_timeout(self, request_id: str):
-        """处理请求超时"""
-        async with self._lock:
-            # 从队列中移除
-            self.request_queue = deque(
-                item for item in self.request_queue 
-                if item.request_id != request_id
-            )
-            
-            # 从活跃请求中移除
-            if request_id in self.active_requests:
-                del self.active_requests[request_id]
-                self.semaphore.release()
-            
-            self.stats["timeout_requests"] += 1
-            logger.warning(f"请求超时: {request_id[:8]}...")
-    
     def get_status(self) -> Dict[str, Any]:
-        """获取详细状态信息"""
+        """获取详细状态信息
+
+        整个方法是同步的且不 await：事件循环单线程，持锁的写方
+        都是协程，无法在本方法执行中途插入，因此这里读到的就是
+        一个一致的原子快照，不需要额外加锁。计数器仍先整体读进
+        局部变量，statistics 与 recommendations 保证基于同一组值。
+        """
         current_time = time.time()
+
+        # 一次性快照全部计数器
+        total_requests = self._total_requests
+        successful_requests = self._successful_requests
+        rejected_requests = self._rejected_requests
+        timeout_requests = self._timeout_requests
+        queued_requests = self._queued_requests
+        peak_concurrent = self._peak_concurrent
+        peak_queue_size = self._peak_queue_size
         
         # 计算队列等待时间
         avg_queue_wait = 0.0
-        if self.request_queue:
-            wait_times = [current_time - item.created_at for item in self.request_queue]
+        if self._entries:
+            wait_times = [current_time - item.created_at for item in self._entries.values()]
             avg_queue_wait = sum(wait_times) / len(wait_times)
+
+        # DRR 下每桶队首按桶序轮流被调度，取各桶队首近似"接下来的 5 个"。
+        # nsmallest(5) 是 O(n log 5)，不整桶排序也不复制整个队列；
+        # 前 5 项全是陈旧堆项的桶在预览里跳过即可
+        next_up = []
+        for bucket in self._buckets.values():
+            for entry in heapq.nsmallest(5, bucket):
+                request_info = self._entries.get(entry[-1])
+                if request_info is not None:
+                    next_up.append(request_info)
+                    break
+            if len(next_up) >= 5:
+                break
+
+        # 每个来源 IP 的排队深度
+        per_ip_queue_depth: Dict[str, int] = {}
+        for item in self._entries.values():
+            bucket_key = item.user_ip or "anon"
+            per_ip_queue_depth[bucket_key] = per_ip_queue_depth.get(bucket_key, 0) + 1
         
         return {
             "limits": {
@@ -338,21 +441,30 @@ class ConcurrencyLimiter:
             },
             "current": {
                 "active_requests": len(self.active_requests),
-                "queued_requests": len(self.request_queue),
+                "queued_requests": len(self._entries),
                 "available_tokens": round(self.tokens, 2),
                 "concurrent_utilization": len(self.active_requests) / self.warp_limits.total_max_concurrent,
-                "queue_utilization": len(self.request_queue) / self.config.max_queue_size,
+                "queue_utilization": len(self._entries) / self.config.max_queue_size,
+                "per_ip_queue_depth": per_ip_queue_depth,
                 "avg_queue_wait_time": round(avg_queue_wait, 1)
             },
-            "statistics": self.stats.copy(),
+            "statistics": {
+                "total_requests": total_requests,
+                "successful_requests": successful_requests,
+                "rejected_requests": rejected_requests,
+                "timeout_requests": timeout_requests,
+                "queued_requests": queued_requests,
+                "peak_concurrent": peak_concurrent,
+                "peak_queue_size": peak_queue_size
+            },
             "queue_details": [
                 {
-                    "request_id": item.request_id[:8] + "...",
+                    "request_id": item.request_id,
                     "priority": item.priority,
                     "wait_time": round(current_time - item.created_at, 1),
                     "video_id": item.video_id
                 }
-                for item in list(self.request_queue)[:5]  # 显示前5个
+                for item in next_up  # 显示最先被调度的5个
             ],
             "recommendations": self._get_recommendations()
         }
@@ -362,7 +474,7 @@ class ConcurrencyLimiter:
         recommendations = []
         
         utilization = len(self.active_requests) / self.warp_limits.total_max_concurrent
-        queue_utilization = len(self.request_queue) / self.config.max_queue_size
+        queue_utilization = len(self._entries) / self.config.max_queue_size
         
         if utilization > 0.8:
             recommendations.append("并发使用率过高，建议考虑升级账户或优化请求")
@@ -370,7 +482,7 @@ class ConcurrencyLimiter:
         if queue_utilization > 0.6:
             recommendations.append("队列压力较大，用户可能体验到较长等待时间")
         
-        if self.stats["rejected_requests"] > self.stats["total_requests"] * 0.1:
+        if self._rejected_requests > self._total_requests * 0.1:
             recommendations.append("拒绝率较高，建议降低请求频率或增加队列大小")
         
         if self.tokens < 1.0:
@@ -391,22 +503,41 @@ class ConcurrencyLimiter:
             ]
             
             for req_id in expired_active:
-                logger.warning(f"清理过期活跃请求: {req_id[:8]}...")
+                logger.warning(f"清理过期活跃请求: {req_id}")
                 del self.active_requests[req_id]
-                self.semaphore.release()
-                self.stats["timeout_requests"] += 1
-            
-            # 清理过期的队列请求
-            original_queue_size = len(self.request_queue)
-            self.request_queue = deque(
-                item for item in self.request_queue
-                if current_time - item.created_at <= timeout
-            )
+                self._release_slot()
+                self._timeout_requests += 1
             
-            expired_queue_count = original_queue_size - len(self.request_queue)
+            # 清理过期的队列请求（摘字典项即可，堆项留给调度侧跳过）
+            expired_queued = [
+                req_id for req_id, req_info in self._entries.items()
+                if current_time - req_info.created_at > timeout
+            ]
+            for req_id in expired_queued:
+                del self._entries[req_id]
+
+            expired_queue_count = len(expired_queued)
             if expired_queue_count > 0:
                 logger.warning(f"清理 {expired_queue_count} 个过期队列请求")
-                self.stats["timeout_requests"] += expired_queue_count
+                self._timeout_requests += expired_queue_count
+
+            # 陈旧堆项过多时压实一次，防止懒删除让堆无界增长
+            total_heaped = sum(len(b) for b in self._buckets.values())
+            if total_heaped > 2 * len(self._entries) + 16:
+                for bucket_key in list(self._buckets.keys()):
+                    bucket = [e for e in self._buckets[bucket_key]
+                              if e[-1] in self._entries]
+                    if bucket:
+                        heapq.heapify(bucket)
+                        self._buckets[bucket_key] = bucket
+                    else:
+                        del self._buckets[bucket_key]
+                        self._deficit.pop(bucket_key, None)
+
+            # 释放了槽位就调度后继；被移出队列的等待者也要唤醒去拿结果
+            self._dispatch_locked()
+            if expired_active or expired_queue_count:
+                self._cond.notify_all()
 
 
 # 全局实例
@@ -418,17 +549,3 @@ def get_concurrency_limiter(config: ConcurrencyConfig = None) -> ConcurrencyLimi
     if _limiter is None:
         _limiter = ConcurrencyLimiter(config)
     return _limiter
-
-async def start_cleanup_task():
-    """启动清理任务"""
-    limiter = get_concurrency_limiter()
-    
-    while True:
-        try:
-            await limiter.cleanup_expired_requests()
-            await asyncio.sleep(limiter.config.cleanup_interval)
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            logger.error(f"清理任务异常: {e}")
-            await asyncio.sleep(60) 
\ No newline at end of file
@@ -1,16 +1,10 @@
-import requests
-from typing import Dict, Optional
+import hmac
+from functools import cached_property
+from typing import Dict, Optional, Tuple
 
-from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
 
-def fetch_cookies_data(url: str) -> str:
-    response = requests.get(url)
-    response.raise_for_status()  # Raise an exception for HTTP errors
-    return response.text
-
-
 class Settings(BaseSettings):
     # 核心功能配置
     DIRECT_LINK_MODE: int = 1
@@ -28,6 +22,12 @@ class Settings(BaseSettings):
     DISABLE_DEMO: int = 0
     DISABLE_HOST_VALIDATION: int = 1  # Railway 部署时推荐禁用严格主机验证
     
+    # yt-dlp 解析线程池大小（有界，避免挤占默认执行器）
+    YTDLP_WORKERS: int = 8
+
+    # 系统监控采样周期（秒）
+    MONITOR_PERIOD_SECONDS: int = 30
+
     # WARP 代理池配置
     WARP_CONFIG_DIR: str = 'warp-configs'
     PROXY_HEALTH_CHECK_INTERVAL: int = 300
@@ -40,21 +40,13 @@ class Settings(BaseSettings):
     DISABLE_SIGN: int = 1
     REST_MODE: int = 0
     COOKIES_URL: str = ''
+    # COOKIES_URL 配置时由后台任务异步注水（见 background_tasks），
+    # 不在 Settings 构造期间做同步网络请求卡住启动
     COOKIES: str = ''
 
     class Config:
         env_file = "./.env"
 
-    @field_validator('COOKIES')
-    def load_cookies(cls, v, values):
-        if not v and values.data.get("COOKIES_URL"):
-            url = values.data["COOKIES_URL"]
-            try:
-                return fetch_cookies_data(url)
-            except:
-                return ''
-        return v or ''
-
     def get_domain_keys(self) -> Dict[str, str]:
         """
         解析多域名多密钥配置
@@ -76,26 +68,49 @@ class Settings(BaseSettings):
         
         return domain_keys
 
+    @cached_property
+    def _domain_key_tables(self) -> Tuple[Dict[str, str], Tuple[Tuple[str, str], ...]]:
+        """预编译的域名密钥表：精确匹配字典 + 通配符后缀元组
+
+        环境变量在进程生命周期内不变，没必要每个请求都重新
+        split 原始字符串；精确匹配退化成一次字典查找，通配符
+        只剩后缀比较。
+        """
+        exact: Dict[str, str] = {}
+        wildcards = []
+        for pattern, key in self.get_domain_keys().items():
+            if pattern.startswith('*.'):
+                wildcards.append((pattern[2:], key))
+            else:
+                exact[pattern] = key
+        return exact, tuple(wildcards)
+
     def validate_secret_for_domain(self, secret: str, domain: Optional[str] = None) -> bool:
         """
         验证密钥是否有效
         支持主密钥和域名专用密钥
+
+        所有密钥比较都走 hmac.compare_digest，避免计时侧信道。
         """
+        if not isinstance(secret, str):
+            return False
+
         # 首先检查主密钥
-        if secret == self.SECRET_KEY:
+        if hmac.compare_digest(secret, self.SECRET_KEY):
             return True
-        
+
         # 如果有域名，检查域名专用密钥
         if domain:
-            domain_keys = self.get_domain_keys()
+            exact, wildcards = self._domain_key_tables
             # 精确匹配
-            if domain in domain_keys and secret == domain_keys[domain]:
+            key = exact.get(domain)
+            if key is not None and hmac.compare_digest(secret, key):
                 return True
             # 通配符匹配
-            for pattern, key in domain_keys.items():
-                if pattern.startswith('*.') and domain.endswith(pattern[2:]) and secret == key:
+            for suffix, key in wildcards:
+                if domain.endswith(suffix) and hmac.compare_digest(secret, key):
                     return True
-        
+
         return False
 
 
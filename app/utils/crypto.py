@@ -1,10 +1,36 @@
 import base64
-import json
+import functools
+import hashlib
+import os
+import struct
 import time
+
+import orjson
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from typing import Dict, Any, Optional
 from app.utils.config import settings
 
+# 令牌布局：12 字节 nonce + 8 字节过期时间（big-endian double）+ 密文。
+# 过期时间放在明文头部并作为 AEAD 附加数据参与认证：解密前可以
+# 零成本拒绝过期令牌，又无法被篡改
+_NONCE_SIZE = 12
+_HEADER = struct.Struct(">d")
+
+
+@functools.lru_cache(maxsize=1)
+def _get_aead() -> AESGCM:
+    """返回缓存的 AES-GCM 实例
+
+    AES-GCM 在单次 OpenSSL 调用里完成加密和认证（AES-NI + GHASH），
+    比 Fernet 的 CBC + 独立 HMAC 两趟遍历快且密文更短；密钥来自
+    配置、进程内不变，用 SHA-256 派生 32 字节后构造一次反复使用。
+    """
+    key = settings.CRYPT_KEY
+    key_bytes = key.encode() if isinstance(key, str) else key
+    return AESGCM(hashlib.sha256(key_bytes).digest())
+
+
 def encrypt_data(data: Dict[str, Any], ttl: Optional[int] = None) -> str:
     """
     加密数据
@@ -18,23 +44,15 @@ def encrypt_data(data: Dict[str, Any], ttl: Optional[int] = None) -> str:
     """
     if ttl is None:
         ttl = settings.CRYPT_TTL
-    
-    # 添加时间戳和过期时间
-    payload = {
-        "data": data,
-        "timestamp": time.time(),
-        "expires_at": time.time() + ttl
-    }
-    
-    # 序列化为 JSON
-    json_data = json.dumps(payload, separators=(',', ':'))
-    
-    # 加密
-    fernet = Fernet(settings.CRYPT_KEY.encode())
-    encrypted_data = fernet.encrypt(json_data.encode())
-    
-    # 返回 base64 编码
-    return base64.urlsafe_b64encode(encrypted_data).decode()
+
+    header = _HEADER.pack(time.time() + ttl)
+    nonce = os.urandom(_NONCE_SIZE)
+
+    # 直接加密数据本身，过期时间走认证头，不再嵌套 payload 字典；
+    # orjson 直接产出紧凑 bytes，省掉 dumps + encode 两步
+    ciphertext = _get_aead().encrypt(nonce, orjson.dumps(data), header)
+
+    return base64.urlsafe_b64encode(nonce + header + ciphertext).decode()
 
 def decrypt_data(encrypted_data: str) -> Optional[Dict[str, Any]]:
     """
@@ -47,22 +65,21 @@ def decrypt_data(encrypted_data: str) -> Optional[Dict[str, Any]]:
         解密后的数据字典，如果解密失败或过期则返回 None
     """
     try:
-        # 解码 base64
-        encrypted_bytes = base64.urlsafe_b64decode(encrypted_data.encode())
-        
-        # 解密
-        fernet = Fernet(settings.CRYPT_KEY.encode())
-        decrypted_data = fernet.decrypt(encrypted_bytes)
-        
-        # 解析 JSON
-        payload = json.loads(decrypted_data.decode())
-        
-        # 检查是否过期
-        if time.time() > payload.get("expires_at", 0):
+        raw = base64.urlsafe_b64decode(encrypted_data.encode())
+        nonce = raw[:_NONCE_SIZE]
+        header = raw[_NONCE_SIZE:_NONCE_SIZE + _HEADER.size]
+
+        # 过期令牌在 AEAD 调用之前就拒绝，省掉一次解密
+        expires_at, = _HEADER.unpack(header)
+        if time.time() > expires_at:
             return None
-        
-        return payload.get("data")
-    
+
+        decrypted = _get_aead().decrypt(
+            nonce, raw[_NONCE_SIZE + _HEADER.size:], header
+        )
+        # orjson 直接接受 bytes，少一次 decode
+        return orjson.loads(decrypted)
+
     except Exception:
         return None
 
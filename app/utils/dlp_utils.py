@@ -1,5 +1,9 @@
 import re
 
+# YouTube 视频 ID 格式（模块级预编译，调用方直接用 C 级匹配）
+YOUTUBE_VIDEO_ID_PATTERN = r'^[a-zA-Z0-9_-]{11}$'
+_VIDEO_ID_RE = re.compile(YOUTUBE_VIDEO_ID_PATTERN)
+
 
 class DLPUtils:
     @staticmethod
@@ -39,5 +43,4 @@ class DLPUtils:
         Returns:
         bool: True if the video ID is valid, False otherwise.
         """
-        pattern = re.compile(r'^[a-zA-Z0-9_-]{11}$')
-        return bool(pattern.match(video_id))
+        return bool(_VIDEO_ID_RE.match(video_id))
@@ -12,9 +12,9 @@
 
 import asyncio
 import logging
+import random
 import time
-import statistics
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from collections import deque
@@ -25,7 +25,7 @@ from .concurrency_limiter import get_concurrency_limiter
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(slots=True)
 class ScalingMetrics:
     """扩容指标"""
     avg_response_time: float = 0.0
@@ -33,9 +33,9 @@ class ScalingMetrics:
     queue_length: int = 0
     error_rate: float = 0.0
     config_count: int = 0
-    timestamp: datetime = None
+    timestamp: float = 0.0  # time.time() 时间戳，仅输出时才格式化
 
-@dataclass 
+@dataclass(slots=True)
 class ScalingLimits:
     """扩容限制配置"""
     # 基础限制
@@ -47,27 +47,100 @@ class ScalingLimits:
     max_response_time: float = 3.0  # 秒
     max_queue_length: int = 20
     max_error_rate: float = 0.1  # 10%
-    
+
+    # PI 控制器参数：以 avg_response_time - target_response_time 为误差
+    # 信号，控制器直接输出期望配置数，代替原来的硬阈值判断
+    # （硬阈值在设定点附近来回震荡，白白消耗 Cloudflare 注册额度）
+    target_response_time: float = 1.5  # 秒，控制器设定点
+    k_p: float = 2.0  # 比例增益：稳态误差每 1 秒约对应 2 个配置
+    k_i: float = 0.05  # 积分增益：消除持续的稳态误差
+    err_alpha: float = 0.3  # 误差低通滤波系数（平滑瞬时毛刺）
+    integral_min: float = -60.0  # 积分饱和下限
+    integral_max: float = 60.0  # 积分饱和上限
+
     # 扩容控制
-    scale_up_threshold: float = 2.0  # 响应时间阈值
-    scale_down_threshold: float = 1.0  # 响应时间阈值
     scale_cooldown: int = 300  # 5分钟冷却期
     max_scale_per_hour: int = 3  # 每小时最多扩容3次
     
     # API 调用限制（防止触发 Cloudflare 限制）
-    api_call_interval: int = 60  # 每次 API 调用间隔
     max_concurrent_registrations: int = 2  # 最大并发注册数
 
+class _AsyncThrottler:
+    """异步令牌桶限流器：period 秒内最多放行 rate_limit 次
+
+    用时间戳 deque 实现：桶未满时立即放行（允许突发），满了等最老
+    的一条过期。用于 Cloudflare 注册限速——原来的固定 60s 串行
+    sleep 即使并发信号量有空闲也在干等。
+    """
+
+    __slots__ = ("rate_limit", "period", "_timestamps")
+
+    def __init__(self, rate_limit: int, period: float):
+        self.rate_limit = rate_limit
+        self.period = period
+        self._timestamps: deque = deque()
+
+    async def __aenter__(self):
+        while True:
+            now = time.monotonic()
+            # 淘汰窗口外的时间戳
+            while self._timestamps and now - self._timestamps[0] > self.period:
+                self._timestamps.popleft()
+            if len(self._timestamps) < self.rate_limit:
+                self._timestamps.append(now)
+                return self
+            # 等最老的一条滑出窗口
+            await asyncio.sleep(self.period - (now - self._timestamps[0]))
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
 class DynamicWARPScaler:
     """动态 WARP 扩容器"""
     
     def __init__(self, limits: ScalingLimits = None):
         self.limits = limits or ScalingLimits()
         self.metrics_history: deque = deque(maxlen=100)  # 保留最近100个指标
-        self.last_scale_time: Optional[datetime] = None
-        self.scale_operations_per_hour: List[datetime] = []
+        # 上次扩缩容时刻（time.monotonic()；冷却期是纯时长运算，
+        # 不需要也不应该用墙钟）
+        self.last_scale_time: Optional[float] = None
+        # 最近一小时的扩缩容时刻（time.monotonic() 浮点数，左端过期弹出）
+        self.scale_operations_per_hour: deque = deque()
         self.is_scaling: bool = False
-        
+
+        # PI 控制器状态
+        self._filtered_err: float = 0.0  # 低通滤波后的误差
+        self._integral: float = 0.0  # 误差积分（带饱和钳制）
+        self._last_control_time: Optional[float] = None
+
+        # 自适应步长/冷却期：连续同号误差说明容量方向没追上，
+        # 步长加大、冷却减半；误差变号说明上次动作过冲，反向收敛
+        self._last_err_sign: int = 0
+        self._scale_step: int = 2
+        self._cooldown: float = float(self.limits.scale_cooldown)
+
+        # Cloudflare 注册限流：小时额度的 4/3 倍作桶容量，允许首批
+        # 注册快速突发，超过后平滑排队
+        self._cf_throttler = _AsyncThrottler(
+            rate_limit=self.limits.max_scale_per_hour * 4, period=3600)
+
+        # get_status 的 1s TTL 缓存：(单调时间戳, 结果)
+        self._status_cache: Optional[Tuple[float, Dict]] = None
+
+        # _get_recommendations 的记忆化：建议文案只依赖粗粒度的
+        # 指标档位，档位不变时直接复用上次的列表
+        self._last_rec_key: Optional[tuple] = None
+        self._last_rec_list: List[str] = []
+
+        # 指标数值列（SoA）：估算辅助函数只用到这几列数字，单独
+        # 维护带运行总和的列队列，读取就是一次除法，不再每次从
+        # metrics_history 里抽对象遍历
+        self._queue_win: deque = deque()  # 最近10个队列长度
+        self._queue_sum: int = 0
+        self._load_win: deque = deque()  # 最近5个 活跃+排队 总量
+        self._load_sum: int = 0
+
         # 依赖组件
         self.warp_optimizer = None
         self.concurrency_limiter = None
@@ -108,49 +181,58 @@ class DynamicWARPScaler:
                 queue_length=concurrency_status.get("queued_requests", 0),
                 error_rate=error_rate,
                 config_count=warp_status.get("healthy_configs", 0),
-                timestamp=datetime.now()
+                timestamp=time.time()
             )
             
-            # 添加到历史记录
+            # 添加到历史记录和数值列
             self.metrics_history.append(metrics)
-            
+            self._push_columns(metrics)
+
             return metrics
             
         except Exception as e:
             logger.error(f"收集指标失败: {e}")
-            return ScalingMetrics(timestamp=datetime.now())
+            return ScalingMetrics(timestamp=time.time())
     
+    def _push_columns(self, metrics: ScalingMetrics):
+        """把新指标的数值推入列窗口并维护运行总和"""
+        self._queue_win.append(metrics.queue_length)
+        self._queue_sum += metrics.queue_length
+        if len(self._queue_win) > 10:
+            self._queue_sum -= self._queue_win.popleft()
+
+        load = metrics.active_connections + metrics.queue_length
+        self._load_win.append(load)
+        self._load_sum += load
+        if len(self._load_win) > 5:
+            self._load_sum -= self._load_win.popleft()
+
     def _calculate_avg_response_time(self) -> float:
-        """计算平均响应时间（简化实现）"""
-        if len(self.metrics_history) == 0:
-            return 1.0
-        
-        # 基于队列长度估算响应时间
-        recent_metrics = list(self.metrics_history)[-10:]  # 最近10个指标
-        queue_lengths = [m.queue_length for m in recent_metrics]
-        
-        if not queue_lengths:
+        """计算平均响应时间（简化实现）
+
+        均值直接取列窗口的运行总和，O(1)。
+        """
+        if not self._queue_win:
             return 1.0
-        
-        avg_queue = statistics.mean(queue_lengths)
+
+        avg_queue = self._queue_sum / len(self._queue_win)
         # 简化计算：队列越长，响应时间越长
         estimated_time = 1.0 + (avg_queue * 0.1)
-        
+
         return min(estimated_time, 10.0)  # 最大10秒
-    
+
     def _calculate_error_rate(self) -> float:
         """计算错误率（简化实现）"""
         if len(self.metrics_history) == 0:
             return 0.0
-        
-        # 基于配置数量和负载估算错误率
-        recent_metrics = list(self.metrics_history)[-5:]
-        total_requests = sum(m.active_connections + m.queue_length for m in recent_metrics)
-        config_count = recent_metrics[-1].config_count if recent_metrics else 5
-        
+
+        # 基于配置数量和负载估算错误率（负载总量取列窗口的运行总和）
+        total_requests = self._load_sum
+        config_count = self.metrics_history[-1].config_count
+
         if total_requests == 0:
             return 0.0
-        
+
         # 简化计算：配置不足时错误率升高
         if config_count < self.limits.min_configs:
             return 0.2
@@ -159,82 +241,79 @@ class DynamicWARPScaler:
         else:
             return 0.02
     
-    def should_scale_up(self, metrics: ScalingMetrics) -> bool:
-        """判断是否应该扩容"""
+    def _can_scale(self) -> bool:
+        """扩缩容的公共前置检查：进行中 / 冷却期"""
         if self.is_scaling:
             logger.debug("正在扩容中，跳过")
             return False
-        
-        # 检查冷却期
-        if self.last_scale_time:
-            time_since_last = (datetime.now() - self.last_scale_time).total_seconds()
-            if time_since_last < self.limits.scale_cooldown:
-                logger.debug(f"冷却期内，剩余 {self.limits.scale_cooldown - time_since_last:.0f} 秒")
-                return False
-        
-        # 检查每小时扩容次数限制
-        if self._get_scales_in_last_hour() >= self.limits.max_scale_per_hour:
-            logger.warning("已达到每小时最大扩容次数限制")
-            return False
-        
-        # 检查是否已达到最大配置数
-        if metrics.config_count >= self.limits.max_configs:
-            logger.debug(f"已达到最大配置数限制: {self.limits.max_configs}")
-            return False
-        
-        # 性能指标检查
-        should_scale = (
-            metrics.avg_response_time > self.limits.scale_up_threshold or
-            metrics.queue_length > self.limits.max_queue_length or
-            metrics.error_rate > self.limits.max_error_rate
-        )
-        
-        if should_scale:
-            logger.info(f"满足扩容条件: 响应时间={metrics.avg_response_time:.2f}s, "
-                       f"队列长度={metrics.queue_length}, 错误率={metrics.error_rate:.2%}")
-        
-        return should_scale
-    
-    def should_scale_down(self, metrics: ScalingMetrics) -> bool:
-        """判断是否应该缩容"""
-        if self.is_scaling:
-            return False
-        
-        # 检查冷却期
-        if self.last_scale_time:
-            time_since_last = (datetime.now() - self.last_scale_time).total_seconds()
-            if time_since_last < self.limits.scale_cooldown:
+
+        if self.last_scale_time is not None:
+            time_since_last = time.monotonic() - self.last_scale_time
+            if time_since_last < self._cooldown:
+                logger.debug(f"冷却期内，剩余 {self._cooldown - time_since_last:.0f} 秒")
                 return False
-        
-        # 检查是否已达到最小配置数
-        if metrics.config_count <= self.limits.min_configs:
-            return False
-        
-        # 检查是否有持续的低负载
-        if len(self.metrics_history) < 5:
-            return False
-        
-        recent_metrics = list(self.metrics_history)[-5:]
-        all_low_load = all(
-            m.avg_response_time < self.limits.scale_down_threshold and
-            m.queue_length == 0 and
-            m.error_rate < 0.05
-            for m in recent_metrics
-        )
-        
-        if all_low_load:
-            logger.info("检测到持续低负载，考虑缩容")
-        
-        return all_low_load
-    
+
+        return True
+
+    def _adapt_step(self):
+        """扩缩容后按误差符号调整步长和冷却期
+
+        与上次动作同号 → 上次步长不够，步长 +1（上限 4）、冷却减半
+        （下限 60s）；变号 → 出现过冲，步长 -1（下限 1）、冷却翻倍
+        （上限 900s）。
+        """
+        sign = 1 if self._filtered_err > 0 else (-1 if self._filtered_err < 0 else 0)
+        if sign == 0:
+            return
+
+        if sign == self._last_err_sign:
+            self._scale_step = min(self._scale_step + 1, 4)
+            self._cooldown = max(self._cooldown / 2, 60.0)
+        else:
+            self._scale_step = max(self._scale_step - 1, 1)
+            self._cooldown = min(self._cooldown * 2, 900.0)
+        self._last_err_sign = sign
+
+    def _desired_config_count(self, metrics: ScalingMetrics) -> int:
+        """PI 控制器：根据响应时间误差计算期望配置数
+
+        误差先过一阶低通滤波（filtered = α·err + (1-α)·filtered），
+        再积分并做饱和钳制，期望值 = 目标配置数 + K_p·滤波误差 +
+        K_i·积分，最后钳到 [min_configs, max_configs]。相比硬阈值，
+        控制器在设定点附近收敛而不是来回震荡。
+        """
+        limits = self.limits
+        now = time.monotonic()
+        # 两次控制之间的实际间隔，首次或间隔异常时按 60s 计
+        if self._last_control_time is None:
+            dt = 60.0
+        else:
+            dt = min(now - self._last_control_time, 300.0)
+        self._last_control_time = now
+
+        err = metrics.avg_response_time - limits.target_response_time
+        self._filtered_err = (limits.err_alpha * err +
+                              (1 - limits.err_alpha) * self._filtered_err)
+        self._integral = max(limits.integral_min,
+                             min(limits.integral_max,
+                                 self._integral + self._filtered_err * dt))
+
+        desired = (limits.target_configs +
+                   limits.k_p * self._filtered_err +
+                   limits.k_i * self._integral)
+        return max(limits.min_configs, min(limits.max_configs, round(desired)))
+
+
     def _get_scales_in_last_hour(self) -> int:
-        """获取过去一小时的扩容次数"""
-        one_hour_ago = datetime.now() - timedelta(hours=1)
-        self.scale_operations_per_hour = [
-            op_time for op_time in self.scale_operations_per_hour 
-            if op_time > one_hour_ago
-        ]
-        return len(self.scale_operations_per_hour)
+        """获取过去一小时的扩容次数
+
+        deque 左端弹出过期条目（O(过期数)），不再每次调用都重建列表。
+        """
+        one_hour_ago = time.monotonic() - 3600
+        ops = self.scale_operations_per_hour
+        while ops and ops[0] <= one_hour_ago:
+            ops.popleft()
+        return len(ops)
     
     async def scale_up(self, target_count: int = None) -> bool:
         """扩容操作"""
@@ -247,9 +326,9 @@ class DynamicWARPScaler:
             current_metrics = self.collect_metrics()
             current_count = current_metrics.config_count
             
-            # 确定目标数量
+            # 确定目标数量（自适应步长代替固定 +2）
             if target_count is None:
-                target_count = min(current_count + 2, self.limits.max_configs)
+                target_count = min(current_count + self._scale_step, self.limits.max_configs)
             
             add_count = target_count - current_count
             if add_count <= 0:
@@ -263,27 +342,44 @@ class DynamicWARPScaler:
             
             async def add_single_config(index: int) -> bool:
                 async with semaphore:
-                    try:
-                        logger.info(f"正在生成第 {index+1} 个新配置...")
-                        
-                        # 添加延迟，避免过于频繁的API调用
-                        if index > 0:
-                            await asyncio.sleep(self.limits.api_call_interval)
-                        
-                        config_path = await self.warp_optimizer.warp_manager.add_new_config(
-                            f"warp_scale_{int(time.time())}_{index+1:02d}.conf"
-                        )
-                        
-                        if config_path:
-                            logger.info(f"✅ 成功添加配置: {config_path}")
-                            return True
-                        else:
-                            logger.error(f"❌ 添加配置失败: {index+1}")
-                            return False
-                            
-                    except Exception as e:
-                        logger.error(f"添加配置异常 {index+1}: {e}")
-                        return False
+                    # 指数退避重试：瞬时的 429/503 不应立刻计为失败，
+                    # 否则 success_count 偏低会触发更多 scale_up 重试、
+                    # 消耗更多 API 额度
+                    for attempt in range(3):
+                        try:
+                            logger.info(f"正在生成第 {index+1} 个新配置...")
+
+                            # 令牌桶限速代替固定间隔 sleep：额度内突发放行，
+                            # 信号量继续约束同时在途的注册请求数
+                            async with self._cf_throttler:
+                                config_path = await self.warp_optimizer.warp_manager.add_new_config(
+                                    f"warp_scale_{int(time.time())}_{index+1:02d}.conf"
+                                )
+
+                            if config_path:
+                                logger.info(f"✅ 成功添加配置: {config_path}")
+                                return True
+                            logger.warning(f"添加配置返回空: {index+1} (第{attempt+1}次)")
+                            delay = None
+
+                        except asyncio.CancelledError:
+                            raise
+                        except Exception as e:
+                            logger.warning(f"添加配置异常 {index+1} (第{attempt+1}次): {e}")
+                            # 429 带 Retry-After 时优先遵守服务端给的等待时间
+                            retry_after = None
+                            if getattr(e, 'status', None) == 429:
+                                headers = getattr(e, 'headers', None) or {}
+                                retry_after = headers.get('Retry-After')
+                            delay = float(retry_after) if retry_after else None
+
+                        if attempt < 2:
+                            if delay is None:
+                                delay = min(2 * 2 ** attempt + random.uniform(0, 1), 30)
+                            await asyncio.sleep(delay)
+
+                    logger.error(f"❌ 添加配置失败（重试耗尽）: {index+1}")
+                    return False
             
             # 并发添加配置
             tasks = [add_single_config(i) for i in range(add_count)]
@@ -291,10 +387,11 @@ class DynamicWARPScaler:
             
             success_count = sum(1 for r in results if r is True)
             
-            # 更新记录
-            self.last_scale_time = datetime.now()
+            # 更新记录并调整自适应步长/冷却期
+            self.last_scale_time = time.monotonic()
             self.scale_operations_per_hour.append(self.last_scale_time)
-            
+            self._adapt_step()
+
             # 触发优化器更新
             await self.warp_optimizer.force_optimization()
             
@@ -332,9 +429,10 @@ class DynamicWARPScaler:
             # 缩容逻辑（移除不健康的配置）
             result = await self.warp_optimizer.force_optimization()
             
-            self.last_scale_time = datetime.now()
+            self.last_scale_time = time.monotonic()
             self.scale_operations_per_hour.append(self.last_scale_time)
-            
+            self._adapt_step()
+
             logger.info(f"✅ 缩容完成")
             return True
             
@@ -344,24 +442,50 @@ class DynamicWARPScaler:
         finally:
             self.is_scaling = False
     
+    def _decide_scale(self) -> Tuple[str, int]:
+        """单遍决策：收集指标、跑控制器、过守卫
+
+        返回 ("up"|"down"|"none", 目标配置数)。指标收集、控制器
+        更新和冷却/额度检查在一次调用里完成，monitor_and_scale
+        只负责按返回的动作分发。
+        """
+        metrics = self.collect_metrics()
+
+        logger.debug(f"指标: 响应时间={metrics.avg_response_time:.2f}s, "
+                    f"活跃连接={metrics.active_connections}, "
+                    f"队列长度={metrics.queue_length}, "
+                    f"错误率={metrics.error_rate:.2%}, "
+                    f"配置数={metrics.config_count}")
+
+        # PI 控制器直接给出期望配置数，仅在与当前不一致时动作
+        desired = self._desired_config_count(metrics)
+        current = metrics.config_count
+
+        if desired == current or not self._can_scale():
+            return ("none", current)
+
+        if desired > current:
+            if self._get_scales_in_last_hour() >= self.limits.max_scale_per_hour:
+                logger.warning("已达到每小时最大扩容次数限制")
+                return ("none", current)
+            logger.info(f"控制器建议扩容: {current} → {desired} "
+                        f"(滤波误差={self._filtered_err:.2f}s)")
+            return ("up", desired)
+
+        logger.info(f"控制器建议缩容: {current} → {desired} "
+                    f"(滤波误差={self._filtered_err:.2f}s)")
+        return ("down", desired)
+
     async def monitor_and_scale(self):
         """监控并执行自动扩缩容"""
         try:
-            # 收集指标
-            metrics = self.collect_metrics()
-            
-            logger.debug(f"指标: 响应时间={metrics.avg_response_time:.2f}s, "
-                        f"活跃连接={metrics.active_connections}, "
-                        f"队列长度={metrics.queue_length}, "
-                        f"错误率={metrics.error_rate:.2%}, "
-                        f"配置数={metrics.config_count}")
-            
-            # 判断是否需要扩容
-            if self.should_scale_up(metrics):
-                await self.scale_up()
-            elif self.should_scale_down(metrics):
-                await self.scale_down()
-            
+            action, target = self._decide_scale()
+
+            if action == "up":
+                await self.scale_up(target_count=target)
+            elif action == "down":
+                await self.scale_down(target_count=target)
+
         except Exception as e:
             logger.error(f"监控扩容失败: {e}")
     
@@ -378,10 +502,18 @@ class DynamicWARPScaler:
                 await asyncio.sleep(interval)
     
     def get_status(self) -> Dict:
-        """获取扩容器状态"""
+        """获取扩容器状态
+
+        1s TTL 缓存：仪表盘通常 1-5s 轮询，突发的并发状态请求共享
+        一次指标收集（collect_metrics 会级联查询限制器和优化器）。
+        """
+        now = time.monotonic()
+        if self._status_cache and now - self._status_cache[0] < 1.0:
+            return self._status_cache[1]
+
         current_metrics = self.collect_metrics() if self.metrics_history else ScalingMetrics()
-        
-        return {
+
+        result = {
             "scaling_limits": {
                 "min_configs": self.limits.min_configs,
                 "max_configs": self.limits.max_configs,
@@ -399,18 +531,39 @@ class DynamicWARPScaler:
             },
             "scaling_status": {
                 "is_scaling": self.is_scaling,
-                "last_scale_time": self.last_scale_time.isoformat() if self.last_scale_time else None,
+                # 单调时间只在输出边界换算回墙钟再格式化
+                "last_scale_time": (
+                    datetime.fromtimestamp(
+                        time.time() - (time.monotonic() - self.last_scale_time)
+                    ).isoformat()
+                    if self.last_scale_time is not None else None
+                ),
                 "scales_in_last_hour": self._get_scales_in_last_hour(),
                 "metrics_history_count": len(self.metrics_history)
             },
             "recommendations": self._get_recommendations(current_metrics)
         }
-    
+
+        self._status_cache = (now, result)
+        return result
+
     def _get_recommendations(self, metrics: ScalingMetrics) -> List[str]:
-        """获取扩容建议"""
+        """获取扩容建议
+
+        按粗粒度指标档位记忆化：档位元组没变就复用上次的文案列表，
+        省掉每次状态轮询的一串 f-string 格式化。
+        """
+        key = (round(metrics.avg_response_time, 1),
+               metrics.queue_length // 5,
+               round(metrics.error_rate, 2),
+               metrics.config_count,
+               self._get_scales_in_last_hour())
+        if key == self._last_rec_key:
+            return self._last_rec_list
+
         recommendations = []
-        
-        if metrics.avg_response_time > self.limits.scale_up_threshold:
+
+        if metrics.avg_response_time > self.limits.max_response_time:
             recommendations.append(f"响应时间过高 ({metrics.avg_response_time:.2f}s)，建议扩容")
         
         if metrics.queue_length > self.limits.max_queue_length:
@@ -430,7 +583,9 @@ class DynamicWARPScaler:
         
         if not recommendations:
             recommendations.append("系统运行状态良好")
-        
+
+        self._last_rec_key = key
+        self._last_rec_list = recommendations
         return recommendations
 
 
@@ -0,0 +1,46 @@
+"""
+健康检查端点的 TTL 响应缓存
+
+/ip-check、/warp-test、/warp-status 每次调用都会对外发起 HTTP 请求
+（warp-test 甚至跑一次 yt-dlp 解析）。在监控/负载均衡轮询下，这会把
+探测流量放大成对外部服务的持续请求。这里按端点名缓存序列化后的响应，
+TTL 窗口内的所有调用共享同一次真实探测。
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+import orjson
+
+# key -> (过期时间 monotonic, 序列化响应体)
+_cache: Dict[str, Tuple[float, bytes]] = {}
+# 每个 key 一把锁：TTL 过期瞬间的并发请求只触发一次真实刷新
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def get_or_set(key: str, ttl: float,
+                     producer: Callable[[], Awaitable[Any]],
+                     refresh: bool = False) -> Tuple[bytes, bool]:
+    """读取缓存或执行 producer 刷新
+
+    返回 (响应体 bytes, 是否命中缓存)。refresh=True 时跳过读取，
+    供运维带 ?refresh=1 强制刷新。
+    """
+    if not refresh:
+        entry = _cache.get(key)
+        if entry and time.monotonic() < entry[0]:
+            return entry[1], True
+
+    lock = _locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # 拿到锁后二次检查：排队期间可能已被其他请求刷新
+        if not refresh:
+            entry = _cache.get(key)
+            if entry and time.monotonic() < entry[0]:
+                return entry[1], True
+
+        value = await producer()
+        body = orjson.dumps(value)
+        _cache[key] = (time.monotonic() + ttl, body)
+        return body, False
@@ -1,14 +1,16 @@
 import time
-import asyncio
 import logging
 from collections import defaultdict, deque
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# 小时统计环形缓冲的槽数（7天 × 24小时）
+_HOURLY_SLOTS = 168
+
+@dataclass(slots=True)
 class RequestMetrics:
     """单次请求指标"""
     timestamp: float
@@ -19,7 +21,7 @@ class RequestMetrics:
     error_type: Optional[str] = None
     response_size: int = 0
     
-@dataclass
+@dataclass(slots=True)
 class SystemMetrics:
     """系统指标"""
     timestamp: float
@@ -28,9 +30,59 @@ class SystemMetrics:
     active_requests: int = 0
     queue_size: int = 0
 
+class _SlidingWindow:
+    """分桶滑动窗口聚合
+
+    end_request 时 O(1) 更新当前桶并累加运行总量，过期桶从左侧
+    弹出时把贡献减掉；读取统计就是取三个现成的总量，不再每次
+    查询都遍历整条请求历史。
+    """
+
+    __slots__ = ("bucket_size", "num_buckets", "_buckets",
+                 "count", "success_count", "time_sum")
+
+    def __init__(self, window_seconds: float, num_buckets: int):
+        self.bucket_size: float = window_seconds / num_buckets
+        self.num_buckets: int = num_buckets
+        # 每桶: [桶序号, 请求数, 成功数, 处理时间和]
+        self._buckets: deque = deque()
+        self.count: int = 0
+        self.success_count: int = 0
+        self.time_sum: float = 0.0
+
+    def _evict(self, bucket_idx: int):
+        min_idx = bucket_idx - self.num_buckets + 1
+        buckets = self._buckets
+        while buckets and buckets[0][0] < min_idx:
+            _, count, success, time_sum = buckets.popleft()
+            self.count -= count
+            self.success_count -= success
+            self.time_sum -= time_sum
+
+    def add(self, now: float, success: bool, processing_time: float):
+        bucket_idx = int(now // self.bucket_size)
+        self._evict(bucket_idx)
+        buckets = self._buckets
+        if not buckets or buckets[-1][0] != bucket_idx:
+            buckets.append([bucket_idx, 0, 0, 0.0])
+        bucket = buckets[-1]
+        bucket[1] += 1
+        bucket[3] += processing_time
+        self.count += 1
+        self.time_sum += processing_time
+        if success:
+            bucket[2] += 1
+            self.success_count += 1
+
+    def totals(self, now: float) -> tuple:
+        """返回 (请求数, 成功数, 处理时间和)，先淘汰过期桶"""
+        self._evict(int(now // self.bucket_size))
+        return self.count, self.success_count, self.time_sum
+
+
 class PerformanceMetrics:
     """性能指标管理器"""
-    
+
     def __init__(self, history_size: int = 1000):
         self.history_size = history_size
         
@@ -42,143 +94,150 @@ class PerformanceMetrics:
         
         # 实时统计
         self.active_requests: Dict[str, float] = {}  # request_id -> start_time
-        self.hourly_stats: Dict[str, Dict] = defaultdict(lambda: {
-            "total_requests": 0,
-            "successful_requests": 0,
-            "failed_requests": 0,
-            "total_processing_time": 0.0,
-            "avg_processing_time": 0.0
-        })
-        
+
+        # 滑动窗口聚合：10分钟窗口用10秒桶，1小时窗口用60秒桶
+        self._window_10m = _SlidingWindow(600, 60)
+        self._window_1h = _SlidingWindow(3600, 60)
+
+        # get_current_stats 的 1s TTL 缓存：(单调时间戳, 结果)
+        self._stats_cache: Optional[tuple] = None
+
+        # 小时统计：168 槽（7天）环形缓冲，按 int(时间戳//3600) % 168
+        # 取槽，slot["epoch"] 标记所属小时以识别被复用的陈旧槽。
+        # O(1) 读写、零字符串格式化、无需清理任务
+        self.hourly_stats: List[Dict] = [
+            {
+                "epoch": -1,
+                "total_requests": 0,
+                "successful_requests": 0,
+                "failed_requests": 0,
+                "total_processing_time": 0.0,
+                "avg_processing_time": 0.0
+            }
+            for _ in range(_HOURLY_SLOTS)
+        ]
+
         # 代理使用统计
         self.proxy_stats: Dict[str, Dict] = defaultdict(lambda: {
             "requests": 0,
             "successes": 0,
             "failures": 0,
             "total_time": 0.0,
-            "avg_time": 0.0
+            "avg_time": 0.0,
+            "success_rate": 0.0
         })
         
-        self._lock = asyncio.Lock()
-    
-    async def start_request(self, request_id: str) -> float:
+    # 注：所有方法都只在事件循环线程里调用，单线程下每个方法体
+    # 本身就是原子的，不需要 asyncio.Lock——去掉锁后记录指标不再
+    # 有挂起点，方法直接变成同步调用
+
+    def start_request(self, request_id: str) -> float:
         """开始记录请求"""
         start_time = time.time()
-        async with self._lock:
-            self.active_requests[request_id] = start_time
+        self.active_requests[request_id] = start_time
         return start_time
-    
-    async def end_request(self, 
-                         request_id: str, 
-                         video_id: str,
-                         success: bool = True,
-                         error_type: Optional[str] = None,
-                         proxy_used: Optional[str] = None,
-                         response_size: int = 0) -> float:
+
+    def end_request(self,
+                    request_id: str,
+                    video_id: str,
+                    success: bool = True,
+                    error_type: Optional[str] = None,
+                    proxy_used: Optional[str] = None,
+                    response_size: int = 0) -> float:
         """结束记录请求"""
-        end_time = time.time()
+        end_time: float = time.time()
+
+        start_time: float = self.active_requests.pop(request_id, end_time)
+        processing_time: float = end_time - start_time
         
-        async with self._lock:
-            start_time = self.active_requests.pop(request_id, end_time)
-            processing_time = end_time - start_time
-            
-            # 记录请求指标
-            metrics = RequestMetrics(
-                timestamp=end_time,
-                video_id=video_id,
-                processing_time=processing_time,
-                proxy_used=proxy_used,
-                success=success,
-                error_type=error_type,
-                response_size=response_size
-            )
-            
-            self.request_history.append(metrics)
-            
-            # 更新小时统计
-            hour_key = datetime.fromtimestamp(end_time).strftime("%Y-%m-%d %H")
-            stats = self.hourly_stats[hour_key]
-            stats["total_requests"] += 1
-            stats["total_processing_time"] += processing_time
+        # 记录请求指标
+        metrics = RequestMetrics(
+            timestamp=end_time,
+            video_id=video_id,
+            processing_time=processing_time,
+            proxy_used=proxy_used,
+            success=success,
+            error_type=error_type,
+            response_size=response_size
+        )
+        
+        self.request_history.append(metrics)
+
+        # 更新滑动窗口聚合
+        self._window_10m.add(end_time, success, processing_time)
+        self._window_1h.add(end_time, success, processing_time)
+
+        # 更新小时统计（环形槽，跨周复用时先清零）
+        hour_epoch: int = int(end_time // 3600)
+        stats: Dict = self.hourly_stats[hour_epoch % _HOURLY_SLOTS]
+        if stats["epoch"] != hour_epoch:
+            stats.update(epoch=hour_epoch, total_requests=0,
+                         successful_requests=0, failed_requests=0,
+                         total_processing_time=0.0, avg_processing_time=0.0)
+        stats["total_requests"] += 1
+        stats["total_processing_time"] += processing_time
+        
+        if success:
+            stats["successful_requests"] += 1
+        else:
+            stats["failed_requests"] += 1
+        
+        # 计算平均处理时间
+        if stats["total_requests"] > 0:
+            stats["avg_processing_time"] = stats["total_processing_time"] / stats["total_requests"]
+        
+        # 更新代理统计
+        if proxy_used:
+            proxy_stat: Dict = self.proxy_stats[proxy_used]
+            proxy_stat["requests"] += 1
+            proxy_stat["total_time"] += processing_time
             
             if success:
-                stats["successful_requests"] += 1
+                proxy_stat["successes"] += 1
             else:
-                stats["failed_requests"] += 1
-            
-            # 计算平均处理时间
-            if stats["total_requests"] > 0:
-                stats["avg_processing_time"] = stats["total_processing_time"] / stats["total_requests"]
-            
-            # 更新代理统计
-            if proxy_used:
-                proxy_stat = self.proxy_stats[proxy_used]
-                proxy_stat["requests"] += 1
-                proxy_stat["total_time"] += processing_time
-                
-                if success:
-                    proxy_stat["successes"] += 1
-                else:
-                    proxy_stat["failures"] += 1
-                
-                # 计算平均时间
-                if proxy_stat["requests"] > 0:
-                    proxy_stat["avg_time"] = proxy_stat["total_time"] / proxy_stat["requests"]
+                proxy_stat["failures"] += 1
+
+            # 增量维护平均时间和成功率，读取侧不用再做除法
+            proxy_stat["avg_time"] = proxy_stat["total_time"] / proxy_stat["requests"]
+            proxy_stat["success_rate"] = proxy_stat["successes"] / proxy_stat["requests"]
         
         return processing_time
     
-    async def record_system_metrics(self, 
-                                  cpu_usage: float, 
-                                  memory_usage: float, 
-                                  queue_size: int = 0):
+    def record_system_metrics(self,
+                              cpu_usage: float,
+                              memory_usage: float,
+                              queue_size: int = 0):
         """记录系统指标"""
-        async with self._lock:
-            metrics = SystemMetrics(
-                timestamp=time.time(),
-                cpu_usage=cpu_usage,
-                memory_usage=memory_usage,
-                active_requests=len(self.active_requests),
-                queue_size=queue_size
-            )
-            self.system_history.append(metrics)
+        self.system_history.append(SystemMetrics(
+            timestamp=time.time(),
+            cpu_usage=cpu_usage,
+            memory_usage=memory_usage,
+            active_requests=len(self.active_requests),
+            queue_size=queue_size
+        ))
     
     def get_current_stats(self) -> Dict[str, Any]:
-        """获取当前统计信息"""
+        """获取当前统计信息
+
+        直接读滑动窗口维护的运行总量，O(1)，不再遍历请求历史；
+        附带 1s TTL 缓存，状态接口被并发轮询时共享同一份结果。
+        """
+        mono = time.monotonic()
+        if self._stats_cache and mono - self._stats_cache[0] < 1.0:
+            return self._stats_cache[1]
+
         now = time.time()
-        
-        # 最近1小时的请求
-        recent_requests = [
-            r for r in self.request_history 
-            if now - r.timestamp <= 3600
-        ]
-        
-        # 最近10分钟的请求
-        recent_10min = [
-            r for r in recent_requests
-            if now - r.timestamp <= 600
-        ]
-        
-        # 计算统计
-        total_recent = len(recent_requests)
-        successful_recent = sum(1 for r in recent_requests if r.success)
-        
-        total_10min = len(recent_10min)
-        successful_10min = sum(1 for r in recent_10min if r.success)
-        
-        # 平均处理时间
-        avg_time_1h = 0.0
-        avg_time_10m = 0.0
-        
-        if recent_requests:
-            avg_time_1h = sum(r.processing_time for r in recent_requests) / len(recent_requests)
-        
-        if recent_10min:
-            avg_time_10m = sum(r.processing_time for r in recent_10min) / len(recent_10min)
-        
+
+        total_recent, successful_recent, time_sum_1h = self._window_1h.totals(now)
+        total_10min, successful_10min, time_sum_10m = self._window_10m.totals(now)
+
+        avg_time_1h = time_sum_1h / total_recent if total_recent > 0 else 0.0
+        avg_time_10m = time_sum_10m / total_10min if total_10min > 0 else 0.0
+
         # 系统指标
         latest_system = self.system_history[-1] if self.system_history else None
         
-        return {
+        result = {
             "requests_1h": total_recent,
             "successful_1h": successful_recent,
             "success_rate_1h": successful_recent / total_recent if total_recent > 0 else 0.0,
@@ -198,57 +257,58 @@ class PerformanceMetrics:
                 "queue_size": latest_system.queue_size if latest_system else 0
             } if latest_system else None
         }
-    
+
+        self._stats_cache = (mono, result)
+        return result
+
     def get_proxy_performance(self) -> Dict[str, Dict]:
-        """获取代理性能统计"""
-        result = {}
-        for proxy_id, stats in self.proxy_stats.items():
-            result[proxy_id] = {
+        """获取代理性能统计
+
+        success_rate 和 avg_time 已在 end_request 里增量维护，
+        这里只做字段挑选，没有除法。
+        """
+        return {
+            proxy_id: {
                 "requests": stats["requests"],
-                "success_rate": stats["successes"] / stats["requests"] if stats["requests"] > 0 else 0.0,
+                "success_rate": stats["success_rate"],
                 "avg_time": round(stats["avg_time"], 2),
                 "total_time": round(stats["total_time"], 2)
             }
-        return result
+            for proxy_id, stats in self.proxy_stats.items()
+        }
     
     def get_hourly_trends(self, hours: int = 24) -> List[Dict]:
         """获取最近N小时的趋势数据"""
-        current_time = datetime.now()
+        current_epoch = int(time.time() // 3600)
         trends = []
-        
+
         for i in range(hours):
-            hour_time = current_time - timedelta(hours=i)
-            hour_key = hour_time.strftime("%Y-%m-%d %H")
-            
-            stats = self.hourly_stats.get(hour_key, {
-                "total_requests": 0,
-                "successful_requests": 0,
-                "failed_requests": 0,
-                "avg_processing_time": 0.0
-            })
-            
+            hour_epoch = current_epoch - i
+            stats = self.hourly_stats[hour_epoch % _HOURLY_SLOTS]
+            if stats["epoch"] != hour_epoch:
+                # 槽还属于上一轮（或从未写入），该小时没有数据
+                stats = {
+                    "total_requests": 0,
+                    "successful_requests": 0,
+                    "avg_processing_time": 0.0
+                }
+
             trends.append({
-                "hour": hour_key,
+                # 只在对外输出时才做人类可读的格式化
+                "hour": datetime.fromtimestamp(hour_epoch * 3600).strftime("%Y-%m-%d %H"),
                 "total_requests": stats["total_requests"],
                 "success_rate": stats["successful_requests"] / stats["total_requests"] if stats["total_requests"] > 0 else 0.0,
                 "avg_processing_time": round(stats["avg_processing_time"], 2)
             })
-        
+
         return list(reversed(trends))  # 从早到晚排序
-    
-    async def cleanup_old_data(self):
-        """清理旧数据"""
-        async with self._lock:
-            current_time = datetime.now()
-            cutoff_time = current_time - timedelta(days=7)  # 保留7天数据
-            cutoff_key = cutoff_time.strftime("%Y-%m-%d %H")
-            
-            # 清理小时统计
-            old_keys = [k for k in self.hourly_stats.keys() if k < cutoff_key]
-            for key in old_keys:
-                del self.hourly_stats[key]
-            
-            logger.info(f"清理了 {len(old_keys)} 个旧的小时统计记录")
+
+    def cleanup_old_data(self):
+        """清理旧数据
+
+        小时统计改为环形缓冲后，过期槽会在被复用时就地清零，
+        不再需要周期性扫描清理。
+        """
 
 
 # 全局指标实例
@@ -1,14 +1,28 @@
 import asyncio
 import aiohttp
 import logging
+import math
+import re
+import sys
 import time
 import random
+from itertools import islice
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass, field
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# 配置文件里的 Endpoint 行：Endpoint = host:port
+_ENDPOINT_RE = re.compile(r'^\s*Endpoint\s*=\s*(\S+?):(\d+)\s*$', re.MULTILINE)
+
+# 带内流量（释放时的成功/失败）刚更新过健康状态的代理，这段时间内
+# 跳过定时探测——两个信号去抖合并，不重复打刚判过死活的端点
+_MIN_PROBE_INTERVAL = 60.0
+
+# 成功率 EWMA 的衰减系数：约 1/α 次结果后旧历史的影响衰减殆尽
+_EWMA_ALPHA = 0.1
+
 @dataclass
 class ProxyInfo:
     """代理信息类"""
@@ -18,10 +32,21 @@ class ProxyInfo:
     
     # 健康状态
     is_healthy: bool = True
-    last_check: float = field(default_factory=time.time)
+    last_check: float = field(default_factory=time.monotonic)
     response_time: float = 0.0
-    error_count: int = 0
-    success_count: int = 0
+
+    # 成功/失败分维度统计：真实流量（释放时）与健康探测分开计数，
+    # 避免探测成功稀释真实流量的失败信号；汇总口径见
+    # success_count / error_count 属性
+    traffic_success_count: int = 0
+    traffic_error_count: int = 0
+    probe_success_count: int = 0
+    probe_error_count: int = 0
+
+    # 指数加权成功率：累计计数跑了很久之后对新近故障不敏感，
+    # EWMA 在 O(1/α) 次结果内就能反映最近的劣化；原始计数只
+    # 用于对外统计
+    ewma_success: float = 1.0
     
     # 使用统计
     last_used: float = 0.0
@@ -31,51 +56,113 @@ class ProxyInfo:
     # WARP 配置信息 (可选)
     config_file: Optional[str] = None
     endpoint: str = ""
-    
+
+    # 缓存的健康分数：只在健康检查和释放这些写入点重算，
+    # 选取热路径每次读的是现成的浮点数
+    _cached_health_score: float = 1.0
+
+    # 探测去抖状态：最近一次带内（真实流量）健康信号的时间，
+    # 以及持续失败代理的下次允许探测时间（指数退避）
+    _last_in_band_event: float = 0.0
+    _next_check_at: float = 0.0
+
     @property
     def url(self) -> str:
         """返回代理 URL"""
         return f"{self.protocol}://{self.host}:{self.port}"
-    
+
+    @property
+    def success_count(self) -> int:
+        """累计成功数（流量 + 探测）"""
+        return self.traffic_success_count + self.probe_success_count
+
+    @property
+    def error_count(self) -> int:
+        """累计失败数（流量 + 探测）"""
+        return self.traffic_error_count + self.probe_error_count
+
     @property
     def success_rate(self) -> float:
-        """成功率计算"""
+        """综合成功率（流量 + 探测）"""
         total = self.success_count + self.error_count
         if total == 0:
             return 1.0
         return self.success_count / total
-    
+
     @property
-    def health_score(self) -> float:
-        """健康分数 (0-1)"""
+    def traffic_success_rate(self) -> float:
+        """真实流量成功率"""
+        total = self.traffic_success_count + self.traffic_error_count
+        if total == 0:
+            return 1.0
+        return self.traffic_success_count / total
+
+    @property
+    def probe_success_rate(self) -> float:
+        """健康探测成功率"""
+        total = self.probe_success_count + self.probe_error_count
+        if total == 0:
+            return 1.0
+        return self.probe_success_count / total
+
+    def _record_outcome(self, success: bool):
+        """按结果更新成功率 EWMA"""
+        self.ewma_success = (_EWMA_ALPHA * (1.0 if success else 0.0)
+                             + (1.0 - _EWMA_ALPHA) * self.ewma_success)
+
+    def _recompute_score(self):
+        """重算并缓存健康分数（写入点调用：健康检查、释放）"""
         if not self.is_healthy:
-            return 0.0
-        
-        # 基础分数：成功率
-        score = self.success_rate
-        
+            self._cached_health_score = 0.0
+            return
+
+        # 基础分数：指数加权成功率，对新近结果敏感
+        score = self.ewma_success
+
         # 响应时间惩罚 (>5秒开始扣分)
         if self.response_time > 5.0:
             score *= max(0.1, 1.0 - (self.response_time - 5.0) / 10.0)
-        
+
         # 并发数惩罚
         if self.concurrent_requests >= self.max_concurrent:
             score *= 0.1
-        
-        return max(0.0, min(1.0, score))
+
+        self._cached_health_score = max(0.0, min(1.0, score))
+
+    @property
+    def health_score(self) -> float:
+        """健康分数 (0-1)，读缓存值"""
+        return self._cached_health_score
 
 
 class WARPProxyPool:
     """WARP 代理池管理器 - 生产环境版本"""
     
-    def __init__(self, config_dir: str = "warp-configs", health_check_interval: int = 300):
+    def __init__(self, config_dir: str = "warp-configs", health_check_interval: int = 300,
+                 http_session: Optional[aiohttp.ClientSession] = None,
+                 max_check_concurrency: int = 8):
         self.config_dir = Path(config_dir)
         self.health_check_interval = health_check_interval
         self.proxies: Dict[str, ProxyInfo] = {}
         self.round_robin_index = 0
-        self._lock = asyncio.Lock()
         self._health_check_task: Optional[asyncio.Task] = None
-        
+        # 外部注入的共享 HTTP 会话（由 lifespan 创建和关闭），复用连接池
+        self._http_session = http_session
+        # 未注入共享会话时池自建的探测会话：长期持有、随健康检查
+        # 任务创建和关闭，避免每次探测都新建会话+连接器
+        self._probe_session: Optional[aiohttp.ClientSession] = None
+        # 健康检查并发上限：并行检查但避免同时打满所有出口连接
+        self._check_semaphore = asyncio.Semaphore(max_check_concurrency)
+        # 代理对象列表缓存：random.sample 需要序列，代理集合只在
+        # 加载时变化，不必每次选取都 list() 一遍字典值
+        self._proxy_list: List[ProxyInfo] = []
+        # 选取快照（列式）：[(健康分数, 代理), ...]，只含健康且分数
+        # 为正的代理。健康状态/分数只在健康检查和释放这些写入点变
+        # 化，写入点置脏、选取时惰性重建，热路径读扁平元组而不是
+        # 逐对象查四个属性
+        self._selection_snapshot: List[Tuple[float, ProxyInfo]] = []
+        self._snapshot_dirty = True
+
         # 只加载生产环境的 WARP 配置文件代理
         self._load_warp_config_proxies()
     
@@ -87,16 +174,18 @@ class WARPProxyPool:
             logger.warning(f"WARP 配置目录不存在: {self.config_dir}")
             return
         
-        # 扫描配置文件
-        config_files = list(self.config_dir.glob("*.conf"))
+        # 限制配置数量 (基于 Cloudflare 免费账户限制)
+        max_configs = 8  # 保守限制
+
+        # 扫描配置文件：多取一个就足以判断是否超限，目录再大也
+        # 不用把全部路径物化出来
+        config_files = list(islice(self.config_dir.glob("*.conf"), max_configs + 1))
         if not config_files:
             logger.warning(f"未找到 WARP 配置文件: {self.config_dir}")
             return
-        
-        # 限制配置数量 (基于 Cloudflare 免费账户限制)
-        max_configs = 8  # 保守限制
+
         if len(config_files) > max_configs:
-            logger.warning(f"配置文件过多 ({len(config_files)})，仅使用前 {max_configs} 个")
+            logger.warning(f"配置文件过多，仅使用前 {max_configs} 个")
             config_files = config_files[:max_configs]
         
         # 为每个配置文件创建代理信息
@@ -119,6 +208,8 @@ class WARPProxyPool:
             else:
                 logger.warning(f"无法解析配置文件: {config_file}")
         
+        self._proxy_list = list(self.proxies.values())
+        self._snapshot_dirty = True
         logger.info(f"已加载 {len(self.proxies)} 个 WARP 配置代理")
     
     def _parse_warp_config(self, config_file: Path) -> Optional[Tuple[str, int]]:
@@ -127,20 +218,11 @@ class WARPProxyPool:
             with open(config_file, 'r') as f:
                 content = f.read()
             
-            # 查找 Endpoint 行
-            for line in content.split('\n'):
-                line = line.strip()
-                if line.startswith('Endpoint'):
-                    # 格式: Endpoint = host:port
-                    endpoint = line.split('=', 1)[1].strip()
-                    if ':' in endpoint:
-                        host, port_str = endpoint.rsplit(':', 1)
-                        try:
-                            port = int(port_str)
-                            return host, port
-                        except ValueError:
-                            pass
-            
+            # 查找 Endpoint 行（预编译正则一次扫描，免去逐行 split/strip）
+            m = _ENDPOINT_RE.search(content)
+            if m:
+                return m.group(1), int(m.group(2))
+
             # 如果没有找到端点，使用默认的 Cloudflare WARP 端点
             return "engage.cloudflareclient.com", 2408
             
@@ -152,10 +234,23 @@ class WARPProxyPool:
         """启动健康检查任务"""
         if self._health_check_task and not self._health_check_task.done():
             return
-        
+
+        if self._http_session is None and self._probe_session is None:
+            self._probe_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=16, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+
+        # 3.12+ 上启用急切任务工厂：同步就能完成的任务（如被去抖
+        # 早退的探测）不再经过一轮事件循环调度
+        if sys.version_info >= (3, 12):
+            loop = asyncio.get_running_loop()
+            if loop.get_task_factory() is None:
+                loop.set_task_factory(asyncio.eager_task_factory)
+
         self._health_check_task = asyncio.create_task(self._health_check_loop())
         logger.info("WARP 代理池健康检查已启动")
-    
+
     async def stop_health_check(self):
         """停止健康检查任务"""
         if self._health_check_task:
@@ -164,6 +259,11 @@ class WARPProxyPool:
                 await self._health_check_task
             except asyncio.CancelledError:
                 pass
+
+        if self._probe_session is not None:
+            await self._probe_session.close()
+            self._probe_session = None
+
         logger.info("WARP 代理池健康检查已停止")
     
     async def _health_check_loop(self):
@@ -183,13 +283,22 @@ class WARPProxyPool:
         if not self.proxies:
             return
         
-        tasks = []
-        for proxy_id, proxy in self.proxies.items():
-            task = asyncio.create_task(self._check_single_proxy(proxy_id, proxy))
-            tasks.append(task)
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        async def check_bounded(proxy_id: str, proxy: ProxyInfo):
+            async with self._check_semaphore:
+                await self._check_single_proxy(proxy_id, proxy)
+
+        # 信号量限流下并行检查：总耗时趋近最慢一个，而非逐个累加。
+        # 3.12+ 走 TaskGroup（配合急切任务工厂省调度往返），
+        # 旧版本回退到 gather
+        if sys.version_info >= (3, 12):
+            async with asyncio.TaskGroup() as tg:
+                for proxy_id, proxy in self.proxies.items():
+                    tg.create_task(check_bounded(proxy_id, proxy))
+        else:
+            await asyncio.gather(
+                *(check_bounded(proxy_id, proxy) for proxy_id, proxy in self.proxies.items()),
+                return_exceptions=True
+            )
         
         # 记录健康状态
         healthy_count = sum(1 for p in self.proxies.values() if p.is_healthy)
@@ -197,74 +306,146 @@ class WARPProxyPool:
     
     async def _check_single_proxy(self, proxy_id: str, proxy: ProxyInfo):
         """检查单个代理的健康状态"""
-        start_time = time.time()
-        
+        start_time = time.monotonic()
+
+        # 去抖：带内流量刚更新过健康状态，不必再探测一遍
+        if start_time - proxy._last_in_band_event < _MIN_PROBE_INTERVAL:
+            return
+
+        # 持续失败的代理按指数间隔退避，别反复打已经死掉的端点
+        if start_time < proxy._next_check_at:
+            return
+
         try:
             # 使用代理访问测试 URL
-            connector = aiohttp.TCPConnector()
             proxy_url = proxy.url
-            
+            test_url = "https://www.youtube.com"
             timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(
-                connector=connector,
+
+            # 共享会话优先，其次池自建的探测会话；两者都是长期持有，
+            # 每次检查不再新建会话/连接器
+            session = self._http_session
+            if session is None or session.closed:
+                session = self._probe_session
+            if session is None or session.closed:
+                raise RuntimeError("健康检查会话未初始化")
+
+            async with session.get(
+                test_url,
+                proxy=proxy_url,
                 timeout=timeout
-            ) as session:
-                test_url = "https://www.youtube.com"
-                async with session.get(
-                    test_url,
-                    proxy=proxy_url
-                ) as response:
-                    if response.status == 200:
-                        proxy.is_healthy = True
-                        proxy.success_count += 1
-                        proxy.error_count = max(0, proxy.error_count - 1)  # 成功时减少错误计数
-                    else:
-                        raise aiohttp.ClientError(f"HTTP {response.status}")
-            
+            ) as response:
+                if response.status == 200:
+                    proxy.is_healthy = True
+                    proxy.probe_success_count += 1
+                    proxy.probe_error_count = max(0, proxy.probe_error_count - 1)  # 成功时减少错误计数
+                    proxy._record_outcome(True)
+                    proxy._next_check_at = 0.0
+                else:
+                    raise aiohttp.ClientError(f"HTTP {response.status}")
+
         except Exception as e:
             proxy.is_healthy = False
-            proxy.error_count += 1
+            proxy.probe_error_count += 1
+            proxy._record_outcome(False)
+            if proxy.error_count >= 5:
+                # 60s 起步、按错误数翻倍、封顶 1 小时
+                proxy._next_check_at = time.monotonic() + min(
+                    3600.0, 60.0 * 2 ** min(proxy.error_count, 8))
             logger.warning(f"代理 {proxy_id} 检查失败: {e}")
         
         finally:
-            proxy.response_time = time.time() - start_time
-            proxy.last_check = time.time()
+            proxy.response_time = time.monotonic() - start_time
+            proxy.last_check = time.monotonic()
+            proxy._recompute_score()
+            self._snapshot_dirty = True
     
+    def _rebuild_snapshot(self):
+        """重建选取快照：健康且分数为正的代理及其分数的扁平列表"""
+        self._selection_snapshot = [
+            (p._cached_health_score, p)
+            for p in self._proxy_list
+            if p.is_healthy and p._cached_health_score > 0
+        ]
+        self._snapshot_dirty = False
+
+    def _reservoir_pick(self) -> Optional[ProxyInfo]:
+        """Efraimidis–Spirakis 加权水库采样：单次遍历，每个候选按
+        key = ln(random()) / health_score 打分取最大者，选中概率与
+        健康分数成正比。原来的"排序取第一"是 O(N log N) 外加中间
+        列表，而且确定性地把流量全压在分数最高的一个代理上，
+        代理池形同虚设。
+        """
+        best_proxy: Optional[ProxyInfo] = None
+        best_key = -math.inf
+
+        for weight, proxy in self._selection_snapshot:
+            # 健康和分数已在快照里过滤，循环内只剩容量检查
+            if proxy.concurrent_requests >= proxy.max_concurrent:
+                continue
+            # 等价于 random()**(1/w) 取最大，但省一次 pow
+            key = math.log(random.random()) / weight
+            if key > best_key:
+                best_key = key
+                best_proxy = proxy
+
+        return best_proxy
+
+    # 注：选取和释放的方法体内都没有 await 点，在单线程事件循环里
+    # 整个方法体就是原子的，不需要 asyncio.Lock——省掉每个请求两次
+    # 协程挂起/恢复。保持 async 签名以兼容现有调用方
+
     async def get_best_proxy(self) -> Optional[ProxyInfo]:
         """获取最佳代理"""
-        async with self._lock:
-            healthy_proxies = [
-                proxy for proxy in self.proxies.values()
-                if proxy.is_healthy and proxy.concurrent_requests < proxy.max_concurrent
+        if self._snapshot_dirty:
+            self._rebuild_snapshot()
+        snapshot = self._selection_snapshot
+
+        # 两选一快路径：随机抽两个代理、取分数高者，O(1) 就够在
+        # 小池子上接近按分数分流；两个都不可用才退回全池采样
+        best_proxy: Optional[ProxyInfo] = None
+        if len(snapshot) >= 2:
+            candidates = [
+                (score, p) for score, p in random.sample(snapshot, 2)
+                if p.concurrent_requests < p.max_concurrent
             ]
-            
-            if not healthy_proxies:
-                logger.warning("没有可用的健康代理")
-                return None
-            
-            # 按健康分数排序，选择最佳代理
-            healthy_proxies.sort(key=lambda p: p.health_score, reverse=True)
-            best_proxy = healthy_proxies[0]
-            
-            # 更新使用统计
-            best_proxy.last_used = time.time()
-            best_proxy.concurrent_requests += 1
-            
-            return best_proxy
-    
+            if candidates:
+                best_proxy = max(candidates, key=lambda c: c[0])[1]
+
+        if best_proxy is None:
+            best_proxy = self._reservoir_pick()
+
+        if best_proxy is None:
+            logger.warning("没有可用的健康代理")
+            return None
+
+        # 更新使用统计
+        best_proxy.last_used = time.monotonic()
+        best_proxy.concurrent_requests += 1
+        # 防御性回退：理论上单线程下不会超卖，留个保险
+        if best_proxy.concurrent_requests > best_proxy.max_concurrent:
+            best_proxy.concurrent_requests -= 1
+            return None
+
+        return best_proxy
+
     async def release_proxy(self, proxy: ProxyInfo, success: bool = True):
         """释放代理"""
-        async with self._lock:
-            proxy.concurrent_requests = max(0, proxy.concurrent_requests - 1)
-            
-            if success:
-                proxy.success_count += 1
-            else:
-                proxy.error_count += 1
-                # 连续失败太多次，标记为不健康
-                if proxy.error_count >= 5:
-                    proxy.is_healthy = False
-    
+        proxy.concurrent_requests = max(0, proxy.concurrent_requests - 1)
+        proxy._last_in_band_event = time.monotonic()
+
+        proxy._record_outcome(success)
+        if success:
+            proxy.traffic_success_count += 1
+        else:
+            proxy.traffic_error_count += 1
+            # 连续失败太多次，标记为不健康
+            if proxy.error_count >= 5:
+                proxy.is_healthy = False
+
+        proxy._recompute_score()
+        self._snapshot_dirty = True
+
     def get_proxy_stats(self) -> Dict:
         """获取代理池统计信息"""
         if not self.proxies:
@@ -272,29 +453,42 @@ class WARPProxyPool:
                 "total": 0,
                 "healthy": 0,
                 "average_response_time": 0.0,
-                "average_success_rate": 0.0
+                "average_success_rate": 0.0,
+                "average_traffic_success_rate": 0.0,
+                "average_probe_success_rate": 0.0
             }
-        
+
         healthy_proxies = [p for p in self.proxies.values() if p.is_healthy]
-        
-        avg_response_time = sum(p.response_time for p in self.proxies.values()) / len(self.proxies)
-        avg_success_rate = sum(p.success_rate for p in self.proxies.values()) / len(self.proxies)
-        
+
+        n = len(self.proxies)
+        avg_response_time = sum(p.response_time for p in self.proxies.values()) / n
+        avg_success_rate = sum(p.success_rate for p in self.proxies.values()) / n
+        avg_traffic_rate = sum(p.traffic_success_rate for p in self.proxies.values()) / n
+        avg_probe_rate = sum(p.probe_success_rate for p in self.proxies.values()) / n
+
         return {
-            "total": len(self.proxies),
+            "total": n,
             "healthy": len(healthy_proxies),
             "average_response_time": round(avg_response_time, 2),
-            "average_success_rate": round(avg_success_rate * 100, 1)
+            # 综合口径保留给老调用方，流量/探测分列，避免探测成功
+            # 把真实流量的故障率抹平
+            "average_success_rate": round(avg_success_rate * 100, 1),
+            "average_traffic_success_rate": round(avg_traffic_rate * 100, 1),
+            "average_probe_success_rate": round(avg_probe_rate * 100, 1)
         }
 
 
 # 全局代理池实例
 _proxy_pool: Optional[WARPProxyPool] = None
 
-async def initialize_proxy_pool(config_dir: str = "warp-configs", health_check_interval: int = 300):
+async def initialize_proxy_pool(config_dir: str = "warp-configs", health_check_interval: int = 300,
+                                http_session: Optional[aiohttp.ClientSession] = None,
+                                max_check_concurrency: int = 8):
     """初始化代理池"""
     global _proxy_pool
-    _proxy_pool = WARPProxyPool(config_dir, health_check_interval)
+    _proxy_pool = WARPProxyPool(config_dir, health_check_interval,
+                                http_session=http_session,
+                                max_check_concurrency=max_check_concurrency)
     await _proxy_pool.start_health_check()
     return _proxy_pool
 
@@ -9,21 +9,43 @@ import aiohttp
 import logging
 import base64
 import json
-import subprocess
-import tempfile
-import os
+import re
+import sys
 import uuid
 from typing import Dict, Optional, Tuple
 from datetime import datetime, timezone
 
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
 logger = logging.getLogger(__name__)
 
+# WireGuard 密钥格式：32 字节的 base64（44 字符、一个填充位）
+_WG_KEY_RE = re.compile(r'^[A-Za-z0-9+/]{42}[AEIMQUYcgkosw048]=$')
+
+# WireGuard 配置模板：一次 format_map 填充，免去多段 f-string 拼接
+_WG_CONFIG_TEMPLATE = """[Interface]
+PrivateKey = {private_key}
+Address = {addresses}
+DNS = 1.1.1.1, 1.0.0.1, 2606:4700:4700::1111, 2606:4700:4700::1001
+MTU = 1280
+
+[Peer]
+PublicKey = {peer_public_key}
+AllowedIPs = 0.0.0.0/0, ::/0
+Endpoint = {endpoint}
+{reserved_line}"""
+
 class CloudflareWARPAPI:
     """
     Cloudflare WARP API 客户端
     使用官方 API 生成真实的 WireGuard 配置
     """
     
+    # 注册节奏目标：每个并发槽内按 1/TARGET_QPS 秒间隔发请求，
+    # 限速挂在并发槽上而不是完成顺序上
+    TARGET_QPS = 1.0
+
     def __init__(self):
         self.api_base = "https://api.cloudflareclient.com"
         self.api_version = "v0a537"  # 更新版本号
@@ -60,50 +82,21 @@ class CloudflareWARPAPI:
     
     def _generate_wireguard_keypair(self) -> Tuple[str, str]:
         """
-        使用 WireGuard 官方工具生成密钥对
-        返回: (private_key, public_key)
-        """
-        try:
-            # 生成私钥
-            private_key_process = subprocess.run(
-                ["wg", "genkey"], 
-                capture_output=True, 
-                text=True, 
-                check=True
-            )
-            private_key = private_key_process.stdout.strip()
-            
-            # 从私钥生成公钥
-            public_key_process = subprocess.run(
-                ["wg", "pubkey"], 
-                input=private_key, 
-                capture_output=True, 
-                text=True, 
-                check=True
-            )
-            public_key = public_key_process.stdout.strip()
-            
-            return private_key, public_key
-            
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            # 如果没有安装 wg 工具，使用备用方法
-            logger.warning(f"WireGuard 工具不可用: {e}，使用备用生成方法")
-            return self._generate_keypair_fallback()
-    
-    def _generate_keypair_fallback(self) -> Tuple[str, str]:
-        """
-        备用密钥生成方法（如果没有 wg 工具）
+        在进程内生成 Curve25519 密钥对（与 wg genkey/pubkey 等价）
+        返回: (private_key, public_key)，均为 base64 编码
         """
-        # 生成32字节随机私钥
-        private_bytes = os.urandom(32)
-        private_key = base64.b64encode(private_bytes).decode()
-        
-        # 这是简化版本，真实的公钥派生需要椭圆曲线运算
-        # 在生产环境中，建议安装 wireguard-tools
-        public_bytes = os.urandom(32)
-        public_key = base64.b64encode(public_bytes).decode()
-        
-        return private_key, public_key
+        private = X25519PrivateKey.generate()
+        private_bytes = private.private_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PrivateFormat.Raw,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        public_bytes = private.public_key().public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return (base64.b64encode(private_bytes).decode(),
+                base64.b64encode(public_bytes).decode())
     
     async def register_device(self) -> Optional[Dict]:
         """
@@ -203,6 +196,12 @@ class CloudflareWARPAPI:
             else:
                 peer_config = peers_config[0]
                 peer_public_key = peer_config.get("public_key", "bmXOC+F1FxEMF9dyiK2H5/1SUtzH0JuVo51h2wPfgyo=")
+
+                # 校验密钥格式，畸形公钥回退到官方默认值，避免生成
+                # 永远握不上手的配置
+                if not _WG_KEY_RE.match(peer_public_key):
+                    logger.warning(f"对端公钥格式非法: {peer_public_key!r}，使用默认 WARP 公钥")
+                    peer_public_key = "bmXOC+F1FxEMF9dyiK2H5/1SUtzH0JuVo51h2wPfgyo="
                 
                 # 处理端点信息
                 endpoint_info = peer_config.get("endpoint", {})
@@ -213,30 +212,19 @@ class CloudflareWARPAPI:
                 
                 reserved = peer_config.get("reserved", [])
             
-            # 生成配置文件内容
-            config_content = f"""[Interface]
-PrivateKey = {private_key}
-Address = {v4_address}"""
-            
-            if v6_address:
-                config_content += f", {v6_address}"
-            
-            config_content += f"""
-DNS = 1.1.1.1, 1.0.0.1, 2606:4700:4700::1111, 2606:4700:4700::1001
-MTU = 1280
-
-[Peer]
-PublicKey = {peer_public_key}
-AllowedIPs = 0.0.0.0/0, ::/0
-Endpoint = {endpoint}
-"""
-            
-            # 添加 Reserved 字段（如果存在）
+            # 生成配置文件内容：填充模板，一次分配
+            addresses = f"{v4_address}, {v6_address}" if v6_address else v4_address
+            reserved_line = ""
             if reserved and isinstance(reserved, list):
-                reserved_str = ",".join(map(str, reserved))
-                config_content += f"Reserved = {reserved_str}\n"
-            
-            return config_content
+                reserved_line = f"Reserved = {','.join(map(str, reserved))}\n"
+
+            return _WG_CONFIG_TEMPLATE.format_map({
+                "private_key": private_key,
+                "addresses": addresses,
+                "peer_public_key": peer_public_key,
+                "endpoint": endpoint,
+                "reserved_line": reserved_line
+            })
             
         except Exception as e:
             logger.error(f"生成 WireGuard 配置失败: {e}")
@@ -292,38 +280,45 @@ Endpoint = {endpoint}
                 try:
                     config_name = f"warp_real_{index+1:02d}.conf"
                     result = await self.create_warp_config(config_name)
-                    
+
                     if result:
                         name, content = result
+                        # 节奏间隔放在并发槽内：占着槽等待即是限速，
+                        # 不拖慢已经完成的其他任务
+                        await asyncio.sleep(1 / self.TARGET_QPS)
                         return name, content
-                    
+
                     # 如果失败，等待一段时间再重试
                     await asyncio.sleep(2)
                     return None, None
-                    
+
                 except Exception as e:
                     logger.error(f"创建配置 {index+1} 失败: {e}")
                     return None, None
-        
-        # 并发创建配置
-        tasks = [create_single_config(i) for i in range(count)]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
+
+        # 并发创建配置：3.12+ 用 TaskGroup（create_single_config
+        # 内部吞掉所有异常，不会触发组级取消），旧版本回退到 gather
+        if sys.version_info >= (3, 12):
+            async with asyncio.TaskGroup() as tg:
+                tasks = [tg.create_task(create_single_config(i)) for i in range(count)]
+            results = [task.result() for task in tasks]
+        else:
+            results = await asyncio.gather(
+                *(create_single_config(i) for i in range(count)),
+                return_exceptions=True
+            )
+
         # 处理结果
         for i, result in enumerate(results):
             if isinstance(result, Exception):
                 logger.error(f"配置 {i+1} 创建异常: {result}")
                 continue
-                
+
             name, content = result
             if name and content:
                 configs[name] = content
                 success_count += 1
-            
-            # 在请求之间添加延迟，避免触发速率限制
-            if i < len(results) - 1:
-                await asyncio.sleep(1)
-        
+
         logger.info(f"✅ 批量创建完成: {success_count}/{count} 个配置成功")
         return configs
 
@@ -4,158 +4,260 @@ WARP 配置管理器
 使用真实的 Cloudflare WARP API 生成和管理 WireGuard 配置
 """
 
+import asyncio
 import os
 import json
 import logging
+import re
+import time
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Optional, Any
 from datetime import datetime
 
-from .warp_api_client import CloudflareWARPAPI, generate_real_warp_configs
+from .warp_api_client import CloudflareWARPAPI
+from .async_backup_writer import get_backup_writer
 
 logger = logging.getLogger(__name__)
 
+# 校验所需的段和字段：一次 findall 扫描收集全部命中，
+# 代替逐个 token 对整份内容做 in 判断（6 趟变 1 趟）
+_REQUIRED_TOKENS = frozenset(
+    ['[Interface]', '[Peer]', 'PrivateKey', 'Address', 'PublicKey', 'Endpoint'])
+_REQUIRED_TOKENS_RE = re.compile(
+    r'\[Interface\]|\[Peer\]|PrivateKey|Address|PublicKey|Endpoint')
+
+# list_configs 的结果缓存时长：优化循环的一轮迭代里会连着扫
+# 好几次目录，短 TTL 内直接复用同一份列表
+_LIST_TTL = 2.0
+
+
+def _atomic_write(path: Path, content: str):
+    """原子写入：写临时文件、fsync、再 os.replace 覆盖
+
+    进程在写到一半时崩溃不会留下残缺的 .conf——残缺文件会被下个
+    健康周期判为无效并触发昂贵的重新注册。
+    """
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, content.encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=256)
+def _iso(ts: float) -> str:
+    """时间戳转 ISO 字符串，按时间戳缓存
+
+    同一批文件每个扫描周期都会格式化同样的 ctime/mtime，
+    缓存后稳态下不再反复构造 datetime。
+    """
+    return datetime.fromtimestamp(ts).isoformat()
+
+
+@lru_cache(maxsize=128)
+def _load_and_parse(config_file: str, mtime_ns: int, size: int) -> tuple:
+    """单趟读取配置：同一次遍历完成校验和 Address/Endpoint 提取
+
+    以 (路径, mtime_ns, 大小) 为键做 LRU 缓存：文件没变就不重读。
+    健康检查每个周期都会验证同一批文件，稳态下磁盘读直接归零。
+
+    Returns:
+        (is_valid, address, endpoint)
+    """
+    try:
+        with open(config_file, 'r') as f:
+            # WARP 配置不到 2KB，读 4KB 上限足够覆盖全部字段；
+            # 损坏文件异常膨胀时也不会整个读进内存
+            content = f.read(4096)
+    except OSError as e:
+        logger.error(f"验证配置文件失败 {config_file}: {e}")
+        return (False, None, None)
+
+    # 检查必要的配置段和字段：单趟扫描收集命中
+    seen = set(_REQUIRED_TOKENS_RE.findall(content))
+    missing = _REQUIRED_TOKENS - seen
+    is_valid = not missing
+    for token in missing:
+        logger.warning(f"配置文件缺少 {token}: {config_file}")
+
+    # 同一份内容顺带提取关键字段，省去第二次 open/read
+    address = None
+    endpoint = None
+    for line in content.split('\n'):
+        line = line.strip()
+        if line.startswith('Address'):
+            address = line.split('=', 1)[1].strip()
+        elif line.startswith('Endpoint'):
+            endpoint = line.split('=', 1)[1].strip()
+
+    return (is_valid, address, endpoint)
+
 class WARPConfigGenerator:
     """WARP 配置生成器 - 使用真实的 Cloudflare API"""
-    
+
+    # 批量生成的并发上限（免费账户保守值）
+    GEN_CONCURRENCY = 4
+
     def __init__(self, config_dir: str = "warp-configs"):
         self.config_dir = Path(config_dir)
         self.config_dir.mkdir(exist_ok=True)
-        
+
+        # 长期持有的 API 客户端：按需创建，所有生成调用复用同一个
+        # HTTP 会话，省掉每次配置一轮 TCP+TLS 握手
+        self._api: Optional[CloudflareWARPAPI] = None
+        self._gen_sem = asyncio.Semaphore(self.GEN_CONCURRENCY)
+
         logger.info("WARP 配置生成器初始化 - 使用真实的 Cloudflare API")
-    
+
+    async def _api_session(self) -> CloudflareWARPAPI:
+        """获取（懒创建的）共享 API 客户端"""
+        if self._api is None:
+            self._api = await CloudflareWARPAPI().__aenter__()
+        return self._api
+
+    async def aclose(self):
+        """关闭共享 API 客户端（服务关闭时调用）"""
+        if self._api is not None:
+            await self._api.__aexit__(None, None, None)
+            self._api = None
+
     async def generate_config(self, config_id: int) -> str:
         """
         生成单个 WARP 配置文件 (使用真实 API)
         """
         try:
-            async with CloudflareWARPAPI() as api:
-                config_name = f"warp_api_{config_id:02d}.conf"
-                result = await api.create_warp_config(config_name)
-                
-                if result:
-                    _, config_content = result
-                    return config_content
-                else:
-                    raise Exception(f"无法从 Cloudflare API 生成配置 {config_id}")
-                    
+            api = await self._api_session()
+            config_name = f"warp_api_{config_id:02d}.conf"
+            result = await api.create_warp_config(config_name)
+
+            if result:
+                _, config_content = result
+                return config_content
+            else:
+                raise Exception(f"无法从 Cloudflare API 生成配置 {config_id}")
+
         except Exception as e:
             logger.error(f"生成配置 {config_id} 失败: {e}")
             # 返回错误提示而不是模拟数据
             raise Exception(f"WARP 配置生成失败: {e}")
     
+    async def _generate_one(self, index: int):
+        """在并发信号量下生成一个配置"""
+        async with self._gen_sem:
+            api = await self._api_session()
+            return await api.create_warp_config(f"warp_api_{index+1:02d}.conf")
+
     async def generate_multiple_configs(self, count: int = 8) -> Dict[str, str]:
         """
         生成多个 WARP 配置 (使用真实 API)
+
+        并发发起注册请求（信号量限流、共享会话），批量生成耗时
+        趋近 count/并发 个 RTT 而不是逐个串行。
         """
         try:
             logger.info(f"正在通过 Cloudflare API 生成 {count} 个真实 WARP 配置...")
-            
-            # 使用真实的 API 生成配置
-            configs = await generate_real_warp_configs(count)
-            
+
+            results = await asyncio.gather(
+                *(self._generate_one(i) for i in range(count)),
+                return_exceptions=True
+            )
+
+            configs = {}
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"生成配置失败: {result}")
+                elif result:
+                    name, content = result
+                    configs[name] = content
+
             if not configs:
                 raise Exception("无法从 Cloudflare API 生成任何配置")
-            
+
             logger.info(f"✅ 成功生成 {len(configs)} 个真实 WARP 配置")
             return configs
-            
+
         except Exception as e:
             logger.error(f"批量生成配置失败: {e}")
             raise
     
-    def save_configs_to_disk(self, configs: Dict[str, str]) -> List[str]:
-        """保存配置到磁盘"""
+    async def save_configs_to_disk(self, configs: Dict[str, str]) -> List[str]:
+        """保存配置到磁盘（写入放线程池，事件循环不被磁盘 I/O 阻塞）"""
         saved_files = []
-        
-        for filename, content in configs.items():
-            config_path = self.config_dir / filename
-            
-            try:
-                with open(config_path, 'w') as f:
-                    f.write(content)
-                saved_files.append(str(config_path))
+
+        results = await asyncio.gather(
+            *(asyncio.to_thread(_atomic_write, self.config_dir / filename, content)
+              for filename, content in configs.items()),
+            return_exceptions=True
+        )
+
+        for filename, result in zip(configs, results):
+            if isinstance(result, Exception):
+                logger.error(f"保存配置文件失败 {filename}: {result}")
+            else:
+                saved_files.append(str(self.config_dir / filename))
                 logger.info(f"✅ 已保存真实 WARP 配置: {filename}")
-            except Exception as e:
-                logger.error(f"保存配置文件失败 {filename}: {e}")
-        
+
         return saved_files
     
     def validate_config(self, config_file: str) -> bool:
-        """验证配置文件格式"""
+        """验证配置文件格式（按 stat 缓存，文件未变不重读）"""
         try:
-            config_path = Path(config_file)
-            if not config_path.exists():
-                return False
-            
-            with open(config_path, 'r') as f:
-                content = f.read()
-            
-            # 检查必要的配置段
-            required_sections = ['[Interface]', '[Peer]']
-            required_fields = ['PrivateKey', 'Address', 'PublicKey', 'Endpoint']
-            
-            for section in required_sections:
-                if section not in content:
-                    logger.warning(f"配置文件缺少 {section} 段: {config_file}")
-                    return False
-            
-            for field in required_fields:
-                if field not in content:
-                    logger.warning(f"配置文件缺少 {field} 字段: {config_file}")
-                    return False
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"验证配置文件失败 {config_file}: {e}")
+            st = Path(config_file).stat()
+        except OSError:
             return False
+        is_valid, _, _ = _load_and_parse(str(config_file), st.st_mtime_ns, st.st_size)
+        return is_valid
     
     def scan_existing_configs(self) -> List[str]:
         """扫描现有配置文件"""
+        return [path for path, _ in self.scan_existing_configs_with_stat()]
+
+    def scan_existing_configs_with_stat(self) -> List[tuple]:
+        """扫描现有配置文件，顺带返回 stat 结果
+
+        os.scandir 一趟拿到文件名和元数据，后续 get_config_info
+        复用这里的 stat，免去每个文件再 stat 一次。
+        """
         if not self.config_dir.exists():
             return []
-        
-        config_files = list(self.config_dir.glob("*.conf"))
-        return [str(f) for f in config_files]
-    
-    def get_config_info(self, config_file: str) -> Optional[Dict]:
-        """获取配置文件信息"""
+
+        entries = []
+        with os.scandir(self.config_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.conf') and entry.is_file():
+                    entries.append((entry.path, entry.stat()))
+        return entries
+
+    def get_config_info(self, config_file: str, stat: Optional[os.stat_result] = None) -> Optional[Dict]:
+        """获取配置文件信息（stat 可由目录扫描预取传入）"""
         try:
             config_path = Path(config_file)
-            if not config_path.exists():
-                return None
-            
-            # 获取文件基本信息
-            stat = config_path.stat()
+
+            # 获取文件基本信息；校验和字段提取共用同一次（缓存的）读取
+            if stat is None:
+                if not config_path.exists():
+                    return None
+                stat = config_path.stat()
+            is_valid, address, endpoint = _load_and_parse(
+                str(config_path), stat.st_mtime_ns, stat.st_size)
+
             info = {
                 "file_path": str(config_path),
                 "file_name": config_path.name,
                 "size": stat.st_size,
-                "created": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                "is_valid": self.validate_config(config_file)
+                "created": _iso(stat.st_ctime),
+                "modified": _iso(stat.st_mtime),
+                "is_valid": is_valid
             }
-            
-            # 尝试解析配置内容
-            try:
-                with open(config_path, 'r') as f:
-                    content = f.read()
-                
-                # 提取关键信息
-                for line in content.split('\n'):
-                    line = line.strip()
-                    if line.startswith('Address'):
-                        info["address"] = line.split('=', 1)[1].strip()
-                    elif line.startswith('Endpoint'):
-                        info["endpoint"] = line.split('=', 1)[1].strip()
-                    elif line.startswith('PublicKey') and '[Peer]' in content:
-                        # 这是 Peer 的公钥，不是我们的
-                        pass
-                
-            except Exception as e:
-                logger.warning(f"解析配置文件内容失败 {config_file}: {e}")
-            
+            if address is not None:
+                info["address"] = address
+            if endpoint is not None:
+                info["endpoint"] = endpoint
+
             return info
             
         except Exception as e:
@@ -170,7 +272,11 @@ class WARPConfigManager:
         self.config_dir = Path(config_dir)
         self.config_dir.mkdir(exist_ok=True)
         self.generator = WARPConfigGenerator(config_dir)
-        
+
+        # list_configs 的短 TTL 缓存：(单调时间戳, 配置列表)，
+        # 增删配置时失效
+        self._list_cache: Optional[tuple] = None
+
         logger.info("WARP 配置管理器初始化 - 集成真实 Cloudflare API")
     
     async def setup_initial_configs(self, count: int = 8) -> Dict[str, Any]:
@@ -210,7 +316,7 @@ class WARPConfigManager:
                 }
             
             # 保存到磁盘
-            saved_files = self.generator.save_configs_to_disk(configs)
+            saved_files = await self.generator.save_configs_to_disk(configs)
             
             # 验证生成的配置
             valid_configs = []
@@ -247,37 +353,40 @@ class WARPConfigManager:
             }
     
     def list_configs(self) -> List[Dict]:
-        """列出所有配置文件"""
+        """列出所有配置文件（短 TTL 缓存，合并同一轮的重复扫描）"""
+        mono = time.monotonic()
+        if self._list_cache and mono - self._list_cache[0] < _LIST_TTL:
+            return list(self._list_cache[1])
+
         configs = []
-        config_files = self.generator.scan_existing_configs()
-        
-        for config_file in config_files:
-            info = self.generator.get_config_info(config_file)
+        for config_file, stat in self.generator.scan_existing_configs_with_stat():
+            info = self.generator.get_config_info(config_file, stat=stat)
             if info:
                 configs.append(info)
-        
-        return configs
+
+        self._list_cache = (mono, configs)
+        return list(configs)
     
     async def add_new_config(self, config_name: str = None) -> Optional[str]:
         """添加新的配置文件 (使用真实 API)"""
         try:
-            async with CloudflareWARPAPI() as api:
-                result = await api.create_warp_config(config_name)
-                
-                if result:
-                    name, content = result
-                    
-                    # 保存到磁盘
-                    config_path = self.config_dir / name
-                    with open(config_path, 'w') as f:
-                        f.write(content)
-                    
-                    logger.info(f"✅ 添加新的真实 WARP 配置: {name}")
-                    return str(config_path)
-                else:
-                    logger.error("❌ 无法从 Cloudflare API 生成新配置")
-                    return None
-                    
+            api = await self.generator._api_session()
+            result = await api.create_warp_config(config_name)
+
+            if result:
+                name, content = result
+
+                # 保存到磁盘（线程池原子写入，不阻塞事件循环）
+                config_path = self.config_dir / name
+                await asyncio.to_thread(_atomic_write, config_path, content)
+
+                logger.info(f"✅ 添加新的真实 WARP 配置: {name}")
+                self._list_cache = None
+                return str(config_path)
+            else:
+                logger.error("❌ 无法从 Cloudflare API 生成新配置")
+                return None
+
         except Exception as e:
             logger.error(f"添加新配置失败: {e}")
             return None
@@ -291,10 +400,13 @@ class WARPConfigManager:
                 backup_dir = self.config_dir / "backup"
                 backup_dir.mkdir(exist_ok=True)
                 
-                backup_path = backup_dir / f"{config_path.name}.{int(datetime.now().timestamp())}.bak"
-                config_path.rename(backup_path)
-                
+                # 纳秒级时间戳：同一秒内删除多个配置不会撞名互相覆盖
+                backup_path = backup_dir / f"{config_path.name}.{time.time_ns()}.bak"
+                # 备份改名是非关键写入，排队后台线程执行，调用方不等待
+                get_backup_writer().submit(config_path, backup_path)
+
                 logger.info(f"✅ 配置文件已移除并备份: {config_path.name}")
+                self._list_cache = None
                 return True
             else:
                 logger.warning(f"配置文件不存在: {config_file}")
@@ -6,6 +6,7 @@ WARP 配置优化器
 
 import asyncio
 import logging
+import random
 import time
 from pathlib import Path
 from typing import List, Dict, Optional, Any, Tuple
@@ -13,11 +14,12 @@ from dataclasses import dataclass
 from datetime import datetime, timedelta
 
 from .warp_manager import WARPConfigManager, WARPConfigGenerator
+from .async_backup_writer import get_backup_writer
 from .concurrency_limiter import AccountTier
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WARPOptimizationConfig:
     """WARP 优化配置"""
     # 基于免费账户的保守配置
@@ -36,6 +38,18 @@ class WARPOptimizationConfig:
     backup_dir: str = "warp-configs-backup"
     account_tier: AccountTier = AccountTier.FREE
 
+    # 健康检查方式：本地/测试环境走模拟检查；关闭后对配置的
+    # WireGuard 端点做 TCP 连通性探测（Cloudflare 端点同时监听
+    # TCP，连接耗时即近似 RTT）
+    mock_mode: bool = True
+
+    @property
+    def health_check_concurrency(self) -> int:
+        """健康检查并发上限（按账户等级收敛）"""
+        if self.account_tier == AccountTier.FREE:
+            return 4
+        return 8
+
 class WARPOptimizer:
     """
     WARP 配置优化器
@@ -52,13 +66,31 @@ class WARPOptimizer:
         self.warp_manager = WARPConfigManager(self.config.config_dir)
         
         # 状态追踪
-        self.healthy_configs: List[str] = []
-        self.unhealthy_configs: List[str] = []
-        self.config_health_status: Dict[str, Dict] = {}
+        # 状态统一以 Path 为键：.name/.exists 直接调用，不再每次
+        # 从字符串重建 Path；只在对外输出时转成字符串
+        self.healthy_configs: List[Path] = []
+        # 集合存储：清理时整批差集移除，不做逐元素 list.remove
+        self.unhealthy_configs: set = set()
+        self.config_health_status: Dict[Path, Dict] = {}
         
         # 任务状态
         self._optimization_task: Optional[asyncio.Task] = None
         self._is_running = False
+
+        # 健康检查并发上限：限制同时打开的配置文件/探测数，
+        # 配置数增长时不会出现 fd 和事件循环尖峰
+        self._health_sem = asyncio.Semaphore(self.config.health_check_concurrency)
+
+        # 状态快照缓存：大部分健康检查不改变结论（健康的仍健康），
+        # 只在健康位翻转、配置增删或循环启停时失效；
+        # 平均响应时间用增量 (总和, 计数) 维护，避免每次全量求和
+        self._status_cache: Optional[Dict[str, Any]] = None
+        self._rt_sum: float = 0.0
+        self._rt_count: int = 0
+
+        # 本轮优化新增的配置路径：收尾健康检查只复查这些脏路径，
+        # 不再对整个目录做第二遍全量检查
+        self._dirty: set = set()
         
         logger.info(f"WARP 优化器初始化: 目标配置数={self.config.target_config_count}, "
                    f"账户等级={self.config.account_tier.value}")
@@ -80,8 +112,8 @@ class WARPOptimizer:
         # 4. 补充配置到目标数量
         added_count = await self._ensure_target_config_count()
         
-        # 5. 最终健康检查
-        await self._check_all_configs_health()
+        # 5. 最终健康检查（只复查本轮新增的配置）
+        await self._check_dirty_configs()
         
         result = {
             "initial_configs": len(existing_configs),
@@ -103,18 +135,24 @@ class WARPOptimizer:
             return
         
         self._is_running = True
+        self._status_cache = None
         self._optimization_task = asyncio.create_task(self._optimization_loop())
         logger.info("WARP 优化循环已启动")
     
     async def stop_optimization_loop(self):
         """停止优化循环"""
         self._is_running = False
+        self._status_cache = None
         if self._optimization_task:
             self._optimization_task.cancel()
             try:
                 await self._optimization_task
             except asyncio.CancelledError:
                 pass
+
+        # 顺带收掉生成器的共享 API 会话
+        await self.warp_manager.generator.aclose()
+
         logger.info("WARP 优化循环已停止")
     
     async def _optimization_loop(self):
@@ -158,42 +196,59 @@ class WARPOptimizer:
             logger.warning("没有找到任何 WARP 配置")
             return
         
-        # 并发检查所有配置
-        tasks = []
-        for config_info in configs:
-            config_file = config_info.get('file_path', '')
-            if config_file:
-                task = asyncio.create_task(
-                    self._check_single_config_health(config_file)
-                )
-                tasks.append(task)
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # 更新健康配置列表
+        # 并发检查所有配置（信号量限流，单个检查在体内排队）
+        await asyncio.gather(
+            *(self._check_single_config_health(Path(config_info['file_path']))
+              for config_info in configs if config_info.get('file_path')),
+            return_exceptions=True
+        )
+
+        self._refresh_health_lists()
+
+        logger.info(f"健康检查完成: {len(self.healthy_configs)} 健康, "
+                   f"{len(self.unhealthy_configs)} 不健康")
+
+    def _refresh_health_lists(self):
+        """按状态表重建健康/不健康配置列表"""
         self.healthy_configs = [
             config_file for config_file, status in self.config_health_status.items()
             if status.get('is_healthy', False)
         ]
-        
-        self.unhealthy_configs = [
+
+        self.unhealthy_configs = {
             config_file for config_file, status in self.config_health_status.items()
             if not status.get('is_healthy', True)
-        ]
-        
-        logger.info(f"健康检查完成: {len(self.healthy_configs)} 健康, "
-                   f"{len(self.unhealthy_configs)} 不健康")
+        }
+
+    async def _check_dirty_configs(self):
+        """收尾健康检查：只复查本轮新增的脏配置，再刷新列表
+
+        清理和补充之后状态表里大部分条目刚检查过，
+        没必要为了几个新文件把整个目录再扫一遍。
+        """
+        if self._dirty:
+            await asyncio.gather(
+                *(self._check_single_config_health(config_file)
+                  for config_file in self._dirty),
+                return_exceptions=True
+            )
+            self._dirty.clear()
+
+        self._refresh_health_lists()
     
-    async def _check_single_config_health(self, config_file: str) -> bool:
+    async def _check_single_config_health(self, config_file: Path) -> bool:
         """检查单个配置的健康状态"""
-        config_name = Path(config_file).name
-        
+        async with self._health_sem:
+            return await self._do_check_single_config_health(config_file)
+
+    async def _do_check_single_config_health(self, config_file: Path) -> bool:
+        config_name = config_file.name
+
         try:
             # 模拟健康检查 (实际环境中需要真正的网络检查)
             # 这里我们基于文件存在性和格式正确性来判断
-            
-            if not Path(config_file).exists():
+
+            if not config_file.exists():
                 raise FileNotFoundError(f"配置文件不存在: {config_file}")
             
             # 验证配置文件格式
@@ -201,31 +256,42 @@ class WARPOptimizer:
             if not is_valid:
                 raise ValueError(f"配置文件格式无效: {config_file}")
             
-            # 在本地环境中，我们无法真正测试 WARP 连接
-            # 所以这里使用简化的健康判断逻辑
-            
-            # 模拟网络检查 (随机失败率，模拟真实环境)
-            import random
-            if random.random() < 0.1:  # 10% 的失败率
-                raise Exception("模拟网络连接失败")
-            
+            if self.config.mock_mode:
+                # 本地环境无法真正测试 WARP 连接：模拟网络检查
+                # (随机失败率，模拟真实环境)
+                if random.random() < 0.1:  # 10% 的失败率
+                    raise Exception("模拟网络连接失败")
+                response_time = random.uniform(0.5, 2.0)  # 模拟响应时间
+            else:
+                # 真实探测：经配置端点作为代理，对探测 URL 发 HEAD
+                response_time = await self._probe_config(config_file)
+
             # 更新健康状态
+            prev = self.config_health_status.get(config_file)
+            if prev is None or not prev.get('is_healthy', False):
+                self._status_cache = None
+            self._track_response_time(prev, response_time)
+
             self.config_health_status[config_file] = {
                 'is_healthy': True,
                 'last_check': time.time(),
                 'consecutive_failures': 0,
                 'last_error': None,
-                'response_time': random.uniform(0.5, 2.0)  # 模拟响应时间
+                'response_time': response_time
             }
-            
+
             logger.debug(f"配置健康: {config_name}")
             return True
-            
+
         except Exception as e:
             # 更新不健康状态
             current_status = self.config_health_status.get(config_file, {})
             consecutive_failures = current_status.get('consecutive_failures', 0) + 1
-            
+
+            if not current_status or current_status.get('is_healthy', False):
+                self._status_cache = None
+            self._track_response_time(current_status, None)
+
             self.config_health_status[config_file] = {
                 'is_healthy': False,
                 'last_check': time.time(),
@@ -237,6 +303,45 @@ class WARPOptimizer:
             logger.warning(f"配置不健康: {config_name}, 连续失败: {consecutive_failures}, 错误: {e}")
             return False
     
+    def _track_response_time(self, prev: Optional[Dict], new_rt: Optional[float]):
+        """维护响应时间的增量 (总和, 计数)：换出旧值、换入新值"""
+        old_rt = (prev or {}).get('response_time')
+        if old_rt is not None:
+            self._rt_sum -= old_rt
+            self._rt_count -= 1
+        if new_rt is not None:
+            self._rt_sum += new_rt
+            self._rt_count += 1
+
+    async def _probe_config(self, config_file: Path) -> float:
+        """对单个配置做端点连通性探测，返回连接耗时（秒）
+
+        WireGuard 端点不是代理，不能拿来中转 HTTP 请求；但 Cloudflare
+        的 WARP 端点在同一端口同时监听 TCP，TCP 握手成功说明端点可达，
+        连接耗时即近似 RTT。探测失败抛异常交由调用方记录。
+        """
+        info = self.warp_manager.generator.get_config_info(config_file)
+        endpoint = (info or {}).get('endpoint')
+        if not endpoint:
+            raise ValueError(f"配置缺少端点信息: {config_file}")
+
+        host, _, port = endpoint.rpartition(':')
+        if not host:
+            raise ValueError(f"端点格式无效: {endpoint}")
+
+        start = time.monotonic()
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, int(port)),
+            timeout=self.config.health_check_timeout
+        )
+        elapsed = time.monotonic() - start
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return elapsed
+
     async def _cleanup_unhealthy_configs(self) -> int:
         """清理不健康的配置"""
         if not self.unhealthy_configs:
@@ -247,33 +352,39 @@ class WARPOptimizer:
         backup_dir.mkdir(exist_ok=True)
         
         cleaned_count = 0
-        for config_file in self.unhealthy_configs.copy():
+        removed = set()
+        for config_file in self.unhealthy_configs:
             try:
                 config_status = self.config_health_status.get(config_file, {})
                 consecutive_failures = config_status.get('consecutive_failures', 0)
                 
                 # 只清理连续失败次数超过阈值的配置
                 if consecutive_failures >= self.config.failure_threshold:
-                    config_path = Path(config_file)
-                    config_name = config_path.name
-                    
-                    # 备份配置
-                    backup_path = backup_dir / f"{config_name}.{int(time.time())}.bak"
-                    if config_path.exists():
-                        config_path.rename(backup_path)
-                        logger.info(f"配置已备份: {config_name} -> {backup_path.name}")
-                    
-                    # 从状态中移除
-                    self.config_health_status.pop(config_file, None)
-                    self.unhealthy_configs.remove(config_file)
+                    config_name = config_file.name
+
+                    # 备份配置：改名排队后台线程，清理遍历不等待
+                    # 逐个 rename；状态移除（关键部分）保持同步。
+                    # 纳秒级时间戳避免同一秒清理多个配置时备份名冲突
+                    backup_path = backup_dir / f"{config_name}.{time.time_ns()}.bak"
+                    if config_file.exists():
+                        get_backup_writer().submit(config_file, backup_path)
+
+                    # 从状态中移除（连带换出其响应时间增量）
+                    popped = self.config_health_status.pop(config_file, None)
+                    self._track_response_time(popped, None)
+                    self._status_cache = None
+                    removed.add(config_file)
                     cleaned_count += 1
-                    
+
                     logger.info(f"清理不健康配置: {config_name} "
                                f"(连续失败 {consecutive_failures} 次)")
-                    
+
             except Exception as e:
                 logger.error(f"清理配置失败 {config_file}: {e}")
-        
+
+        # 循环结束后一次性差集移除
+        self.unhealthy_configs -= removed
+
         return cleaned_count
     
     async def _ensure_target_config_count(self) -> int:
@@ -303,10 +414,12 @@ class WARPOptimizer:
             new_configs = await self.warp_manager.generator.generate_multiple_configs(actual_add_count)
             
             # 保存新配置
-            saved_files = self.warp_manager.generator.save_configs_to_disk(new_configs)
+            saved_files = await self.warp_manager.generator.save_configs_to_disk(new_configs)
             
-            # 立即检查新配置的健康状态
-            for config_file in saved_files:
+            # 立即检查新配置的健康状态，并记入脏集合供收尾复查
+            new_paths = [Path(f) for f in saved_files]
+            self._dirty.update(new_paths)
+            for config_file in new_paths:
                 await self._check_single_config_health(config_file)
                 if self.config_health_status.get(config_file, {}).get('is_healthy', False):
                     self.healthy_configs.append(config_file)
@@ -338,18 +451,16 @@ class WARPOptimizer:
             logger.warning(f"⚠️ {status_msg} - 健康配置不足！")
     
     def get_optimization_status(self) -> Dict[str, Any]:
-        """获取优化状态"""
+        """获取优化状态（快照缓存，健康结论不变时直接返回）"""
+        if self._status_cache is not None:
+            return self._status_cache
+
         total_configs = len(self.healthy_configs) + len(self.unhealthy_configs)
-        
-        # 计算平均响应时间
-        response_times = [
-            status['response_time'] 
-            for status in self.config_health_status.values() 
-            if status.get('response_time') is not None
-        ]
-        avg_response_time = sum(response_times) / len(response_times) if response_times else 0
-        
-        return {
+
+        # 平均响应时间来自增量维护的 (总和, 计数)
+        avg_response_time = self._rt_sum / self._rt_count if self._rt_count > 0 else 0
+
+        self._status_cache = {
             "config_counts": {
                 "total": total_configs,
                 "healthy": len(self.healthy_configs),
@@ -372,7 +483,7 @@ class WARPOptimizer:
             },
             "config_details": [
                 {
-                    "file": Path(config_file).name,
+                    "file": config_file.name,
                     "is_healthy": status.get('is_healthy', False),
                     "consecutive_failures": status.get('consecutive_failures', 0),
                     "response_time": status.get('response_time'),
@@ -382,7 +493,8 @@ class WARPOptimizer:
             ],
             "recommendations": self._get_recommendations()
         }
-    
+        return self._status_cache
+
     def _get_recommendations(self) -> List[str]:
         """获取优化建议"""
         recommendations = []
@@ -416,8 +528,8 @@ class WARPOptimizer:
         # 补充配置
         added = await self._ensure_target_config_count()
         
-        # 再次健康检查
-        await self._check_all_configs_health()
+        # 再次健康检查（只复查本轮新增的配置）
+        await self._check_dirty_configs()
         
         result = {
             "cleaned_configs": cleaned,
@@ -0,0 +1,119 @@
+"""
+yt-dlp 专用线程池 + 解析结果 TTL 缓存
+
+extract_info 每次调用阻塞 1-3 秒（网络 + 签名解密），此前直接丢给
+asyncio 默认执行器：一是会和其他 to_thread 工作抢线程，二是同一个
+video_id 的连续请求重复支付完整解析成本。这里提供：
+
+- 有界专用线程池（大小由 YTDLP_WORKERS 控制）
+- (video_id, proxy) 维度的 TTL 缓存
+- 进行中请求去重：相同 key 的并发调用共享同一个 Future
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import yt_dlp
+
+from app.utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 专用线程池：解析请求排队而不是无限扩张线程
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.YTDLP_WORKERS,
+    thread_name_prefix="ytdlp"
+)
+
+# 缓存 TTL：YouTube 签名直链有效期数小时，5 分钟内复用足够安全
+_CACHE_TTL = 300.0
+_CACHE_MAX_ENTRIES = 256
+
+# key -> (过期时间 monotonic, 解析结果)
+_cache: "OrderedDict[Tuple[str, Optional[str], bool], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# key -> 进行中的解析 Future（相同视频的并发请求只解析一次）
+_inflight: Dict[Tuple[str, Optional[str], bool], "asyncio.Future[Dict[str, Any]]"] = {}
+
+
+# 线程本地的 YoutubeDL 实例缓存：构造器要初始化提取器注册表、
+# cookie jar 等，按选项集在每个工作线程内复用（线程数有界，缓存随之有界）
+_tls = threading.local()
+
+
+def _get_ydl(opts: Dict[str, Any]) -> yt_dlp.YoutubeDL:
+    """按选项集取线程本地缓存的 YoutubeDL 实例"""
+    cache = getattr(_tls, "ydl_cache", None)
+    if cache is None:
+        cache = _tls.ydl_cache = {}
+    key = tuple(sorted(opts.items()))
+    ydl = cache.get(key)
+    if ydl is None:
+        ydl = cache[key] = yt_dlp.YoutubeDL(opts)
+    return ydl
+
+
+def _run_extract(url: str, opts: Dict[str, Any], process: bool) -> Optional[Dict[str, Any]]:
+    """在工作线程中执行阻塞的 yt-dlp 解析"""
+    return _get_ydl(opts).extract_info(url, download=False, process=process)
+
+
+async def extract(video_id: str, opts: Dict[str, Any],
+                  proxy: Optional[str] = None,
+                  use_cache: bool = True,
+                  process: bool = True) -> Optional[Dict[str, Any]]:
+    """解析视频信息（带缓存与进行中去重）
+
+    key 按 (video_id, proxy, process) 区分：不同代理出口拿到的
+    直链绑定不同 IP，process=False 的结果未做签名解密，均不能互相复用。
+    """
+    key = (video_id, proxy, process)
+    now = time.monotonic()
+
+    if use_cache:
+        entry = _cache.get(key)
+        if entry and now < entry[0]:
+            _cache.move_to_end(key)
+            return entry[1]
+
+        inflight = _inflight.get(key)
+        if inflight is not None:
+            # 已有相同请求在解析中，直接等它的结果
+            return await asyncio.shield(inflight)
+
+    loop = asyncio.get_running_loop()
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    future: "asyncio.Future[Dict[str, Any]]" = loop.create_future()
+    if use_cache:
+        _inflight[key] = future
+
+    try:
+        info = await loop.run_in_executor(EXECUTOR, _run_extract, url, opts, process)
+        if not future.done():
+            future.set_result(info)
+    except Exception as e:
+        if not future.done():
+            future.set_exception(e)
+            # 等待者已经拿到异常，这里避免 "never retrieved" 告警
+            future.exception()
+        raise
+    finally:
+        if use_cache:
+            _inflight.pop(key, None)
+            # 发起方被取消时 CancelledError 不走上面的 except Exception，
+            # Future 会悬空——合流等待者在 shield 里永远等不到结果。
+            # 丢弃前必须让它出结果：取消掉，让等待者拿到 CancelledError
+            if not future.done():
+                future.cancel()
+
+    if use_cache and info:
+        _cache[key] = (time.monotonic() + _CACHE_TTL, info)
+        _cache.move_to_end(key)
+        while len(_cache) > _CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+    return info
@@ -7,8 +7,12 @@ echo "[RAILWAY] 🚀 启动 YTDLP FastAPI 服务..."
 # 使用 Railway 提供的 PORT 环境变量，默认 8000
 PORT=${PORT:-8000}
 
-echo "[RAILWAY] ✅ 使用端口: ${PORT}"
+# worker 数量：默认 1，多核实例可设置 WEB_CONCURRENCY=2*CPU
+# WARP 优化循环通过文件锁选主，多 worker 下只有一个进程执行配置生成
+WORKERS=${WEB_CONCURRENCY:-1}
+
+echo "[RAILWAY] ✅ 使用端口: ${PORT} (workers: ${WORKERS})"
 echo "[RAILWAY] 🚀 启动 uvicorn 服务器..."
 
 # Railway 兼容启动命令
-exec uvicorn app.main:app --host 0.0.0.0 --port ${PORT} --workers 1 --log-level info
+exec uvicorn app.main:app --host 0.0.0.0 --port ${PORT} --workers ${WORKERS} --loop uvloop --http httptools --log-level info
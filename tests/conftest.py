@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+pytest 共享配置
+"""
+import pytest
+from dotenv import load_dotenv
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _env():
+    """整个测试会话只加载一次 .env，避免每个模块导入时重复读盘"""
+    load_dotenv()
+    yield
@@ -2,16 +2,23 @@
 """
 基础功能测试
 """
+import atexit
 import requests
 import os
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
-load_dotenv()
+# .env 由 conftest.py 的会话级 fixture 统一加载，
+# 不在每个测试模块导入时重复读盘
+
+# 共享会话：两次请求复用同一条 TCP 连接，而不是各自重新握手
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
+atexit.register(SESSION.close)
 
 def test_health_check():
     """测试健康检查接口"""
     try:
-        response = requests.get("http://localhost:8000/healthz")
+        response = SESSION.get("http://localhost:8000/healthz")
         print(f"健康检查: {response.status_code}")
         if response.status_code == 200:
             print("✅ 服务运行正常")
@@ -25,7 +32,7 @@ def test_video_api():
     secret_key = os.getenv("SECRET_KEY", "test-secret-key-2024")
     
     try:
-        response = requests.get(
+        response = SESSION.get(
             "http://localhost:8000/v1/video/dQw4w9WgXcQ",
             headers={"X-Secret": secret_key}
         )
@@ -39,6 +46,10 @@ def test_video_api():
         print(f"❌ 请求失败: {e}")
 
 if __name__ == "__main__":
+    # 直接运行脚本时没有 pytest fixture，自己加载一次 .env
+    from dotenv import load_dotenv
+    load_dotenv()
+
     print("🧪 开始基础功能测试...")
     test_health_check()
     test_video_api()